@@ -1,24 +1,19 @@
-import os
+import time
+_import_started = time.perf_counter()
+
 import logging
 import streamlit as st
-from preprocessor import read_image, extract_image_from_id, save_image
-from OCR import extract_text
-from aadhar_postprocessor import extract_aadhaar_information
-from pan_postprocessor import extract_pan_information
-from validation import detect_and_extract_face, face_comparison, get_face_embeddings
-from dbms_operations import insert_records, fetch_records, check_duplicacy
+from pipeline import run_pipeline
+from dbms_operations import fetch_records
+from instrumentation import configure_logging
+from warm_up import start_background_warm_up, wait_until_ready, readiness
+from server import server_config, call_service, service_readiness
 
-# Configure logging
-logging_str = "[%(levelname)s]: %(message)s"
+configure_logging()
+logging.info(f"App modules imported in {time.perf_counter() - _import_started:.2f}s")
 
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(
-    filename=os.path.join(log_dir, "ekyc_logs.log"),
-    level=logging.INFO,
-    format=logging_str,
-    filemode="a"
-)
+# Base URL of the e-KYC HTTP service; when empty the pipeline runs inside the app
+api_url = server_config.get("api_url")
 
 def sidebar_section():
     """
@@ -46,73 +41,54 @@ def header_section(option):
         logging.info("Header set for Driving License")
 
 def main_content(image_file, face_image_file, option):
+    """
+    Run the e-KYC pipeline on the uploaded ID card and face image and show the outcome.
+    Streamlit reruns this on every widget interaction; the pipeline's result cache makes a rerun
+    with the same uploads skip contour detection, DeepFace and EasyOCR.
+    When `server.api_url` is set, the uploads are sent to the e-KYC HTTP service instead.
+    """
     if image_file is not None and face_image_file is not None:
-        face_image = read_image(face_image_file, is_uploaded=True)  
-        # Read face image
-        logging.info("Face image loaded.")
-
-        if face_image is not None:
-            image = read_image(image_file, is_uploaded=True)  
-            # Read ID card image
-            logging.info("ID card image loaded.")
-            
-            image_roi, _ = extract_image_from_id(image)  
-            # Extract ID card region of interest
-            logging.info("ID card ROI extracted.")
-            
-            face_image_path2 = detect_and_extract_face(img=image_roi)  
-            # Detect and extract face from ID card
-            face_image_path1 = save_image(face_image, "face_image.jpg", path="S:\\Machine Learning\\Siddharthan Playlist\\KYC Final\\Data\\faces")  # Save face image
-            logging.info("Faces extracted and saved.")
-            
-            is_face_verified = face_comparison(image1_path=face_image_path1, image2_path=face_image_path2)  
-            # Compare faces
-            logging.info(f"Face verification status: {'successful' if is_face_verified else 'failed'}.")
-
-            if is_face_verified:
-                extracted_text = extract_text(image_roi)  
-                
-                if option == "PAN":
-                    # Extract Aadhar information
-                    text_info = extract_pan_information(extracted_text)  
-                # elif option == "Aadhar":
-                #     # Extract PAN information
-                #     text_info = extract_pan_information(extracted_text)  
-                # else:
-                #     st.error("Unsupported ID card type.")
-                #     return
+        if api_url:
+            with st.spinner("Verifying..."):
+                result = call_service(api_url, image_file.getvalue(), face_image_file.getvalue(), option)
+        else:
+            if not readiness()["ready"]:
+                with st.spinner("Loading the OCR and face models..."):
+                    wait_until_ready()
+            result = run_pipeline(image_file.getvalue(), face_image_file.getvalue(), option)
+        status = result["status"]
+        text_info = result["fields"]
+        logging.info(f"Pipeline finished with status {status}; cached stages: {result.get('cache_hits')}")
 
-                logging.info("Text extracted and information parsed from ID card.")
-                
-                # Fetch records from the database
-                records = fetch_records(text_info)  
-                
-                if not records.empty and 'Name' in records.columns:
-                    st.write(f"{records['Name'].iloc[0]} Verified")
-                else:
-                    # st.error("Name not found in records.")
-                    pass 
-                    
-                # Check for duplicate records    
-                is_duplicate = check_duplicacy(text_info)  
-                if is_duplicate:
-                    st.write(f"User already present with ID {text_info['ID']}")
-                else:
-                    st.write(text_info)
-                    
-                    # Get face embeddings
-                    text_info['Embedding'] = get_face_embeddings(face_image_path1)  
-                    
-                    # Insert new record into the database
-                    insert_records(text_info)  
-                    logging.info(f"New user record inserted: {text_info['ID']}")
-                    
-            else:
-                st.error("Face verification failed. Please try again.")
-                
+        if status == "busy":
+            st.warning(result["error"])
+        elif status in ("low_quality", "unusable"):
+            st.error(result["error"])
+        elif status == "rejected":
+            st.error(f"The upload was not accepted: {result['error']}")
+        elif status == "face_mismatch":
+            st.error("Face verification failed. Please try again.")
+        elif status == "invalid_id":
+            st.error(f"Could not read a valid {text_info['ID Type']} number from the card. Please upload a clearer image.")
+        elif status == "duplicate":
+            # Fetch the enrolled record only to greet the user by name
+            records = fetch_records(text_info) if not api_url else []
+            if records:
+                st.write(f"{records[0]['name']} Verified")
+            st.write(f"User already present with ID {text_info['ID']}")
+        elif status == "face_duplicate":
+            st.error("This face is already registered with a different ID.")
+            logging.warning(f"Face of {text_info['ID']} matches enrolled ID {result['matched_id']}")
+        elif status == "enrolled":
+            st.write(text_info)
+            logging.info(f"New user record written: {text_info['ID']}")
+        elif status == "accepted":
+            st.write(text_info)
+            st.info("Your enrolment has been accepted and will be confirmed once it is recorded.")
+            logging.info(f"New user record queued: {text_info['ID']}")
         else:
-            st.error("Face image not uploaded. Please upload a face image.")
-            logging.error("No face image uploaded.")
+            st.error("The images could not be processed. Please upload clear images of the ID card and your face.")
+            logging.error(f"Pipeline error: {result['error']}")
             
     elif image_file is None:
         st.warning("Please upload an ID card image.")
@@ -125,8 +101,14 @@ def main():
     """
     Set up the Streamlit app, handle user inputs, and process the uploaded files.
     """
+    # Load the OCR and face models in the background while the page renders; later reruns reuse them
+    if not api_url:
+        start_background_warm_up()
+
     # Get the selected ID card type
     option = sidebar_section()  
+    status = service_readiness(api_url) if api_url else readiness()
+    st.sidebar.caption(" | ".join(f"{name}: {model['state']}" for name, model in status["models"].items()))
     header_section(option)
     
     image_file = st.file_uploader("Upload ID Card")
@@ -0,0 +1,183 @@
+"""
+Headless batch e-KYC runner.
+
+Usage:
+    python batch_ekyc.py manifest.csv --output results.jsonl --workers 4
+
+The manifest is a CSV file or a JSONL file (one object per line) with the columns `id_image`,
+`face_image` and `id_type` (PAN, Aadhar or Driving License), and an optional `key`. Every processed
+row is appended to the output file as one JSON line, so the output doubles as the checkpoint: running
+the same command again after a crash skips the rows that are already there.
+"""
+import os
+import csv
+import json
+import logging
+import argparse
+import multiprocessing
+import multiprocessing.util
+
+REQUIRED_COLUMNS = ("id_image", "face_image", "id_type")
+
+
+def read_manifest(manifest_path):
+    """
+    I read the manifest rows from a CSV or JSONL file.
+
+    :param manifest_path: Path to the manifest. Files ending in .jsonl or .json are read as JSON lines,
+                          anything else as CSV with a header row.
+    :return: List of dictionaries, each with a unique "key".
+    """
+    if manifest_path.endswith((".jsonl", ".json")):
+        with open(manifest_path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(manifest_path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+
+    for number, row in enumerate(rows, start=1):
+        missing = [column for column in REQUIRED_COLUMNS if not row.get(column)]
+        if missing:
+            raise ValueError(f"Manifest row {number} is missing {', '.join(missing)}")
+        row.setdefault("key", f"{row['id_image']}|{row['face_image']}")
+    return rows
+
+
+def read_checkpoint(output_path, retry_failed=False):
+    """
+    I collect the keys already written to the results file.
+
+    Lines cut short by a crash are ignored, so those rows are processed again.
+
+    :param output_path: Path to the JSONL results file.
+    :param retry_failed: Whether rows that ended with status "error" should be processed again.
+    :return: Set of completed keys.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if retry_failed and record.get("status") == "error":
+                continue
+            done.add(record["key"])
+    return done
+
+
+def _init_worker(warm_up):
+    """
+    I load the models once per worker process, so every row handled by the worker reuses them.
+    """
+    global run_pipeline
+    import preprocessor
+    from instrumentation import configure_logging
+    configure_logging()
+    from pipeline import run_pipeline
+
+    # When debug saving is on, give each worker its own folder so intermediate images do not collide
+    preprocessor.intermediate_dir_path = os.path.join(preprocessor.intermediate_dir_path, f"worker-{os.getpid()}")
+    if warm_up:
+        from ocr import warm_up_readers
+        warm_up_readers()
+    from enrollment_queue import stop_enrollment_queue
+    # Runs when the worker exits after `pool.close()`, so its enrolment writer finishes or hands back its batch
+    multiprocessing.util.Finalize(None, stop_enrollment_queue, kwargs={"drain": False}, exitpriority=10)
+    logging.info(f"Batch worker {os.getpid()} ready")
+
+
+def _process_row(task):
+    """
+    I run the pipeline for one manifest row inside a worker process.
+    """
+    row, persist = task
+    result = run_pipeline(row["id_image"], row["face_image"], row["id_type"], persist=persist)
+    result.update({
+        "key": row["key"],
+        "id_image": row["id_image"],
+        "face_image": row["face_image"],
+        "id_type": row["id_type"],
+        "worker": os.getpid(),
+    })
+    return result
+
+
+def run_batch(manifest_path, output_path, workers=None, persist=True, retry_failed=False, warm_up=True):
+    """
+    I process every manifest row not yet in the results file across a pool of worker processes.
+
+    Results are appended and flushed as soon as each row finishes, in completion order.
+
+    :param manifest_path: Path to the CSV or JSONL manifest.
+    :param output_path: Path to the JSONL results file, which is also the checkpoint.
+    :param workers: Number of worker processes. Defaults to the number of CPUs.
+    :param persist: Whether to run the duplicate check and insert records into the database.
+    :param retry_failed: Whether to process rows that previously ended with an error again.
+    :param warm_up: Whether each worker loads the OCR model before taking rows.
+    :return: Dictionary counting the rows per status, plus "skipped" for rows already done.
+    """
+    rows = read_manifest(manifest_path)
+    done = read_checkpoint(output_path, retry_failed=retry_failed)
+    pending = [row for row in rows if row["key"] not in done]
+    summary = {"skipped": len(rows) - len(pending)}
+    logging.info(f"Batch run: {len(pending)} rows pending, {summary['skipped']} already done")
+
+    if not pending:
+        return summary
+
+    # Make sure a line cut short by a crash does not swallow the first new record
+    needs_newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    workers = workers or os.cpu_count() or 1
+    with open(output_path, "a", encoding="utf-8") as out, \
+            multiprocessing.Pool(processes=workers, initializer=_init_worker, initargs=(warm_up,)) as pool:
+        if needs_newline:
+            out.write("\n")
+        tasks = ((row, persist) for row in pending)
+        for result in pool.imap_unordered(_process_row, tasks):
+            out.write(json.dumps(result, default=str) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            summary[result["status"]] = summary.get(result["status"], 0) + 1
+        # Let the workers exit on their own rather than be terminated, so no writer dies holding a claimed batch
+        pool.close()
+        pool.join()
+
+    if persist:
+        from enrollment_queue import get_enrollment_queue, queue_config
+        if queue_config["enabled"]:
+            # Write what the workers' queue writers had not reached yet
+            summary["enrollment_queue"] = get_enrollment_queue(start=False).drain()["counts"]
+
+    logging.info(f"Batch run finished: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the e-KYC pipeline over a manifest of ID card and selfie pairs.")
+    parser.add_argument("manifest", help="CSV or JSONL file with id_image, face_image and id_type columns")
+    parser.add_argument("--output", default="ekyc_results.jsonl", help="JSONL results file, also used as the checkpoint")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--no-db", action="store_true", help="skip the duplicate check and database insert")
+    parser.add_argument("--retry-failed", action="store_true", help="process rows that previously ended with an error again")
+    parser.add_argument("--no-warm-up", action="store_true", help="do not load the OCR model before taking rows")
+    args = parser.parse_args()
+
+    from instrumentation import configure_logging
+    configure_logging()
+
+    summary = run_batch(args.manifest, args.output, workers=args.workers, persist=not args.no_db,
+                        retry_failed=args.retry_failed, warm_up=not args.no_warm_up)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
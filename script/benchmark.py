@@ -0,0 +1,444 @@
+"""
+Reproducible benchmark for the e-KYC pipeline.
+
+Usage:
+    python benchmark.py --cases 10 --resolutions 800 1600 3200 --output benchmark.json
+    python benchmark.py --baseline benchmark_before.json --output benchmark_after.json
+    python benchmark.py --generate-only ../Data/synthetic --cases 20
+
+I render synthetic PAN, Aadhaar and driving licence cards with known field values and an embedded face photo,
+at several image resolutions, and run every card through `pipeline.run_pipeline` against a throwaway SQLite
+database and face index. The results file records throughput, p50/p95/p99 latency and peak memory per stage,
+field-extraction accuracy per card type and the environment of the run, so two runs can be compared with
+`--baseline`.
+
+With a single photo in the face folder every enrolment after the first is reported as "face_duplicate"; add
+more photos to `--faces` to exercise the insert path as well.
+
+`--generate-only` writes the cards and a manifest for `batch_ekyc.py` instead of running the pipeline.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import date
+import cv2
+import numpy as np
+from utilities import get_config
+from id_extraction import verhoeff_is_valid
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+DEFAULT_FACE_DIRECTORY = os.path.join("..", "Data", "Faces")
+DEFAULT_RESOLUTIONS = (800, 1600, 3200)
+DOCUMENT_OPTIONS = ("PAN", "Aadhar", "Driving License")
+
+# ID-1 card format (85.60 x 53.98 mm) shared by all three cards
+CARD_ASPECT_RATIO = 85.60 / 53.98
+
+_FIRST_NAMES = ("RAHUL", "PRIYA", "AMIT", "SNEHA", "VIKRAM", "ANJALI", "ARJUN", "DEEPA", "KARAN", "MEERA",
+                "ROHAN", "KAVYA", "SURESH", "LAKSHMI", "NIKHIL", "POOJA")
+_LAST_NAMES = ("SHARMA", "PATEL", "IYER", "REDDY", "SINGH", "GUPTA", "NAIR", "KUMAR", "MEHTA", "JOSHI",
+               "DAS", "RAO", "VERMA", "KAPOOR")
+_DL_STATES = ("MH", "KA", "TN", "DL", "GJ", "UP", "WB", "RJ", "KL", "TS")
+_LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _random_name(rng):
+    return f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}"
+
+
+def _random_date(rng, first_year, last_year):
+    return date(rng.randint(first_year, last_year), rng.randint(1, 12), rng.randint(1, 28))
+
+
+def random_pan(rng):
+    """
+    I generate a well-formed PAN for an individual holder: three letters, "P", the surname initial, four digits
+    and a letter.
+    """
+    return "".join(rng.choice(_LETTERS) for _ in range(3)) + "P" + rng.choice(_LETTERS) + \
+        f"{rng.randint(1, 9999):04d}" + rng.choice(_LETTERS)
+
+
+def random_aadhaar(rng):
+    """
+    I generate an Aadhaar number that passes the Verhoeff check: eleven random digits (not starting with 0 or 1)
+    followed by the matching check digit.
+    """
+    prefix = str(rng.randint(2, 9)) + "".join(str(rng.randint(0, 9)) for _ in range(10))
+    return next(prefix + str(digit) for digit in range(10) if verhoeff_is_valid(prefix + str(digit)))
+
+
+def random_driving_licence(rng):
+    """
+    I generate a driving licence number: state code, RTO code, year of issue and a seven-digit serial.
+    """
+    return f"{rng.choice(_DL_STATES)}{rng.randint(1, 99):02d}{rng.randint(1990, date.today().year)}" \
+           f"{rng.randint(1, 9999999):07d}"
+
+
+def random_fields(option, rng):
+    """
+    I generate the ground truth of one card: the fields the pipeline should extract plus what is printed around them.
+
+    :param option: Card type, one of `DOCUMENT_OPTIONS`.
+    :param rng: `random.Random` instance, so the same seed gives the same cards.
+    :return: Dictionary with "ID" and "Name" (the expected extraction) and the other printed values.
+    """
+    fields = {"Name": _random_name(rng), "Father": _random_name(rng),
+              "DOB": _random_date(rng, 1950, 2005).strftime("%d/%m/%Y")}
+    if option == "PAN":
+        fields["ID"] = random_pan(rng)
+    elif option == "Aadhar":
+        fields["ID"] = random_aadhaar(rng)
+        fields["Gender"] = rng.choice(("MALE", "FEMALE"))
+    elif option == "Driving License":
+        fields["ID"] = random_driving_licence(rng)
+        fields["Valid"] = _random_date(rng, date.today().year + 1, date.today().year + 20).strftime("%d/%m/%Y")
+    else:
+        raise ValueError(f"Unsupported ID card type: {option}")
+    return fields
+
+
+def _card_lines(option, fields):
+    """
+    I lay out the printed lines of a card as (text, x, y, scale) in card-relative units.
+    """
+    if option == "PAN":
+        return [
+            ("INCOME TAX DEPARTMENT", 0.05, 0.12, 1.0), ("GOVT. OF INDIA", 0.62, 0.12, 1.0),
+            ("Permanent Account Number Card", 0.30, 0.25, 0.9), (fields["ID"], 0.36, 0.36, 1.3),
+            ("Name", 0.36, 0.48, 0.7), (fields["Name"], 0.36, 0.56, 1.0),
+            ("Father's Name", 0.36, 0.66, 0.7), (fields["Father"], 0.36, 0.74, 1.0),
+            ("Date of Birth", 0.36, 0.84, 0.7), (fields["DOB"], 0.36, 0.92, 1.0),
+        ]
+    if option == "Aadhar":
+        number = fields["ID"]
+        return [
+            ("Government of India", 0.30, 0.12, 1.1),
+            (fields["Name"], 0.36, 0.34, 1.0), (f"DOB: {fields['DOB']}", 0.36, 0.46, 0.9),
+            (fields["Gender"], 0.36, 0.58, 0.9),
+            (f"{number[:4]} {number[4:8]} {number[8:]}", 0.30, 0.86, 1.5),
+        ]
+    number = fields["ID"]
+    return [
+        ("Union of India", 0.05, 0.10, 0.8), ("DRIVING LICENCE", 0.50, 0.10, 1.1),
+        (f"DL No: {number[:4]} {number[4:]}", 0.36, 0.28, 1.0),
+        ("Name", 0.36, 0.40, 0.7), (fields["Name"], 0.36, 0.48, 1.0),
+        (f"S/D/W of {fields['Father']}", 0.36, 0.60, 0.8),
+        (f"DOB: {fields['DOB']}", 0.36, 0.72, 0.8), (f"Valid Till: {fields['Valid']}", 0.36, 0.84, 0.8),
+    ]
+
+
+def render_card(option, fields, face, width, np_rng=None):
+    """
+    I render a synthetic ID card on a dark background, the way a phone photo of a card on a table looks.
+
+    :param option: Card type, one of `DOCUMENT_OPTIONS`.
+    :param fields: Ground truth from `random_fields`.
+    :param face: BGR face photo to print on the card.
+    :param width: Width in pixels of the whole image; the card takes 80% of it.
+    :param np_rng: Optional `numpy.random.Generator` for sensor noise; no noise when None.
+    :return: BGR image as a numpy array.
+    """
+    height = int(width * 0.75)
+    card_w = int(width * 0.8)
+    card_h = int(card_w / CARD_ASPECT_RATIO)
+    canvas = np.full((height, width, 3), 45, np.uint8)
+    card = np.full((card_h, card_w, 3), (232, 236, 238), np.uint8)
+    cv2.rectangle(card, (0, 0), (card_w, int(card_h * 0.18)), (200, 170, 120), -1)
+
+    # Photo on the left, below the header band
+    photo_h = int(card_h * 0.62)
+    photo_w = int(photo_h * 0.78)
+    photo_x, photo_y = int(card_w * 0.04), int(card_h * 0.28)
+    card[photo_y:photo_y + photo_h, photo_x:photo_x + photo_w] = cv2.resize(face, (photo_w, photo_h),
+                                                                          interpolation=cv2.INTER_AREA)
+
+    # Text sized so a line of the base scale is about 5% of the card height
+    base_scale = card_h / 600.0
+    thickness = max(1, int(round(card_h / 250)))
+    for text, x, y, scale in _card_lines(option, fields):
+        cv2.putText(card, text, (int(x * card_w), int(y * card_h)), cv2.FONT_HERSHEY_DUPLEX,
+                    base_scale * scale, (20, 20, 20), thickness, cv2.LINE_AA)
+
+    top, left = (height - card_h) // 2, (width - card_w) // 2
+    canvas[top:top + card_h, left:left + card_w] = card
+    if np_rng is not None:
+        noise = np_rng.normal(0, 4, canvas.shape)
+        canvas = np.clip(canvas + noise, 0, 255).astype(np.uint8)
+    return canvas
+
+
+def load_faces(face_directory=DEFAULT_FACE_DIRECTORY):
+    """
+    I load the face photos used for the card photo and the selfie.
+
+    :param face_directory: Folder of face images.
+    :return: List of (name, BGR image) pairs.
+    """
+    faces = []
+    for name in sorted(os.listdir(face_directory)):
+        image = cv2.imread(os.path.join(face_directory, name))
+        if image is not None:
+            faces.append((name, image))
+    if not faces:
+        raise ValueError(f"No readable face images in {face_directory}")
+    return faces
+
+
+def generate_cases(cases_per_type, resolutions, faces, seed=0, noise=True):
+    """
+    I generate the benchmark cases: every card type at every resolution, `cases_per_type` times.
+
+    The same seed always gives the same cards, so runs on different commits see identical inputs.
+
+    :return: List of dictionaries with "option", "resolution", "fields", "id_image" and "face_image"
+             (JPEG bytes) and "face" (name of the face photo used).
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    cases = []
+    for resolution in resolutions:
+        for option in DOCUMENT_OPTIONS:
+            for _ in range(cases_per_type):
+                face_name, face = faces[rng.randrange(len(faces))]
+                fields = random_fields(option, rng)
+                card = render_card(option, fields, face, resolution, np_rng if noise else None)
+                cases.append({
+                    "option": option,
+                    "resolution": resolution,
+                    "fields": fields,
+                    "face": face_name,
+                    "id_image": cv2.imencode(".jpg", card, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes(),
+                    "face_image": cv2.imencode(".jpg", face, [cv2.IMWRITE_JPEG_QUALITY, 92])[1].tobytes(),
+                })
+    return cases
+
+
+def write_cases(cases, directory):
+    """
+    I write the generated cards, selfies and a `batch_ekyc.py` manifest with the ground truth to a folder.
+
+    :return: Path of the manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, "manifest.csv")
+    with open(manifest_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["key", "id_image", "face_image", "id_type", "expected_id",
+                                               "expected_name", "resolution"])
+        writer.writeheader()
+        for number, case in enumerate(cases):
+            key = f"case-{number:05d}"
+            id_path = os.path.join(directory, f"{key}-card.jpg")
+            face_path = os.path.join(directory, f"{key}-selfie.jpg")
+            with open(id_path, "wb") as image_file:
+                image_file.write(case["id_image"])
+            with open(face_path, "wb") as image_file:
+                image_file.write(case["face_image"])
+            writer.writerow({"key": key, "id_image": id_path, "face_image": face_path, "id_type": case["option"],
+                             "expected_id": case["fields"]["ID"], "expected_name": case["fields"]["Name"],
+                             "resolution": case["resolution"]})
+    return manifest_path
+
+
+def _normalise(value):
+    return " ".join(str(value or "").upper().split())
+
+
+def _percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+
+def _peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        from instrumentation import current_rss_bytes
+        return current_rss_bytes()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+    }
+
+
+def _use_local_stand_ins(directory):
+    """
+    I point the database and the enrolment queue at fresh SQLite files and the face index at a snapshot path
+    in `directory`, so a benchmark never touches the real enrolment data.
+    """
+    import face_index
+    import enrollment_queue
+    from dbms_operations import configure_database
+
+    configure_database(backend="sqlite", sqlite_path=os.path.join(directory, "benchmark.sqlite3"))
+    enrollment_queue.queue_config["path"] = os.path.join(directory, "enrollment_queue.sqlite3")
+    enrollment_queue._queue = None
+    face_index.face_index_path = os.path.join(directory, "face_index.npz")
+    face_index._face_index = None
+
+
+def run_benchmark(cases, persist=True, use_cache=False, mode=None, warm_up=2):
+    """
+    I run every case through the pipeline and summarise speed, memory and accuracy.
+
+    :param cases: Cases from `generate_cases`.
+    :param persist: Whether to include the duplicate check, face index and insert (on local stand-ins).
+    :param use_cache: Whether the result cache may serve repeated inputs. Off by default so every case
+                      runs the models.
+    :param mode: Orchestrator mode, or None for the configured one.
+    :param warm_up: Number of leading cases run once before measuring, to load the models.
+    :return: Dictionary ready to be written as JSON.
+    """
+    from ocr import warm_up_readers
+    from pipeline import run_pipeline
+    from instrumentation import metrics
+
+    warm_up_readers()
+    for case in cases[:warm_up]:
+        run_pipeline(case["id_image"], case["face_image"], case["option"], persist=False, use_cache=False, mode=mode)
+    metrics.reset()
+
+    stage_timings = {}
+    statuses = {}
+    accuracy = {}
+    by_resolution = {}
+    started = time.perf_counter()
+
+    for number, case in enumerate(cases):
+        result = run_pipeline(case["id_image"], case["face_image"], case["option"], persist=persist,
+                              use_cache=use_cache, mode=mode)
+        statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+        for stage, seconds in result["timings"].items():
+            stage_timings.setdefault(stage, []).append(seconds)
+        by_resolution.setdefault(str(case["resolution"]), []).append(result["timings"]["total"])
+
+        fields = result["fields"] or {}
+        counts = accuracy.setdefault(case["option"], {"cases": 0, "id_correct": 0, "name_correct": 0, "valid": 0})
+        counts["cases"] += 1
+        counts["id_correct"] += _normalise(fields.get("ID")) == _normalise(case["fields"]["ID"])
+        counts["name_correct"] += _normalise(fields.get("Name")) == _normalise(case["fields"]["Name"])
+        counts["valid"] += bool(fields.get("Valid"))
+        logging.info(f"Benchmark case {number + 1}/{len(cases)}: {result['status']} "
+                     f"in {result['timings']['total']:.3f}s")
+
+    elapsed = time.perf_counter() - started
+    for counts in accuracy.values():
+        for field in ("id", "name"):
+            counts[f"{field}_accuracy"] = counts[f"{field}_correct"] / counts["cases"]
+
+    snapshot = metrics.snapshot()["stages"]
+    return {
+        "throughput": {"cases": len(cases), "seconds": elapsed,
+                       "cases_per_second": len(cases) / elapsed if elapsed else 0.0},
+        "latency": {stage: _percentiles(values) for stage, values in sorted(stage_timings.items())},
+        "latency_by_resolution": {resolution: _percentiles(values) for resolution, values in by_resolution.items()},
+        "memory": {
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "stages": {stage: {"peak_rss_bytes": entry["peak_rss_bytes"],
+                               "max_rss_growth_bytes": entry["max_rss_growth_bytes"]}
+                       for stage, entry in sorted(snapshot.items())},
+        },
+        "accuracy": accuracy,
+        "statuses": statuses,
+    }
+
+
+def compare_runs(baseline, current):
+    """
+    I compare two benchmark results and return the relative change of throughput and stage latencies.
+
+    Negative latency changes and positive throughput changes are improvements.
+
+    :return: Dictionary of metric name to (baseline, current, relative change).
+    """
+    def change(old, new):
+        return (old, new, (new - old) / old if old else None)
+
+    comparison = {"cases_per_second": change(baseline["throughput"]["cases_per_second"],
+                                             current["throughput"]["cases_per_second"])}
+    for stage, latency in current["latency"].items():
+        if stage in baseline["latency"]:
+            for key in ("p50", "p95", "p99"):
+                comparison[f"{stage}.{key}"] = change(baseline["latency"][stage][key], latency[key])
+    comparison["peak_rss_bytes"] = change(baseline["memory"]["peak_rss_bytes"], current["memory"]["peak_rss_bytes"])
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the e-KYC pipeline on synthetic ID cards.")
+    parser.add_argument("--cases", type=int, default=5, help="cards per card type and resolution")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=list(DEFAULT_RESOLUTIONS),
+                        help="image widths in pixels")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the card generator")
+    parser.add_argument("--faces", default=DEFAULT_FACE_DIRECTORY, help="folder of face photos")
+    parser.add_argument("--output", default="benchmark.json", help="JSON results file")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--mode", choices=("sequential", "speculative", "eager_cancel"), help="orchestrator mode")
+    parser.add_argument("--no-db", action="store_true", help="skip the duplicate check, face index and insert")
+    parser.add_argument("--cache", action="store_true", help="let the result cache serve repeated inputs")
+    parser.add_argument("--warm-up", type=int, default=2, help="cases run before measuring")
+    parser.add_argument("--no-noise", action="store_true", help="render cards without sensor noise")
+    parser.add_argument("--generate-only", metavar="DIRECTORY",
+                        help="write the cards and a batch manifest to DIRECTORY instead of benchmarking")
+    args = parser.parse_args()
+
+    from instrumentation import configure_logging
+    configure_logging()
+
+    cases = generate_cases(args.cases, args.resolutions, load_faces(args.faces), seed=args.seed,
+                           noise=not args.no_noise)
+    if args.generate_only:
+        print(write_cases(cases, args.generate_only))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="ekyc-benchmark-") as directory:
+        _use_local_stand_ins(directory)
+        results = run_benchmark(cases, persist=not args.no_db, use_cache=args.cache, mode=args.mode,
+                                warm_up=args.warm_up)
+
+    results["run"] = dict(_environment(), started_at=time.strftime("%Y-%m-%dT%H:%M:%S"), arguments=vars(args),
+                          orchestrator=config.get("orchestrator", {}), preprocessing=config.get("preprocessing", {}))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            results["comparison"] = compare_runs(json.load(f), results)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({"throughput": results["throughput"], "accuracy": results["accuracy"],
+                      "statuses": results["statuses"]}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,591 @@
-import mysql.connector
-import pandas as pd
+import time
+import queue
+import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
+from utilities import get_config
+from face_index import embedding_to_blob, blob_to_embedding
+from instrumentation import instrumented, log_sampled
+import schema
 
-mydb = mysql.connector.connect(
-    host="localhost",
-    user="root",
-    password="",
-    database="ekyc"
-)
-mycursor = mydb.cursor()
-print("Connection Established")
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
 
+db_config = {
+    "backend": "mysql",
+    "host": "localhost",
+    "port": 3306,
+    "user": "root",
+    "password": "",
+    "database": "ekyc",
+    "sqlite_path": "ekyc.sqlite3",
+    "pool_size": 5,
+    "pool_timeout": 30,
+    "health_check_interval": 30,
+    "auto_migrate": True,
+    "audit": True,
+}
+db_config.update(config.get("database", {}))
 
+# Stage audit rows waiting for the background audit writer; new rows are dropped while it is full
+_AUDIT_QUEUE_SIZE = 10000
+
+
+class ConnectionPool:
+    """
+    I hand out database connections from a fixed-size pool.
+
+    Connections are opened lazily, the first time they are needed, so importing this module never touches
+    the database. A connection that has been idle for longer than `health_check_interval` seconds is
+    checked before it is handed out, and replaced if the check fails.
+    """
+
+    def __init__(self, connect, health_check, size=5, timeout=30, health_check_interval=30):
+        self._connect = connect
+        self._health_check = health_check
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        I return a healthy connection, opening a new one while the pool is below its size.
+
+        :return: A connection, to be given back with `release` or `discard`.
+        """
+        try:
+            connection, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                return self._open()
+            try:
+                connection, last_used = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No database connection became free within {self.timeout} seconds")
+
+        if time.monotonic() - last_used > self.health_check_interval:
+            try:
+                self._health_check(connection)
+            except Exception as e:
+                logging.warning(f"Database connection failed its health check, reconnecting: {e}")
+                self.discard(connection)
+                with self._lock:
+                    self._created += 1
+                return self._open()
+        return connection
+
+    def _open(self):
+        """
+        I open a new connection, giving its slot back if connecting fails.
+        """
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, connection):
+        """
+        I put a connection back into the pool.
+        """
+        self._idle.put((connection, time.monotonic()))
+
+    def discard(self, connection):
+        """
+        I close a broken connection and free its slot in the pool.
+        """
+        with self._lock:
+            self._created -= 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        I close every idle connection.
+        """
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(connection)
+
+
+def _connect_mysql():
+    import mysql.connector
+    connection = mysql.connector.connect(
+        host=db_config["host"],
+        port=db_config["port"],
+        user=db_config["user"],
+        password=db_config["password"],
+        database=db_config["database"]
+    )
+    logging.info(f"MySQL connection established to {db_config['host']}/{db_config['database']}")
+    return connection
+
+
+def _check_mysql(connection):
+    connection.ping(reconnect=True, attempts=3, delay=1)
+
+
+def _connect_sqlite():
+    connection = sqlite3.connect(db_config["sqlite_path"], check_same_thread=False)
+    logging.info(f"SQLite connection established to {db_config['sqlite_path']}")
+    return connection
+
+
+def _check_sqlite(connection):
+    connection.execute("SELECT 1")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def _get_pool():
+    """
+    I create the connection pool for the configured backend on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if db_config["backend"] == "sqlite":
+                # Every connection to ":memory:" would be a separate database, so share a single one
+                size = 1 if db_config["sqlite_path"] == ":memory:" else db_config["pool_size"]
+                connect, health_check = _connect_sqlite, _check_sqlite
+            elif db_config["backend"] == "mysql":
+                size = db_config["pool_size"]
+                connect, health_check = _connect_mysql, _check_mysql
+            else:
+                raise ValueError(f"Unsupported database backend: {db_config['backend']}")
+            _pool = ConnectionPool(connect, health_check, size=size, timeout=db_config["pool_timeout"],
+                                   health_check_interval=db_config["health_check_interval"])
+        return _pool
+
+
+def configure_database(**settings):
+    """
+    I change the database settings at runtime, for example to switch to the SQLite backend for local runs.
+
+    Any existing pool is closed, so the next call connects with the new settings.
+
+    :param settings: Keys of the `database` configuration section, such as backend="sqlite" and sqlite_path.
+    """
+    global _pool, _schema_ready
+    with _pool_lock:
+        db_config.update(settings)
+        _schema_ready = False
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def _is_connection_error(error):
+    """
+    I tell whether an error means the connection itself is broken and worth one retry on a new connection.
+    """
+    if isinstance(error, ConnectionError):
+        return True
+    try:
+        from mysql.connector import errors
+    except ImportError:
+        return False
+    # 2006: server has gone away, 2013: lost connection during query, 2055: lost connection at handshake
+    return isinstance(error, errors.InterfaceError) or getattr(error, "errno", None) in (2006, 2013, 2055)
+
+
+def _is_integrity_error(error):
+    """
+    I tell whether an error is a constraint violation, such as a second row for a unique (id_type, id).
+    """
+    if isinstance(error, sqlite3.IntegrityError):
+        return True
+    try:
+        from mysql.connector import errors
+    except ImportError:
+        return False
+    return isinstance(error, errors.IntegrityError)
+
+
+def ensure_schema():
+    """
+    I apply pending schema migrations (see `schema.py`) once per process and database, before the first query.
+    Nothing is checked when `auto_migrate` is off, for databases whose schema is managed by hand.
+    """
+    global _schema_ready
+    if _schema_ready or not db_config["auto_migrate"]:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            with _pooled_cursor(commit=True) as cursor:
+                schema.migrate(cursor, db_config["backend"])
+            _schema_ready = True
+
+
+@contextmanager
+def get_cursor(commit=False):
+    """
+    I lend a fresh cursor on a pooled connection for the duration of a `with` block.
+
+    The transaction is committed when `commit` is True and the block succeeds, and rolled back otherwise.
+    Queries use the `%s` placeholder on every backend. The schema is brought up to date first.
+
+    :param commit: Whether to commit the transaction at the end of the block.
+    """
+    ensure_schema()
+    with _pooled_cursor(commit=commit) as cursor:
+        yield cursor
+
+
+@contextmanager
+def _pooled_cursor(commit=False):
+    pool = _get_pool()
+    connection = pool.acquire()
+    cursor = connection.cursor()
+    if db_config["backend"] == "sqlite":
+        cursor = _SQLiteCursor(cursor)
+    try:
+        yield cursor
+        if commit:
+            connection.commit()
+    except Exception as e:
+        try:
+            cursor.close()
+            connection.rollback()
+        except Exception:
+            pass
+        if _is_connection_error(e):
+            pool.discard(connection)
+        else:
+            pool.release(connection)
+        raise
+    else:
+        cursor.close()
+        pool.release(connection)
+
+
+class _SQLiteCursor:
+    """
+    I wrap an sqlite3 cursor so queries written with `%s` placeholders run unchanged.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(sql.replace("%s", "?"), params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._cursor.executemany(sql.replace("%s", "?"), seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def _execute(sql, params=(), fetch=False, commit=False, many=False):
+    """
+    I run one statement on a pooled connection, retrying once on a new connection if the old one dropped.
+
+    :param many: Whether `params` is a sequence of parameter tuples to run with `executemany` in one transaction.
+    :return: A tuple (rows, column_names) when `fetch` is True, otherwise the affected row count.
+    """
+    for attempt in range(2):
+        try:
+            with get_cursor(commit=commit) as cursor:
+                if many:
+                    cursor.executemany(sql, params)
+                else:
+                    cursor.execute(sql, params)
+                if fetch:
+                    return cursor.fetchall(), [desc[0] for desc in cursor.description or ()]
+                return cursor.rowcount
+        except Exception as e:
+            if attempt == 0 and _is_connection_error(e):
+                logging.warning(f"Database connection lost, retrying on a new connection: {e}")
+                continue
+            raise
+
+
+def _record_values(text_info):
+    """
+    I turn an extracted `text_info` dictionary into the column values of a `user_info` row.
+    """
+    return (
+        text_info['ID'],
+        text_info['Name'],
+        text_info['ID Type'],
+        embedding_to_blob(text_info.get('Embedding'))
+    )
+
+
+def _from_dual():
+    """
+    I return the FROM clause MySQL needs for a SELECT without a table; SQLite needs none.
+    """
+    return " FROM DUAL" if db_config["backend"] == "mysql" else ""
+
+
+@instrumented("db.insert_records")
 def insert_records(text_info):
     """
     I insert a new record into the `user_info` table in the database.
-    I use the `INSERT INTO` SQL statement to add a record with `id`, `name`, and `id_type` fields.
-    I pass the values from the `text_info` dictionary into the SQL query.
-    After executing the query, I commit the transaction to save the changes.
+    I use the `INSERT INTO` SQL statement to add a record with `id`, `name`, `id_type` and `embedding` fields.
+    I pass the values from the `text_info` dictionary into the SQL query, storing the face embedding as float32 bytes.
+    The statement runs on its own pooled connection and is committed before the connection goes back to the pool.
     I log a message indicating that the record for the specified ID has been inserted successfully.
-    """    
+    """
 
     sql = """
-    INSERT INTO user_info(id, name, id_type) 
-    VALUES (%s, %s, %s)
+    INSERT INTO user_info(id, name, id_type, embedding)
+    VALUES (%s, %s, %s, %s)
+    """
+    _execute(sql, _record_values(text_info), commit=True)
+    logging.info("Record for %s inserted successfully", text_info['ID'])
+
+
+@instrumented("db.insert_records_many")
+def insert_records_many(text_infos):
+    """
+    I insert many records into the `user_info` table with a single `executemany` call.
+    All rows are written in one transaction, so either the whole batch is committed or none of it is.
+    I return the number of records inserted.
     """
-    value = (
-        text_info['ID'],
-        text_info['Name'],
-        text_info['ID Type']
-    )
-    mycursor.execute(sql, value)
-    mydb.commit()
-    logging.info(f"Record for {text_info['ID']} inserted successfully")
 
+    rows = [_record_values(text_info) for text_info in text_infos]
+    if not rows:
+        return 0
 
-def fetch_records(text_info):
+    sql = """
+    INSERT INTO user_info(id, name, id_type, embedding)
+    VALUES (%s, %s, %s, %s)
+    """
+    _execute(sql, rows, commit=True, many=True)
+    logging.info(f"{len(rows)} records inserted successfully")
+    return len(rows)
+
+
+@instrumented("db.insert_or_report_duplicate")
+def insert_or_report_duplicate(text_info):
+    """
+    I insert a record only if no record with the same `id_type` and `id` exists, in a single round trip.
+    I use an `INSERT ... SELECT ... WHERE NOT EXISTS` statement, so the check and the insert happen together.
+    If no row was inserted, the ID is already enrolled and I report it as a duplicate. Two concurrent inserts
+    can both pass the check; the unique (id_type, id) index then rejects the second, which I also report as
+    a duplicate.
+    I return True if the record was a duplicate and nothing was inserted, otherwise False.
+    """
+
+    sql = f"""
+    INSERT INTO user_info(id, name, id_type, embedding)
+    SELECT %s, %s, %s, %s{_from_dual()}
+    WHERE NOT EXISTS (SELECT 1 FROM user_info WHERE id_type = %s AND id = %s)
+    """
+    try:
+        inserted = _execute(sql, _record_values(text_info) + (text_info['ID Type'], text_info['ID']), commit=True)
+    except Exception as e:
+        if not _is_integrity_error(e):
+            raise
+        inserted = 0
+
+    if inserted:
+        logging.info("Record for %s inserted successfully", text_info['ID'])
+        return False
+    logging.info("Duplicate record found for %s", text_info['ID'])
+    return True
+
+
+@instrumented("db.fetch_records")
+def fetch_records(text_info, as_frame=False):
     """
-    I retrieve records from the `user_info` table based on the provided `id`.
-    I use the `SELECT * FROM` SQL statement with a `WHERE` clause to filter records by `id`.
-    I execute the query and fetch all results into a DataFrame.
-    If records are found, I log a success message and return the DataFrame.
-    If no records are found, I log a message indicating this and return an empty DataFrame.
+    I retrieve records from the `user_info` table based on the provided `id_type` and `id`.
+    I use the `SELECT * FROM` SQL statement with a `WHERE` clause to filter records by `id_type` and `id`.
+    I return the rows as a list of dictionaries keyed by column name, or as a DataFrame when `as_frame` is True.
+    If no records are found, I log a message indicating this and return an empty list (or an empty DataFrame).
     """
-    
-    sql = "SELECT * FROM user_info WHERE id = %s"
-    value = (text_info['ID'],)
-    mycursor.execute(sql, value)
-    result = mycursor.fetchall()
+
+    sql = "SELECT * FROM user_info WHERE id_type = %s AND id = %s"
+    value = (text_info['ID Type'], text_info['ID'])
+    result, columns = _execute(sql, value, fetch=True)
 
     if result:
-        df = pd.DataFrame(result, columns=[desc[0] for desc in mycursor.description])
-        logging.info(f"Record for {text_info['ID']} fetched successfully")
-        return df
+        logging.info("Record for %s fetched successfully", text_info['ID'])
     else:
-        logging.info(f"No record found for {text_info['ID']}")
-        return pd.DataFrame()
-    
+        logging.info("No record found for %s", text_info['ID'])
+
+    if as_frame:
+        import pandas as pd
+        return pd.DataFrame(result, columns=columns) if result else pd.DataFrame()
+    return [dict(zip(columns, row)) for row in result]
+
 
+@instrumented("db.check_duplicacy")
 def check_duplicacy(text_info):
     """
-    I check if there is a duplicate record in the `user_info` table for the given `id`.
-    I first call the `fetch_records` function to get records for the specified ID.
-    If any records are found (i.e., the DataFrame has more than 0 rows), I set `is_duplicate` to True and log a message indicating a duplicate record.
-    If no records are found, I log a message indicating no duplicates.
+    I check if there is a duplicate record in the `user_info` table for the given `id_type` and `id`.
+    I use a single `SELECT EXISTS` query, so the database stops at the first matching row and no rows are transferred.
+    I log whether a duplicate record was found.
     I return the boolean value `is_duplicate` to indicate whether a duplicate record was found.
-    """ 
-    
-    is_duplicate = False
-    df = fetch_records(text_info)
-    if df.shape[0] > 0:
-        is_duplicate = True
-        logging.info(f"Duplicate record found for {text_info['ID']}")
+    """
+
+    sql = "SELECT EXISTS(SELECT 1 FROM user_info WHERE id_type = %s AND id = %s)"
+    result, _ = _execute(sql, (text_info['ID Type'], text_info['ID']), fetch=True)
+    is_duplicate = bool(result[0][0])
+
+    if is_duplicate:
+        logging.info("Duplicate record found for %s", text_info['ID'])
     else:
-        logging.info(f"No duplicate record found for {text_info['ID']}")
+        logging.info("No duplicate record found for %s", text_info['ID'])
     return is_duplicate
 
+
+@instrumented("db.check_duplicacy_many")
+def check_duplicacy_many(text_infos, chunk_size=1000):
+    """
+    I check many IDs for existing records using batched `IN` queries of at most `chunk_size` IDs each.
+    The same number may belong to different card types, so I look the IDs up on the `id` index and keep
+    the rows whose `id_type` matches too.
+    I return the set of (id_type, id) pairs that are already present in the `user_info` table.
+    """
+
+    keys = list(dict.fromkeys((text_info['ID Type'], text_info['ID']) for text_info in text_infos))
+    ids = list(dict.fromkeys(record_id for _, record_id in keys))
+    found = set()
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        sql = f"SELECT id_type, id FROM user_info WHERE id IN ({placeholders})"
+        result, _ = _execute(sql, tuple(chunk), fetch=True)
+        found.update((id_type, record_id) for id_type, record_id in result)
+    existing = found.intersection(keys)
+
+    logging.info(f"{len(existing)} of {len(keys)} IDs already present")
+    return existing
+
+
+@instrumented("db.fetch_embeddings")
+def fetch_embeddings(ids=None, chunk_size=1000):
+    """
+    I retrieve stored face embeddings from the `user_info` table to build the face index.
+    I skip records enrolled without an embedding.
+    When `ids` is given I fetch only those records, using batched `IN` queries of at most `chunk_size` IDs each.
+    I return the record IDs and a list with one float32 embedding per ID.
+    """
+
+    if ids is None:
+        sql = "SELECT id, embedding FROM user_info WHERE embedding IS NOT NULL"
+        result, _ = _execute(sql, fetch=True)
+    else:
+        ids = list(dict.fromkeys(ids))
+        result = []
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            placeholders = ", ".join(["%s"] * len(chunk))
+            sql = f"SELECT id, embedding FROM user_info WHERE embedding IS NOT NULL AND id IN ({placeholders})"
+            rows, _ = _execute(sql, tuple(chunk), fetch=True)
+            result.extend(rows)
+
+    ids = [row[0] for row in result]
+    embeddings = [blob_to_embedding(row[1]) for row in result]
+    logging.info(f"Fetched {len(ids)} face embeddings")
+    return ids, embeddings
+
+
+@instrumented("db.fetch_embedding_ids_since")
+def fetch_embedding_ids_since(created_at=None):
+    """
+    I retrieve the IDs of records with a face embedding created at or after `created_at`, using the index on
+    `created_at`, so a process can pick up faces enrolled by other processes without reading the whole table.
+    I return the IDs and the latest `created_at` among them (None if there are none), as the database returned it.
+    """
+
+    sql = "SELECT id, created_at FROM user_info WHERE embedding IS NOT NULL"
+    params = ()
+    if created_at is not None:
+        sql += " AND created_at >= %s"
+        params = (created_at,)
+    result, _ = _execute(sql, params, fetch=True)
+    latest = max((row[1] for row in result if row[1] is not None), default=None)
+    return [row[0] for row in result], latest
+
+
+@instrumented("db.insert_stage_audit")
+def insert_stage_audit(rows):
+    """
+    I insert stage audit rows into the `stage_audit` table with a single `executemany` call.
+    Each row is a tuple (run_id, record_id, id_type, status, stage, seconds, cached).
+    I return the number of rows inserted.
+    """
+
+    if not rows:
+        return 0
+    sql = """
+    INSERT INTO stage_audit(run_id, record_id, id_type, status, stage, seconds, cached)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """
+    _execute(sql, rows, commit=True, many=True)
+    return len(rows)
+
+
+_audit_queue = queue.Queue(maxsize=_AUDIT_QUEUE_SIZE)
+_audit_thread = None
+_audit_lock = threading.Lock()
+
+
+def _write_audit():
+    """
+    I write queued audit rows in batches, for as long as the process runs.
+    """
+    while True:
+        rows = _audit_queue.get()
+        while len(rows) < 500:
+            try:
+                rows.extend(_audit_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            insert_stage_audit(rows)
+        except Exception as e:
+            log_sampled("stage_audit", logging.WARNING, "%s stage audit rows lost: %s", len(rows), e)
+
+
+def record_stage_audit(run_id, result, id_type, cached_stages=()):
+    """
+    I queue one audit row per timed stage of a pipeline run, for the background audit writer.
+
+    Auditing never slows down or fails a request: rows are written off the request path, and dropped (with a
+    sampled warning) if the database cannot keep up.
+
+    :param run_id: Identifier shared by the rows of one run.
+    :param result: Result dictionary of `pipeline.run_pipeline`, with "timings", "status" and "fields".
+    :param id_type: ID card type of the run.
+    :param cached_stages: Timed stages whose result came from the result cache.
+    """
+    global _audit_thread
+    if not db_config["audit"]:
+        return
+    fields = result.get("fields") or {}
+    record_id = fields.get("ID") if fields.get("Valid") else None
+    cached = set(cached_stages)
+    rows = [(run_id, record_id, id_type, result["status"], stage, float(seconds), stage in cached)
+            for stage, seconds in result.get("timings", {}).items()]
+    with _audit_lock:
+        if _audit_thread is None:
+            _audit_thread = threading.Thread(target=_write_audit, name="ekyc-stage-audit", daemon=True)
+            _audit_thread.start()
+    try:
+        _audit_queue.put_nowait(rows)
+    except queue.Full:
+        log_sampled("stage_audit", logging.WARNING, "Stage audit queue full, %s rows dropped", len(rows))
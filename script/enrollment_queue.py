@@ -0,0 +1,673 @@
+"""
+Durable enrolment queue.
+
+Usage:
+    python enrollment_queue.py status
+    python enrollment_queue.py drain
+    python enrollment_queue.py replay [--state failed|written|duplicate|face_duplicate]
+
+Enrolments are written to a local SQLite file (WAL mode) as soon as the pipeline accepts them, and a background
+writer copies them to the `user_info` table in batches. A slow or unreachable database therefore no longer
+holds up the user, and an enrolment accepted while the database is down is kept until it can be written.
+
+The queue is local to one process or machine, but it decides nothing on its own: the writer checks every
+enrolment against the shared database (its ID, and its face through the face index kept in step with the
+database) when it writes it. That is why the pipeline answers "accepted" for a queued enrolment rather than
+"enrolled"; the outcome is the enrolment's final state here.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+import numpy as np
+from utilities import get_config
+from face_index import FaceIndex, embedding_to_blob, blob_to_embedding, duplicate_threshold, register_face, \
+    find_face_duplicate
+from instrumentation import instrumented
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+queue_config = {
+    "enabled": True,
+    "path": "enrollment_queue.sqlite3",
+    "batch_size": 100,
+    "flush_interval": 1.0,
+    "max_attempts": 10,
+    "retry_backoff": 2.0,
+    "max_backoff": 300.0,
+    "claim_timeout": 120.0,
+    "retention": 86400.0,
+}
+queue_config.update(config.get("enrollment_queue", {}))
+
+# States of a queued enrolment:
+#   pending   - waiting to be written (again, after a failed attempt, once `next_attempt_at` has passed)
+#   flushing  - claimed by a writer; returned to the queue if the writer dies and the claim times out
+#   written   - inserted into `user_info`
+#   duplicate - the (ID type, ID) was already in `user_info`, possibly from an earlier attempt that was not
+#               acknowledged, or enrolled through another instance meanwhile
+#   face_duplicate - the face was enrolled under another ID, through another instance or earlier in the batch
+#   failed    - gave up after `max_attempts`; `replay` puts it back
+# Written, duplicate and face_duplicate enrolments are deleted `retention` seconds after they finished.
+STATES = ("pending", "flushing", "written", "duplicate", "face_duplicate", "failed")
+
+QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS enrolments (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    name TEXT,
+    id_type TEXT NOT NULL,
+    embedding BLOB,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    enqueued_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    finished_at REAL,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS enrolments_type_id ON enrolments (id_type, id);
+CREATE INDEX IF NOT EXISTS enrolments_state ON enrolments (state, next_attempt_at);
+CREATE INDEX IF NOT EXISTS enrolments_revision ON enrolments (revision);
+CREATE INDEX IF NOT EXISTS enrolments_finished ON enrolments (finished_at);
+"""
+
+# Value of `revision` for a row an enrolment enters or leaves the queue with, so every process can follow which
+# faces are pending by reading the rows changed since the last revision it saw
+_NEXT_REVISION = "(SELECT COALESCE(MAX(revision), 0) + 1 FROM enrolments)"
+
+_WAITING = ("pending", "flushing")
+
+_QUEUE_COLUMNS = ("seq, id, name, id_type, embedding, state, attempts, last_error, enqueued_at, next_attempt_at, "
+                  "claimed_at, finished_at")
+
+
+def _upgrade_queue(connection):
+    """
+    I rebuild a queue file from before enrolments were keyed on (id_type, id), when `id` alone was unique,
+    keeping its rows.
+    """
+    row = connection.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'enrolments'").fetchone()
+    if row is None or "id TEXT NOT NULL UNIQUE" not in row[0]:
+        return
+    logging.info("Rebuilding the enrolment queue to key enrolments on (id_type, id)")
+    connection.executescript(f"""
+    BEGIN IMMEDIATE;
+    ALTER TABLE enrolments RENAME TO enrolments_old;
+    DROP INDEX IF EXISTS enrolments_state;
+    {QUEUE_SCHEMA}
+    INSERT INTO enrolments ({_QUEUE_COLUMNS})
+        SELECT {_QUEUE_COLUMNS.replace("id_type", "COALESCE(id_type, '')")} FROM enrolments_old;
+    DROP TABLE enrolments_old;
+    COMMIT;
+    """)
+
+
+class EnrollmentQueue:
+    """
+    I keep enrolments in a local SQLite write-ahead queue and flush them to the database in batches.
+
+    Every enrolment is committed to the queue file before `enqueue` returns, so it survives a crash of the
+    process or an outage of the database. `flush` claims a batch, looks up which IDs the database already has
+    and inserts the others in one transaction. Writes are idempotent on (id_type, id): an ID of a given card
+    type is queued at most once,
+    and a record the database already holds (for example because the process died after committing the
+    batch but before marking it written) is marked "duplicate" rather than inserted twice.
+
+    A failed batch is retried with exponential backoff. If the failure is not a lost connection, the batch is
+    written one record at a time with `insert_or_report_duplicate`, so a single bad record cannot hold back
+    the rest; records still failing after `max_attempts` are marked "failed" for `replay`.
+
+    A face joins the process's face index only once its record is in the database, so an enrolment that ends
+    up failed never blocks the same face under a corrected ID. Until then `find_pending_face` finds it in an
+    in-memory copy of the waiting faces, which follows the queue file through its `revision` column.
+
+    Finished enrolments are kept for `retention` seconds, long enough to `replay` them, then deleted, so the
+    queue file only grows with the backlog.
+    """
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0, max_attempts=10, retry_backoff=2.0,
+                 max_backoff=300.0, claim_timeout=120.0, retention=86400.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.claim_timeout = claim_timeout
+        self.retention = retention
+        self._connection = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._failures = 0
+        # Sequence numbers of the batch this instance has claimed and not yet finished
+        self._claimed = set()
+        # Waiting faces by seq, as (id, unit-length embedding), up to `_pending_revision`
+        self._pending_faces = None
+        self._pending_revision = 0
+        self._pending_matrix = None
+        self._pending_lock = threading.Lock()
+        self._pruned_at = 0.0
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # An enrolment acknowledged to the user must survive a power cut, not only a process crash
+            connection.execute("PRAGMA synchronous=FULL")
+            _upgrade_queue(connection)
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(enrolments)")}
+            if columns and "revision" not in columns:
+                connection.execute("ALTER TABLE enrolments ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+            connection.executescript(QUEUE_SCHEMA)
+            self._connection = connection
+            logging.info(f"Enrolment queue opened at {self.path}")
+        return self._connection
+
+    def _transaction(self, statements):
+        """
+        I run (sql, params) pairs in one immediate transaction, so concurrent writers in other processes wait
+        instead of claiming the same rows.
+
+        :return: Row count of each statement.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                counts = [connection.execute(sql, params).rowcount for sql, params in statements]
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        return counts
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    @instrumented("enrollment_queue.enqueue")
+    def enqueue(self, text_info):
+        """
+        I durably record an enrolment and wake the writer.
+
+        An ID that is not waiting in the queue any more is queued again with the new data: it gave up
+        ("failed"), was turned down for its face ("face_duplicate"), or was written but the pipeline found no
+        record for it, for example because the record was deleted. An ID still waiting is left as it is.
+
+        :param text_info: Extracted fields with "ID", "Name", "ID Type" and optionally "Embedding".
+        :return: True if the enrolment was queued, False if the ID is already waiting in the queue.
+        """
+        now = time.time()
+        sql = f"""
+        INSERT INTO enrolments (id, name, id_type, embedding, enqueued_at, revision)
+        VALUES (?, ?, ?, ?, ?, {_NEXT_REVISION})
+        ON CONFLICT (id_type, id) DO UPDATE SET
+            name = excluded.name, id_type = excluded.id_type, embedding = excluded.embedding,
+            state = 'pending', attempts = 0, last_error = NULL, enqueued_at = excluded.enqueued_at,
+            next_attempt_at = 0, claimed_at = NULL, finished_at = NULL, revision = excluded.revision
+        WHERE enrolments.state NOT IN ('pending', 'flushing')
+        """
+        (queued,) = self._transaction([(sql, (str(text_info["ID"]), text_info["Name"], text_info["ID Type"],
+                                               embedding_to_blob(text_info.get("Embedding")), now))])
+        if queued:
+            logging.info("Enrolment for %s queued", text_info["ID"])
+            self._wake.set()
+        else:
+            logging.info("Enrolment for %s is already queued", text_info["ID"])
+        return bool(queued)
+
+    def is_queued(self, record_id, id_type):
+        """
+        I tell whether an ID of a card type is waiting in the queue, so the pipeline can report a duplicate
+        before the writer has reached the database. Once written, the database is what tells.
+        """
+        rows = self._query("SELECT 1 FROM enrolments WHERE id_type = ? AND id = ? "
+                           "AND state IN ('pending', 'flushing')", (id_type, str(record_id)))
+        return bool(rows)
+
+    def _refresh_pending_faces(self):
+        """
+        I bring the in-memory waiting faces up to date with the queue file, reading only the rows that entered
+        or left the queue since the last refresh, whichever process changed them.
+        """
+        if self._pending_faces is None:
+            # Rows changed while I load are read again on the next refresh
+            revision = self._query("SELECT COALESCE(MAX(revision), 0) FROM enrolments")[0][0]
+            rows = self._query("SELECT seq, id, state, embedding, 0 FROM enrolments "
+                               "WHERE state IN ('pending', 'flushing')")
+            self._pending_faces = {}
+            self._pending_revision = revision
+        else:
+            rows = self._query("SELECT seq, id, state, CASE WHEN state IN ('pending', 'flushing') THEN embedding END, "
+                               "revision FROM enrolments WHERE revision > ? ORDER BY revision",
+                               (self._pending_revision,))
+        if not rows:
+            return
+        for seq, record_id, state, blob, revision in rows:
+            embedding = blob_to_embedding(blob)
+            if state in _WAITING and embedding is not None:
+                norm = float(np.linalg.norm(embedding)) or 1.0
+                self._pending_faces[seq] = (record_id, embedding / norm)
+            else:
+                self._pending_faces.pop(seq, None)
+            self._pending_revision = max(self._pending_revision, revision)
+        self._pending_matrix = None
+
+    def find_pending_face(self, embedding, record_id=None, threshold=None):
+        """
+        I look for a face queued under another ID but not written yet, which the face index does not hold.
+
+        :param embedding: Embedding of the face being enrolled.
+        :param record_id: ID number being enrolled; its own queued enrolment is not a duplicate.
+        :param threshold: Largest cosine distance treated as the same person. Defaults to
+                          `face_index.duplicate_threshold`.
+        :return: (id, distance) of the closest matching queued face, or None.
+        """
+        if embedding is None:
+            return None
+        threshold = duplicate_threshold if threshold is None else threshold
+        with self._pending_lock:
+            self._refresh_pending_faces()
+            if not self._pending_faces:
+                return None
+            if self._pending_matrix is None:
+                faces = list(self._pending_faces.values())
+                self._pending_matrix = ([face_id for face_id, _ in faces], np.stack([face for _, face in faces]))
+            ids, matrix = self._pending_matrix
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        distances = 1.0 - matrix @ (query / (float(np.linalg.norm(query)) or 1.0))
+        for row in np.argsort(distances):
+            if distances[row] > threshold:
+                break
+            if record_id is None or ids[row] != str(record_id):
+                return ids[row], float(distances[row])
+        return None
+
+    def _claim(self):
+        """
+        I mark the next batch of due enrolments as being flushed, taking over claims of writers that died.
+
+        :return: List of (seq, text_info) pairs.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = connection.execute(
+                    """
+                    SELECT seq, id, name, id_type, embedding FROM enrolments
+                    WHERE (state = 'pending' AND next_attempt_at <= ?) OR (state = 'flushing' AND claimed_at < ?)
+                    ORDER BY seq LIMIT ?
+                    """, (now, now - self.claim_timeout, self.batch_size)).fetchall()
+                connection.executemany("UPDATE enrolments SET state = 'flushing', claimed_at = ? WHERE seq = ?",
+                                       [(now, row[0]) for row in rows])
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self._claimed.update(row[0] for row in rows)
+        return [(seq, {"ID": record_id, "Name": name, "ID Type": id_type, "Embedding": blob_to_embedding(blob)})
+                for seq, record_id, name, id_type, blob in rows]
+
+    def _finish(self, outcomes):
+        """
+        I record the outcome of each claimed enrolment.
+
+        :param outcomes: Dictionary of seq to "written", "duplicate", "face_duplicate" or an exception.
+        """
+        now = time.time()
+        statements = []
+        for seq, outcome in outcomes.items():
+            if isinstance(outcome, Exception):
+                statements.append((f"""
+                    UPDATE enrolments SET attempts = attempts + 1, last_error = ?, claimed_at = NULL,
+                        state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                        next_attempt_at = ? + min(?, ? * (1 << min(attempts, 16))),
+                        finished_at = CASE WHEN attempts + 1 >= ? THEN ? ELSE finished_at END,
+                        revision = CASE WHEN attempts + 1 >= ? THEN {_NEXT_REVISION} ELSE revision END
+                    WHERE seq = ?
+                    """, (str(outcome), self.max_attempts, now, self.max_backoff, self.retry_backoff,
+                          self.max_attempts, now, self.max_attempts, seq)))
+            else:
+                statements.append((f"UPDATE enrolments SET state = ?, finished_at = ?, claimed_at = NULL, "
+                                   f"revision = {_NEXT_REVISION} WHERE seq = ?", (outcome, now, seq)))
+        self._transaction(statements)
+        with self._lock:
+            self._claimed.difference_update(outcomes)
+
+    def _release_claims(self):
+        """
+        I hand the batch this instance claimed back to the queue, so another writer takes it at once instead
+        of after `claim_timeout`. Records the database already committed come back as "duplicate".
+
+        :return: Number of enrolments released.
+        """
+        with self._lock:
+            claimed, self._claimed = list(self._claimed), set()
+        if not claimed:
+            return 0
+        (count,) = self._transaction([(
+            f"UPDATE enrolments SET state = 'pending', claimed_at = NULL "
+            f"WHERE state = 'flushing' AND seq IN ({', '.join('?' * len(claimed))})", claimed)])
+        logging.info(f"{count} claimed enrolments released")
+        return count
+
+    def _register_faces(self, batch, outcomes):
+        """
+        I add the faces of the records just written to the process's face index.
+        """
+        for seq, text_info in batch:
+            if outcomes.get(seq) == "written":
+                try:
+                    register_face(text_info["ID"], text_info["Embedding"])
+                except Exception as e:
+                    # The index reads missing faces back from the database when it is next loaded
+                    logging.warning(f"Face of {text_info['ID']} not added to the face index: {e}")
+
+    def _face_duplicates(self, batch):
+        """
+        I find the enrolments of a batch whose face is already enrolled under another ID, checking the face index
+        (kept in step with the database, so faces written by other instances count) and the batch itself.
+
+        :return: Dictionary of seq to "face_duplicate".
+        """
+        outcomes = {}
+        accepted = FaceIndex()
+        for seq, text_info in batch:
+            embedding = text_info["Embedding"]
+            if embedding is None:
+                continue
+            match = find_face_duplicate(embedding, text_info["ID"]) or \
+                accepted.find_duplicate(embedding, duplicate_threshold, exclude_id=text_info["ID"])
+            if match:
+                logging.info("Queued face of %s matches enrolled ID %s", text_info["ID"], match[0])
+                outcomes[seq] = "face_duplicate"
+            else:
+                accepted.add(text_info["ID"], embedding)
+        return outcomes
+
+    @instrumented("enrollment_queue.flush_batch")
+    def _flush_batch(self, batch):
+        """
+        I write one claimed batch to the database and return the outcome of each enrolment.
+        """
+        from dbms_operations import check_duplicacy_many, insert_records_many, insert_or_report_duplicate, \
+            _is_connection_error
+
+        face_duplicates = self._face_duplicates(batch)
+        try:
+            existing = check_duplicacy_many([text_info for _, text_info in batch])
+            new = [(seq, text_info) for seq, text_info in batch
+                   if (text_info["ID Type"], text_info["ID"]) not in existing and seq not in face_duplicates]
+            insert_records_many([text_info for _, text_info in new])
+            outcomes = dict(face_duplicates)
+            outcomes.update({seq: "duplicate" for seq, text_info in batch
+                             if (text_info["ID Type"], text_info["ID"]) in existing})
+            outcomes.update({seq: "written" for seq, _ in new})
+            return outcomes
+        except Exception as e:
+            if _is_connection_error(e):
+                return {seq: e for seq, _ in batch}
+            logging.warning(f"Batch of {len(batch)} enrolments failed, writing them one at a time: {e}")
+
+        outcomes = dict(face_duplicates)
+        for seq, text_info in batch:
+            if seq in outcomes:
+                continue
+            try:
+                outcomes[seq] = "duplicate" if insert_or_report_duplicate(text_info) else "written"
+            except Exception as e:
+                logging.warning(f"Enrolment for {text_info['ID']} failed: {e}")
+                outcomes[seq] = e
+        return outcomes
+
+    def flush(self, max_batches=None):
+        """
+        I write due enrolments to the database, one batch per transaction, until none is due.
+
+        :param max_batches: Stop after this many batches. None flushes everything that is due.
+        :return: Dictionary counting the enrolments per outcome ("written", "duplicate", "face_duplicate", "retry",
+                 "failed").
+        """
+        summary = {}
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batch = self._claim()
+            if not batch:
+                break
+            batches += 1
+            outcomes = self._flush_batch(batch)
+            # Before the batch leaves the pending faces, so a concurrent request always sees the face somewhere
+            self._register_faces(batch, outcomes)
+            self._finish(outcomes)
+            errors = [outcome for outcome in outcomes.values() if isinstance(outcome, Exception)]
+            for outcome in outcomes.values():
+                name = "retry" if isinstance(outcome, Exception) else outcome
+                summary[name] = summary.get(name, 0) + 1
+            if errors:
+                # Leave the rest of the queue for the next round, after the backoff
+                self._failures += 1
+                logging.warning("%s of %s enrolments not written: %s", len(errors), len(batch), errors[0])
+                break
+            self._failures = 0
+        if summary:
+            failed = self._query("SELECT COUNT(*) FROM enrolments WHERE state = 'failed'")[0][0]
+            summary["failed"] = failed
+            logging.info("Enrolment queue flushed: %s", summary)
+        return summary
+
+    def drain(self, timeout=None):
+        """
+        I flush until nothing is pending, waiting out the backoff of retried enrolments.
+
+        :param timeout: Seconds to keep trying. None tries until the queue is empty or only failed ones remain.
+        :return: The counts of `status`.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.flush()
+            counts = self.status()["counts"]
+            if not counts["pending"] and not counts["flushing"]:
+                return self.status()
+            if deadline is not None and time.monotonic() >= deadline:
+                logging.warning(f"Enrolment queue not drained within {timeout}s: {counts}")
+                return self.status()
+            due = self._query("SELECT MIN(next_attempt_at) FROM enrolments WHERE state = 'pending'")[0][0]
+            wait = 1.0 if due is None else min(max(0.0, due - time.time()), self.max_backoff)
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            time.sleep(max(wait, 0.05))
+
+    def replay(self, state="failed"):
+        """
+        I put enrolments in `state` back in the queue, for example failed ones once the database is fixed, or
+        written ones after the database was restored from a backup older than them (as far back as `retention`
+        keeps them). Replayed enrolments the
+        database already holds end up as "duplicate", so replaying is always safe.
+
+        :param state: "failed", "written", "duplicate" or "face_duplicate".
+        :return: Number of enrolments queued again.
+        """
+        if state not in ("failed", "written", "duplicate", "face_duplicate"):
+            raise ValueError(f"Cannot replay enrolments in state {state!r}")
+        (count,) = self._transaction([(f"""
+            UPDATE enrolments SET state = 'pending', attempts = 0, last_error = NULL, next_attempt_at = 0,
+                claimed_at = NULL, finished_at = NULL, revision = {_NEXT_REVISION}
+            WHERE state = ?
+            """, (state,))])
+        logging.info(f"{count} {state} enrolments queued again")
+        self._wake.set()
+        return count
+
+    def prune(self, retention=None):
+        """
+        I delete enrolments that finished as written, duplicate or face_duplicate more than `retention` seconds
+        ago, with their embeddings. Failed ones are kept for `replay`.
+
+        :param retention: Seconds to keep finished enrolments. Defaults to the queue's `retention`.
+        :return: Number of enrolments deleted.
+        """
+        retention = self.retention if retention is None else retention
+        (count,) = self._transaction([(
+            "DELETE FROM enrolments WHERE state IN ('written', 'duplicate', 'face_duplicate') AND finished_at < ?",
+            (time.time() - retention,))])
+        if count:
+            logging.info(f"{count} finished enrolments pruned from the queue")
+        return count
+
+    def status(self):
+        """
+        I report the queue's length and health.
+
+        :return: Dictionary with "counts" per state, "oldest_pending_seconds" (age of the oldest enrolment not
+                 yet written, or None) and "last_errors" (up to five recent errors by ID).
+        """
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(dict(self._query("SELECT state, COUNT(*) FROM enrolments GROUP BY state")))
+        oldest = self._query("SELECT MIN(enqueued_at) FROM enrolments WHERE state IN ('pending', 'flushing')")[0][0]
+        errors = self._query("SELECT id, last_error FROM enrolments WHERE last_error IS NOT NULL "
+                             "AND state IN ('pending', 'failed') ORDER BY seq DESC LIMIT 5")
+        return {
+            "path": self.path,
+            "counts": counts,
+            "oldest_pending_seconds": None if oldest is None else time.time() - oldest,
+            "last_errors": dict(errors),
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # One batch at a time, so `stop` never waits for more than the batch in flight
+                while not self._stop.is_set():
+                    summary = self.flush(max_batches=1)
+                    if not summary or summary.get("retry"):
+                        break
+            except Exception as e:
+                self._failures += 1
+                logging.exception(f"Enrolment writer failed: {e}")
+            if time.monotonic() - self._pruned_at >= min(self.retention, 3600.0):
+                try:
+                    self.prune()
+                except Exception as e:
+                    logging.warning(f"Enrolment queue not pruned: {e}")
+                self._pruned_at = time.monotonic()
+            delay = self.flush_interval
+            if self._failures:
+                delay = min(self.max_backoff, self.retry_backoff * 2 ** min(self._failures, 16))
+            self._wake.wait(delay)
+            self._wake.clear()
+
+    def start(self):
+        """
+        I start the background writer thread, unless it is already running.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="ekyc-enrolment-writer", daemon=True)
+                self._thread.start()
+        return self._thread
+
+    def stop(self, drain=True, timeout=10.0):
+        """
+        I stop the background writer, after one last attempt to write what is pending when `drain` is True.
+        Whatever is not written stays in the queue file for the next process or `drain`; a batch the writer is
+        still busy with after `timeout` is released rather than left claimed.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logging.warning(f"Enrolment writer still busy after {timeout}s; releasing its batch")
+                self._release_claims()
+        if drain:
+            try:
+                self.drain(timeout=timeout)
+            except Exception as e:
+                logging.warning(f"Enrolment queue not drained on shutdown: {e}")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_enrollment_queue(start=True):
+    """
+    I return the process-wide enrolment queue, created from the `enrollment_queue` configuration section.
+
+    :param start: Whether to make sure the background writer is running.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = EnrollmentQueue(
+                path=queue_config["path"],
+                batch_size=queue_config["batch_size"],
+                flush_interval=queue_config["flush_interval"],
+                max_attempts=queue_config["max_attempts"],
+                retry_backoff=queue_config["retry_backoff"],
+                max_backoff=queue_config["max_backoff"],
+                claim_timeout=queue_config["claim_timeout"],
+                retention=queue_config["retention"],
+            )
+    if start:
+        _queue.start()
+    return _queue
+
+
+def stop_enrollment_queue(drain=True, timeout=10.0):
+    """
+    I stop the process-wide enrolment queue's writer, if this process created the queue.
+
+    :param drain: Whether to try writing what is pending first; see `EnrollmentQueue.stop`.
+    :param timeout: Seconds to wait for the writer, and to drain.
+    """
+    with _queue_lock:
+        enrollment_queue = _queue
+    if enrollment_queue is not None:
+        enrollment_queue.stop(drain=drain, timeout=timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and recover the durable enrolment queue.")
+    parser.add_argument("command", choices=("status", "drain", "replay", "prune"),
+                        help="status: counts per state; drain: write everything pending now; "
+                             "replay: queue enrolments in --state again, then drain; "
+                             "prune: delete enrolments finished longer than --retention ago")
+    parser.add_argument("--path", default=None, help="queue file (default: enrollment_queue.path)")
+    parser.add_argument("--state", default="failed", choices=("failed", "written", "duplicate", "face_duplicate"),
+                        help="state of the enrolments to replay (default: failed)")
+    parser.add_argument("--retention", type=float, default=None,
+                        help="seconds to keep finished enrolments (default: enrollment_queue.retention)")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds to keep draining (default: until empty)")
+    args = parser.parse_args()
+
+    from instrumentation import configure_logging
+    configure_logging()
+
+    if args.path:
+        queue_config["path"] = args.path
+    enrollment_queue = get_enrollment_queue(start=False)
+    if args.command == "replay":
+        enrollment_queue.replay(args.state)
+    if args.command == "prune":
+        enrollment_queue.prune(args.retention)
+    if args.command in ("drain", "replay"):
+        enrollment_queue.drain(timeout=args.timeout)
+    print(json.dumps(enrollment_queue.status(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
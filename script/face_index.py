@@ -0,0 +1,489 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+import numpy as np
+from datetime import datetime, timedelta
+from utilities import get_config
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+face_index_config = config.get("face_index", {})
+face_index_path = face_index_config.get("path", "face_index.npz")
+duplicate_threshold = face_index_config.get("duplicate_threshold", 0.40)
+save_every = face_index_config.get("save_every", 100)
+# Indexes of at least this many faces are switched to inverted-file search when loaded or saved
+ivf_threshold = face_index_config.get("ivf_threshold", 50000)
+ivf_nprobe = face_index_config.get("ivf_nprobe", 8)
+# Faces enrolled by other processes sharing the database are picked up at most this many seconds apart; each
+# poll looks `sync_overlap` seconds before the newest record seen, for transactions that commit out of order
+sync_interval = face_index_config.get("sync_interval", 2.0)
+sync_overlap = face_index_config.get("sync_overlap", 60.0)
+# Precision the embeddings are held in; float16 halves the memory of the index and searches compute in float32
+storage_dtype = np.dtype(face_index_config.get("dtype", "float16"))
+
+
+def embedding_to_blob(embedding):
+    """
+    I pack a face embedding into compact float32 bytes for storage in the database.
+
+    :param embedding: Embedding as a list of floats or a numpy array.
+    :return: Bytes holding the float32 values, or None if there is no embedding.
+    """
+    if embedding is None:
+        return None
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def blob_to_embedding(blob):
+    """
+    I unpack float32 bytes written by `embedding_to_blob` back into a numpy vector.
+
+    :param blob: Bytes from the database.
+    :return: One-dimensional float32 numpy array, or None if there is no blob.
+    """
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def _dot(vectors, query, chunk_size=65536):
+    """
+    I return the dot product of every row with the query, converting float16 rows to float32 a chunk at a time
+    rather than the whole matrix at once.
+    """
+    if vectors.dtype == np.float32:
+        return vectors @ query
+    products = np.empty(vectors.shape[0], dtype=np.float32)
+    for start in range(0, vectors.shape[0], chunk_size):
+        products[start:start + chunk_size] = vectors[start:start + chunk_size].astype(np.float32) @ query
+    return products
+
+
+def _normalise(vectors):
+    """
+    I scale each row to unit length so a dot product gives the cosine similarity.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class FaceIndex:
+    """
+    I keep the enrolled face embeddings in memory and find the nearest ones to a new face.
+
+    Distances are cosine distances (1 - cosine similarity), the same metric DeepFace uses for verification.
+    Small indexes are searched brute force with one matrix product. Once `build_ivf` has been called the
+    index becomes an inverted file: the embeddings are split into `nlist` clusters and a search only scans
+    the `nprobe` clusters closest to the query, which keeps lookups fast at millions of users.
+
+    Memory grows with the embedding size: VGG-Face embeddings have 4096 dimensions, so a million faces take
+    16 GB as float32 and 8 GB in the default float16 storage, and a brute-force search reads all of it. Past
+    `ivf_threshold` faces a search only reads the probed clusters, about `nprobe` / `nlist` of the index.
+    """
+
+    def __init__(self, dim=None, capacity=1024, dtype=None):
+        self.dim = dim
+        self.dtype = storage_dtype if dtype is None else np.dtype(dtype)
+        self.ids = []
+        self._id_set = set()
+        self._vectors = None if dim is None else np.empty((capacity, dim), dtype=self.dtype)
+        self._count = 0
+        self.centroids = None
+        self.nprobe = 1
+        self._lists = []
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, record_id):
+        return str(record_id) in self._id_set
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._count] if self._vectors is not None else np.empty((0, self.dim or 0), self.dtype)
+
+    def _reserve(self, extra):
+        """
+        I grow the embedding matrix geometrically so incremental adds stay cheap.
+        """
+        needed = self._count + extra
+        if self._vectors is None:
+            self._vectors = np.empty((max(needed, 1024), self.dim), dtype=self.dtype)
+        elif needed > self._vectors.shape[0]:
+            grown = np.empty((max(needed, 2 * self._vectors.shape[0]), self.dim), dtype=self.dtype)
+            grown[:self._count] = self._vectors[:self._count]
+            self._vectors = grown
+
+    def add(self, ids, embeddings):
+        """
+        I add embeddings for the given record IDs to the index. IDs already in the index are skipped, so
+        adding a record twice (once from the database, once as it is enrolled) does not duplicate it.
+
+        :param ids: A single ID or a list of IDs.
+        :param embeddings: One embedding or a matrix with one embedding per ID.
+        :return: Number of embeddings added.
+        """
+        if isinstance(ids, str) or not hasattr(ids, "__iter__"):
+            ids = [ids]
+        vectors = _normalise(embeddings)
+        if len(ids) != vectors.shape[0]:
+            raise ValueError(f"Got {len(ids)} IDs for {vectors.shape[0]} embeddings")
+
+        with self._lock:
+            new = [row for row, record_id in enumerate(ids) if str(record_id) not in self._id_set]
+            if len(new) < len(ids):
+                ids, vectors = [ids[row] for row in new], vectors[new]
+            if not ids:
+                return 0
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding has {vectors.shape[1]} dimensions, index expects {self.dim}")
+
+            self._reserve(len(ids))
+            start = self._count
+            self._vectors[start:start + len(ids)] = vectors
+            self.ids.extend(str(i) for i in ids)
+            self._id_set.update(str(i) for i in ids)
+            self._count += len(ids)
+
+            if self.centroids is not None:
+                assignments = self._assign(vectors)
+                for row, cluster in enumerate(assignments, start=start):
+                    self._lists[cluster].append(row)
+        return len(ids)
+
+    def _assign(self, vectors, chunk_size=65536):
+        """
+        I return the closest centroid for every vector, in chunks to bound memory.
+        """
+        assignments = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            block = vectors[start:start + chunk_size].astype(np.float32)
+            assignments[start:start + chunk_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def build_ivf(self, nlist=1024, nprobe=8, iterations=10, sample_size=None, seed=0):
+        """
+        I cluster the current embeddings with spherical k-means and switch the index to inverted-file search.
+
+        :param nlist: Number of clusters. Roughly the square root of the number of enrolled faces works well.
+        :param nprobe: Number of closest clusters scanned per search. Higher is more accurate but slower.
+        :param iterations: Number of k-means iterations.
+        :param sample_size: Number of embeddings used to train the clusters. Defaults to 64 per cluster.
+        :param seed: Random seed, so rebuilding the same data gives the same clusters.
+        """
+        with self._lock:
+            if self._count == 0:
+                raise ValueError("Cannot build an IVF index without embeddings")
+            vectors = self.vectors
+            nlist = max(1, min(nlist, self._count))
+
+            rng = np.random.default_rng(seed)
+            sample_size = min(self._count, sample_size or 64 * nlist)
+            sample = vectors[rng.choice(self._count, sample_size, replace=False)].astype(np.float32)
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                # Clusters that lost all their members keep their previous centroid
+                empty = np.bincount(labels, minlength=nlist) == 0
+                sums[empty] = centroids[empty]
+                centroids = _normalise(sums)
+
+            self.centroids = centroids
+            self.nprobe = max(1, min(nprobe, nlist))
+            self._build_lists()
+            logging.info(f"Face index switched to IVF with {nlist} lists over {self._count} embeddings")
+
+    def _build_lists(self, assignments=None):
+        """
+        I rebuild the inverted lists, assigning every stored embedding to its closest centroid
+        unless the assignments are already known.
+        """
+        nlist = self.centroids.shape[0]
+        if assignments is None:
+            assignments = self._assign(self.vectors)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(nlist + 1))
+        self._lists = [order[bounds[c]:bounds[c + 1]].tolist() for c in range(nlist)]
+
+    def search(self, embedding, k=1):
+        """
+        I find the enrolled faces closest to an embedding.
+
+        :param embedding: Query embedding.
+        :param k: Number of neighbours to return.
+        :return: List of (id, cosine_distance) tuples, closest first.
+        """
+        query = _normalise(embedding)[0]
+        with self._lock:
+            if self._count == 0:
+                return []
+            if self.centroids is None:
+                rows = None
+                candidates = self.vectors
+            else:
+                probes = np.argsort(self.centroids @ query)[::-1][:self.nprobe]
+                rows = np.fromiter((row for cluster in probes for row in self._lists[cluster]), dtype=np.int64)
+                if rows.size == 0:
+                    return []
+                candidates = self._vectors[rows]
+            similarities = _dot(candidates, query)
+            ids = self.ids
+
+        k = min(k, similarities.shape[0])
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        if rows is not None:
+            return [(ids[rows[i]], float(1.0 - similarities[i])) for i in top]
+        return [(ids[i], float(1.0 - similarities[i])) for i in top]
+
+    def find_duplicate(self, embedding, threshold, exclude_id=None):
+        """
+        I look for an enrolled face that matches the embedding under a different ID.
+
+        :param embedding: Embedding of the face being enrolled.
+        :param threshold: Largest cosine distance still treated as the same person.
+        :param exclude_id: ID being enrolled; matches on the same ID are not duplicates.
+        :return: (id, distance) of the closest matching face, or None.
+        """
+        for record_id, distance in self.search(embedding, k=5):
+            if distance > threshold:
+                break
+            if exclude_id is None or record_id != str(exclude_id):
+                return record_id, distance
+        return None
+
+    def save(self, path):
+        """
+        I write the index to an uncompressed .npz file, including the IVF clusters if built.
+
+        I only hold the lock while I take a consistent view of the index; searches and adds go on while the
+        file is written.
+
+        :param path: Destination file path.
+        """
+        with self._lock:
+            count = self._count
+            # Adds only write past `_count`, and growing copies into a new matrix, so these rows stay as they are
+            arrays = {"vectors": self.vectors}
+            ids = list(self.ids)
+            if self.centroids is not None:
+                assignments = np.empty(count, dtype=np.int64)
+                for cluster, rows in enumerate(self._lists):
+                    assignments[rows] = cluster
+                arrays["centroids"] = self.centroids
+                arrays["assignments"] = assignments
+                arrays["nprobe"] = np.array(self.nprobe)
+        arrays["ids"] = np.array(ids, dtype=str)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # A temporary file of our own, so processes saving the same index at once do not clobber each other
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                        dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logging.info(f"Face index with {count} embeddings saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        """
+        I read an index written by `save`, converting its embeddings to `face_index.dtype` if they were saved in
+        another precision.
+
+        :param path: Path to the .npz file.
+        :return: The loaded `FaceIndex`.
+        """
+        with np.load(path) as data:
+            vectors = data["vectors"]
+            index = cls(dim=vectors.shape[1], capacity=max(1024, vectors.shape[0]))
+            index._vectors[:vectors.shape[0]] = vectors
+            index._count = vectors.shape[0]
+            index.ids = data["ids"].tolist()
+            index._id_set = set(index.ids)
+            if "centroids" in data:
+                index.centroids = data["centroids"]
+                index.nprobe = int(data["nprobe"])
+                index._build_lists(data["assignments"])
+        logging.info(f"Face index with {len(index)} embeddings loaded from {path}")
+        return index
+
+
+_face_index = None
+_face_index_lock = threading.Lock()
+_unsaved_adds = 0
+# Newest `created_at` read from the database, and when it was last polled
+_watermark = None
+_synced_at = None
+_sync_lock = threading.Lock()
+# Set by `register_face` when a snapshot is due; the saver thread writes it off the request path
+_save_requested = threading.Event()
+_saver_thread = None
+
+
+def _maybe_build_ivf(index):
+    """
+    I switch a large index to inverted-file search, with about the square root of its size as clusters.
+    """
+    if index.centroids is None and len(index) >= ivf_threshold:
+        index.build_ivf(nlist=max(1, min(4096, int(np.sqrt(len(index))))), nprobe=ivf_nprobe)
+
+
+def _save_in_background():
+    """
+    I write a snapshot of the face index each time one is requested, so no request waits for the file.
+    """
+    while True:
+        _save_requested.wait()
+        _save_requested.clear()
+        index = _face_index
+        if index is None:
+            continue
+        try:
+            _maybe_build_ivf(index)
+            index.save(face_index_path)
+        except Exception as e:
+            # The faces enrolled since the last snapshot are read back from the database on load
+            logging.warning(f"Face index snapshot not saved: {e}")
+
+
+def _as_datetime(value):
+    """
+    I turn a `created_at` value into a datetime; SQLite returns it as text, MySQL as a datetime.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+
+def _add_missing_from_database(index, since=None):
+    """
+    I add the database's embeddings the index lacks: those enrolled since the snapshot was saved, or by other
+    processes since `since`. Only the IDs are read first; embeddings are fetched for the missing ones.
+
+    :param since: Only look at records created at or after this datetime. None looks at every record.
+    :return: Number of embeddings added.
+    """
+    global _watermark
+    from dbms_operations import fetch_embedding_ids_since, fetch_embeddings
+    ids, latest = fetch_embedding_ids_since(None if since is None else since.strftime("%Y-%m-%d %H:%M:%S"))
+    latest = _as_datetime(latest)
+    if latest is not None and (_watermark is None or latest > _watermark):
+        _watermark = latest
+    missing = [record_id for record_id in ids if record_id not in index]
+    if not missing:
+        return 0
+    ids, embeddings = fetch_embeddings(ids=missing)
+    added = index.add(ids, embeddings) if ids else 0
+    logging.info(f"Added {added} embeddings enrolled outside this process to the face index")
+    return added
+
+
+def sync_from_database(force=False):
+    """
+    I add the faces other processes sharing the database have enrolled since the last poll, at most once every
+    `face_index.sync_interval` seconds, so a face enrolled through another instance is caught as a duplicate.
+
+    :param force: Poll now, whatever the interval.
+    :return: Number of embeddings added.
+    """
+    global _synced_at
+    index = get_face_index()
+    if not force and _synced_at is not None and time.monotonic() - _synced_at < sync_interval:
+        return 0
+    # One poll at a time; a request arriving meanwhile searches what the index already holds
+    if not _sync_lock.acquire(blocking=force):
+        return 0
+    try:
+        since = None if _watermark is None else _watermark - timedelta(seconds=sync_overlap)
+        added = _add_missing_from_database(index, since)
+        _synced_at = time.monotonic()
+    finally:
+        _sync_lock.release()
+    return added
+
+
+def get_face_index():
+    """
+    I return the process-wide face index, loading it on first use.
+
+    I read the snapshot at `face_index.path` when it exists and add the database's embeddings it lacks;
+    otherwise I build the index from the embeddings stored in the database. Indexes of `ivf_threshold`
+    faces or more are switched to inverted-file search.
+
+    :return: The shared `FaceIndex`.
+    """
+    global _face_index, _watermark, _synced_at
+    with _face_index_lock:
+        if _face_index is None:
+            _watermark, _synced_at = None, time.monotonic()
+            if os.path.exists(face_index_path):
+                index = FaceIndex.load(face_index_path)
+                _add_missing_from_database(index)
+            else:
+                from dbms_operations import fetch_embeddings
+                index = FaceIndex()
+                ids, embeddings = fetch_embeddings()
+                if ids:
+                    index.add(ids, embeddings)
+                logging.info(f"Face index built from the database with {len(index)} embeddings")
+            _maybe_build_ivf(index)
+            _face_index = index
+        return _face_index
+
+
+def find_face_duplicate(embedding, record_id=None):
+    """
+    I check whether a face is already enrolled under another ID, in this process or, up to
+    `face_index.sync_interval` seconds ago, in any other process sharing the database.
+
+    :param embedding: Embedding of the face being enrolled.
+    :param record_id: ID number being enrolled.
+    :return: (id, distance) of the enrolled match, or None.
+    """
+    if embedding is None:
+        return None
+    try:
+        sync_from_database()
+    except Exception as e:
+        logging.warning(f"Face index not synchronised with the database: {e}")
+    return get_face_index().find_duplicate(embedding, duplicate_threshold, exclude_id=record_id)
+
+
+def register_face(record_id, embedding):
+    """
+    I add a newly enrolled face to the shared index and, every `face_index.save_every` adds, ask the saver
+    thread for a snapshot.
+
+    :param record_id: ID number of the new record.
+    :param embedding: Embedding of the enrolled face.
+    """
+    global _unsaved_adds, _saver_thread
+    if embedding is None:
+        return
+    index = get_face_index()
+    if not index.add(record_id, embedding):
+        # Already loaded from the database when the index was built
+        return
+    with _face_index_lock:
+        _unsaved_adds += 1
+        if _unsaved_adds < save_every:
+            return
+        _unsaved_adds = 0
+        if _saver_thread is None:
+            _saver_thread = threading.Thread(target=_save_in_background, name="face-index-saver", daemon=True)
+            _saver_thread.start()
+    _save_requested.set()
@@ -0,0 +1,246 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from utilities import get_config
+from result_cache import content_key
+from instrumentation import instrumented, timed_import
+from warm_up import mark_loaded
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+face_service_config = config.get("face_service", {})
+
+# Cosine-distance thresholds DeepFace uses to call two faces the same person, for when it cannot tell us itself
+_DEFAULT_COSINE_THRESHOLDS = {
+    "VGG-Face": 0.68, "Facenet": 0.40, "Facenet512": 0.30, "ArcFace": 0.68, "Dlib": 0.07,
+    "SFace": 0.593, "OpenFace": 0.10, "DeepFace": 0.23, "DeepID": 0.015, "GhostFaceNet": 0.65,
+}
+
+
+def cosine_distances(query, candidates):
+    """
+    I compute the cosine distance between one embedding and many, in a single matrix product.
+
+    :param query: Embedding as a 1-D array or list.
+    :param candidates: Embeddings as a 2-D array (one per row) or a list of 1-D embeddings.
+    :return: 1-D float32 array of distances (1 - cosine similarity).
+    """
+    query = np.asarray(query, dtype=np.float32).ravel()
+    candidates = np.atleast_2d(np.asarray(candidates, dtype=np.float32))
+    query_norm = np.linalg.norm(query) or 1.0
+    candidate_norms = np.linalg.norm(candidates, axis=1)
+    candidate_norms[candidate_norms == 0] = 1.0
+    return 1.0 - (candidates @ query) / (candidate_norms * query_norm)
+
+
+class FaceService:
+    """
+    I own the face models of a process: one Haar cascade for finding the face on an ID card and one DeepFace
+    recognition model for embeddings.
+
+    Every face is embedded once: embeddings are kept in an LRU keyed by image content, so verifying a selfie
+    and then enrolling it reuses the same embedding. Verification is a cosine distance between two cached
+    embeddings rather than a second round of detection and inference inside `DeepFace.verify`.
+    """
+
+    def __init__(self, model_name="VGG-Face", detector_backend="opencv", threshold=None, cascade_path=None,
+                 embedding_cache_size=256):
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.threshold = threshold
+        self.cascade_path = cascade_path
+        self.embedding_cache_size = embedding_cache_size
+        self._cascade = None
+        self._deepface = None
+        self._embeddings = OrderedDict()
+        self._batch_supported = None
+        self._lock = threading.Lock()
+        self.stats = {"embeddings": 0, "embedding_hits": 0, "verifications": 0}
+
+    @property
+    def cascade(self):
+        """
+        The Haar cascade, loaded on first use.
+        """
+        with self._lock:
+            if self._cascade is None:
+                self._cascade = cv2.CascadeClassifier(self.cascade_path)
+            return self._cascade
+
+    def _load_model(self):
+        """
+        I import DeepFace and build the recognition model once, and resolve the verification threshold.
+        DeepFace keeps built models in its own cache, which `represent` looks up by name, so building the model
+        here is what loads its weights.
+        """
+        with self._lock:
+            if self._deepface is None:
+                started = time.perf_counter()
+                deepface = timed_import("deepface").DeepFace
+                deepface.build_model(self.model_name)
+                if self.threshold is None:
+                    self.threshold = self._find_threshold()
+                logging.info(f"Face model {self.model_name} loaded, verification threshold {self.threshold}")
+                mark_loaded("face", time.perf_counter() - started)
+                self._deepface = deepface
+        return self._deepface
+
+    def _find_threshold(self):
+        try:
+            from deepface.modules.verification import find_threshold
+            return float(find_threshold(self.model_name, "cosine"))
+        except (ImportError, AttributeError, KeyError, TypeError):
+            return _DEFAULT_COSINE_THRESHOLDS.get(self.model_name, 0.40)
+
+    def _cached_embedding(self, key):
+        with self._lock:
+            embedding = self._embeddings.get(key)
+            if embedding is not None:
+                self._embeddings.move_to_end(key)
+                self.stats["embedding_hits"] += 1
+            return embedding
+
+    def _remember(self, key, embedding):
+        with self._lock:
+            self._embeddings[key] = embedding
+            self._embeddings.move_to_end(key)
+            self.stats["embeddings"] += 1
+            while len(self._embeddings) > self.embedding_cache_size:
+                self._embeddings.popitem(last=False)
+
+    @staticmethod
+    def _image_key(image):
+        """
+        I key an image on its content. A path is keyed on the file's bytes, not its name, since callers such as
+        `validation.detect_and_extract_face` write every face to the same file.
+        """
+        if isinstance(image, np.ndarray):
+            return content_key(image)
+        with open(image, "rb") as f:
+            return content_key(f.read())
+
+    @staticmethod
+    def _first_embedding(representation):
+        if representation and isinstance(representation[0], dict):
+            return np.asarray(representation[0]["embedding"], dtype=np.float32)
+        return np.asarray(representation, dtype=np.float32)
+
+    def embed(self, image, key=None):
+        """
+        I return the embedding of the largest face in an image, computing it only the first time I see the image.
+
+        :param image: Face image as a BGR numpy array, or a path.
+        :param key: Cache key. Defaults to a hash of the image content (or of the file's content, for a path).
+        :return: Embedding as a float32 array.
+        """
+        key = key or self._image_key(image)
+        embedding = self._cached_embedding(key)
+        if embedding is not None:
+            return embedding
+        deepface = self._load_model()
+        embedding = self._first_embedding(deepface.represent(
+            img_path=image, model_name=self.model_name, detector_backend=self.detector_backend,
+            enforce_detection=False))
+        self._remember(key, embedding)
+        return embedding
+
+    @instrumented("embed_many")
+    def embed_many(self, images, batch_size=32):
+        """
+        I embed many faces, for enrolment backfills, reusing cached embeddings and embedding repeated images once.
+
+        When the installed DeepFace accepts a list of images in `represent`, each chunk of `batch_size` new images
+        goes through the model in one call; older versions are handled one image at a time.
+
+        :param images: Iterable of BGR numpy arrays or paths.
+        :param batch_size: Number of images per model call.
+        :return: List of float32 embeddings, in input order.
+        """
+        images = list(images)
+        keys = [self._image_key(image) for image in images]
+        embeddings = {key: self._cached_embedding(key) for key in set(keys)}
+        missing = [key for key, embedding in embeddings.items() if embedding is None]
+        first_image = {key: image for key, image in zip(reversed(keys), reversed(images))}
+
+        deepface = self._load_model() if missing else None
+        for start in range(0, len(missing), batch_size):
+            chunk = missing[start:start + batch_size]
+            results = None
+            if self._batch_supported is not False and len(chunk) > 1:
+                try:
+                    results = deepface.represent(img_path=[first_image[key] for key in chunk],
+                                                 model_name=self.model_name,
+                                                 detector_backend=self.detector_backend, enforce_detection=False)
+                    if len(results) != len(chunk) or not all(isinstance(r, list) for r in results):
+                        raise TypeError("represent returned a single result for a list of images")
+                    self._batch_supported = True
+                except (TypeError, ValueError, AttributeError) as e:
+                    logging.info(f"DeepFace cannot embed a list of images, embedding one at a time: {e}")
+                    self._batch_supported = False
+                    results = None
+            for i, key in enumerate(chunk):
+                if results is not None:
+                    embedding = self._first_embedding(results[i])
+                    self._remember(key, embedding)
+                else:
+                    embedding = self.embed(first_image[key], key=key)
+                embeddings[key] = embedding
+
+        return [embeddings[key] for key in keys]
+
+    def verify(self, image1, image2):
+        """
+        I check whether two images show the same person by comparing their (cached) embeddings.
+
+        :param image1: First face, as a BGR numpy array or a path.
+        :param image2: Second face, as a BGR numpy array or a path.
+        :return: A tuple (verified, distance).
+        """
+        embedding1 = self.embed(image1)
+        embedding2 = self.embed(image2)
+        distance = float(cosine_distances(embedding1, embedding2[np.newaxis, :])[0])
+        with self._lock:
+            self.stats["verifications"] += 1
+        return distance <= self.threshold, distance
+
+    def warm_up(self):
+        """
+        I load the cascade and the recognition model and run one embedding, so the first request is not slowed
+        down by loading weights.
+        """
+        _ = self.cascade
+        self.embed(np.zeros((224, 224, 3), np.uint8), key="warm-up")
+
+    def snapshot(self):
+        """
+        I return the service counters along with the number of cached embeddings.
+        """
+        with self._lock:
+            return dict(self.stats, cached=len(self._embeddings), model=self.model_name, threshold=self.threshold)
+
+
+_face_service = None
+_face_service_lock = threading.Lock()
+
+
+def get_face_service(cascade_path=None):
+    """
+    I return the process-wide face service, created from the `face_service` configuration section.
+
+    :param cascade_path: Haar cascade file, used only when the service is first created.
+    """
+    global _face_service
+    with _face_service_lock:
+        if _face_service is None:
+            _face_service = FaceService(
+                model_name=face_service_config.get("model_name", "VGG-Face"),
+                detector_backend=face_service_config.get("detector_backend", "opencv"),
+                threshold=face_service_config.get("threshold"),
+                cascade_path=cascade_path,
+                embedding_cache_size=face_service_config.get("embedding_cache_size", 256),
+            )
+        return _face_service
@@ -0,0 +1,338 @@
+import re
+import logging
+from datetime import date
+from instrumentation import instrumented
+
+# Verhoeff tables used by the Aadhaar check digit
+_VERHOEFF_MULTIPLY = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9),
+    (1, 2, 3, 4, 0, 6, 7, 8, 9, 5),
+    (2, 3, 4, 0, 1, 7, 8, 9, 5, 6),
+    (3, 4, 0, 1, 2, 8, 9, 5, 6, 7),
+    (4, 0, 1, 2, 3, 9, 5, 6, 7, 8),
+    (5, 9, 8, 7, 6, 0, 4, 3, 2, 1),
+    (6, 5, 9, 8, 7, 1, 0, 4, 3, 2),
+    (7, 6, 5, 9, 8, 2, 1, 0, 4, 3),
+    (8, 7, 6, 5, 9, 3, 2, 1, 0, 4),
+    (9, 8, 7, 6, 5, 4, 3, 2, 1, 0),
+)
+_VERHOEFF_PERMUTE = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9),
+    (1, 5, 7, 6, 2, 8, 3, 0, 9, 4),
+    (5, 8, 0, 3, 7, 9, 6, 1, 4, 2),
+    (8, 9, 1, 6, 0, 4, 3, 5, 2, 7),
+    (9, 4, 5, 3, 1, 2, 6, 8, 7, 0),
+    (4, 2, 8, 6, 5, 7, 3, 9, 0, 1),
+    (2, 7, 9, 3, 8, 0, 6, 4, 1, 5),
+    (7, 0, 4, 6, 9, 1, 3, 2, 5, 8),
+)
+
+# Characters EasyOCR commonly confuses, used to repair fields whose positions must be digits or letters
+_TO_DIGIT = str.maketrans({"O": "0", "D": "0", "Q": "0", "I": "1", "L": "1", "Z": "2", "S": "5", "B": "8", "G": "6"})
+_TO_LETTER = str.maketrans({"0": "O", "1": "I", "2": "Z", "5": "S", "8": "B", "6": "G"})
+
+# Fourth character of a PAN: the kind of holder (person, company, HUF, firm, trust, ...)
+_PAN_HOLDER_TYPES = set("ABCFGHJLPT")
+
+# Two-letter state and union territory codes that start an Indian driving licence number
+_DL_STATE_CODES = {
+    "AN", "AP", "AR", "AS", "BR", "CG", "CH", "DD", "DL", "DN", "GA", "GJ", "HP", "HR", "JH", "JK", "KA",
+    "KL", "LA", "LD", "MH", "ML", "MN", "MP", "MZ", "NL", "OD", "OR", "PB", "PY", "RJ", "SK", "TN", "TR",
+    "TS", "UK", "UP", "WB",
+}
+
+_SPLIT_PATTERN = re.compile(r"[|\n]+")
+_NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z .']+$")
+
+_TOKEN_PATTERN = re.compile(r"[A-Z0-9]+")
+# Digits next to the match, even after a separator, mean a longer number such as a 16-digit Virtual ID
+_AADHAAR_PATTERN = re.compile(r"(?<!\d)(?<!\d[\s-])(\d{4}[\s-]?\d{4}[\s-]?\d{4})(?![\s-]?\d)")
+_DL_PATTERN = re.compile(r"\b([A-Z]{2})[\s-]?(\d{2})[\s-]?(\d{4})\s?(\d{7})\b")
+
+_PAN_ID_LABEL = re.compile(r"permanent\s+account\s+number", re.IGNORECASE)
+_PAN_NAME_ANCHOR = re.compile(r"(govt|government)\s+of\s+india", re.IGNORECASE)
+_NAME_LABEL = re.compile(r"\bname\b[\s:]*(.*)$", re.IGNORECASE)
+_FATHER_LABEL = re.compile(r"father|s/o|d/o|w/o|son of|daughter of|wife of", re.IGNORECASE)
+_AADHAAR_DETAIL_LABEL = re.compile(r"\b(dob|d\.o\.b|date of birth|year of birth|yob|male|female)\b", re.IGNORECASE)
+# Whole words only, so names such as "Kamalesh" or "Ricardo" are not mistaken for the "male" or "card" labels
+_NOT_A_NAME = re.compile(
+    r"\b(government|india|govt|income|tax|department|permanent|account|number|card|signature|"
+    r"aadhaar|aadhar|unique|identification|authority|driving|licen[cs]e|union|transport|male|female|"
+    r"dob|birth|address|valid|issue|date|name)\b",
+    re.IGNORECASE,
+)
+
+
+def verhoeff_is_valid(number):
+    """
+    I check a number against its trailing Verhoeff check digit, as used by Aadhaar.
+
+    :param number: String of digits, check digit last.
+    :return: True if the check digit matches.
+    """
+    check = 0
+    for position, digit in enumerate(reversed(number)):
+        check = _VERHOEFF_MULTIPLY[check][_VERHOEFF_PERMUTE[position % 8][int(digit)]]
+    return check == 0
+
+
+def pan_is_valid(pan):
+    """
+    I check the structure of a PAN: five letters, four digits and a letter, with a known holder type
+    in the fourth position.
+
+    The algorithm behind the final check letter is not published, so only its position is checked.
+
+    :param pan: Candidate PAN in upper case.
+    :return: True if the PAN is well formed.
+    """
+    return (
+        len(pan) == 10
+        and pan[:5].isalpha() and pan[5:9].isdigit() and pan[9].isalpha()
+        and pan[3] in _PAN_HOLDER_TYPES
+    )
+
+
+def tokenise(data_string):
+    """
+    I split the `|`-joined OCR output into clean, non-empty fragments, once per document.
+
+    :param data_string: Raw OCR output.
+    :return: List of stripped fragments in reading order.
+    """
+    return [fragment.strip() for fragment in _SPLIT_PATTERN.split(data_string) if fragment.strip()]
+
+
+def _clean_name(text):
+    """
+    I tidy a candidate name and return it, or an empty string if it does not look like a name.
+    """
+    text = " ".join(text.replace(":", " ").split())
+    if len(text) < 3 or not _NAME_PATTERN.match(text) or _NOT_A_NAME.search(text):
+        return ""
+    return text
+
+
+def _name_after_label(fragments):
+    """
+    I find the name printed after a "Name" label, on the same fragment or the next one.
+
+    :return: A tuple (name, confidence).
+    """
+    for i, fragment in enumerate(fragments):
+        match = _NAME_LABEL.search(fragment)
+        if not match or _FATHER_LABEL.search(fragment):
+            continue
+        name = _clean_name(match.group(1))
+        if name:
+            return name, 0.9
+        if i + 1 < len(fragments):
+            name = _clean_name(fragments[i + 1])
+            if name:
+                return name, 0.85
+    return "", 0.0
+
+
+def _first_name_like(fragments):
+    """
+    I fall back to the first fragment that looks like a person's name.
+
+    :return: A tuple (name, confidence).
+    """
+    for fragment in fragments:
+        name = _clean_name(fragment)
+        if name and len(name.split()) > 1:
+            return name, 0.5
+    return "", 0.0
+
+
+def _pan_candidates(fragment):
+    """
+    I yield the 10-character PAN candidates of a fragment: single words, and runs of adjacent words that make
+    exactly 10 characters together, such as "ABCPE 1234 F". Labels on the same fragment stay separate words,
+    so "Permanent Account Number ABCPE1234F" still gives "ABCPE1234F".
+    """
+    tokens = _TOKEN_PATTERN.findall(fragment.upper())
+    for start in range(len(tokens)):
+        candidate = ""
+        for token in tokens[start:]:
+            candidate += token
+            if len(candidate) >= 10:
+                break
+        if len(candidate) == 10:
+            yield candidate
+
+
+def _extract_pan(fragments):
+    """
+    I extract the PAN and the holder's name from the fragments of a PAN card.
+    """
+    pan, pan_confidence = "", 0.0
+    for fragment in fragments:
+        for candidate in _pan_candidates(fragment):
+            if pan_is_valid(candidate):
+                pan, pan_confidence = candidate, 1.0
+                break
+            # Repair letters read as digits and digits read as letters, position by position
+            repaired = candidate[:5].translate(_TO_LETTER) + candidate[5:9].translate(_TO_DIGIT) + \
+                candidate[9].translate(_TO_LETTER)
+            if not pan and pan_is_valid(repaired):
+                # Keep the first repaired match; a later exact match still replaces it
+                pan, pan_confidence = repaired, 0.8
+        if pan_confidence == 1.0:
+            break
+
+    name, name_confidence = _name_after_label(fragments)
+    if not name:
+        # Older cards print the name right after the "GOVT OF INDIA" banner
+        for i, fragment in enumerate(fragments[:-1]):
+            if _PAN_NAME_ANCHOR.search(fragment):
+                name = _clean_name(fragments[i + 1])
+                if name:
+                    name_confidence = 0.8
+                    break
+    if not name:
+        name, name_confidence = _first_name_like(fragments)
+
+    return pan, pan_confidence, name, name_confidence
+
+
+def _extract_aadhaar(fragments):
+    """
+    I extract the Aadhaar number and the holder's name from the fragments of an Aadhaar card.
+    """
+    number, number_confidence = "", 0.0
+    for fragment in fragments:
+        for candidate in _AADHAAR_PATTERN.findall(fragment.upper().translate(_TO_DIGIT)):
+            digits = candidate.replace(" ", "").replace("-", "")
+            # Aadhaar numbers never start with 0 or 1, and the last digit is a Verhoeff check digit
+            if digits[0] not in "01" and verhoeff_is_valid(digits):
+                number, number_confidence = digits, 1.0 if candidate in fragment else 0.85
+                break
+        if number:
+            break
+
+    name, name_confidence = _name_after_label(fragments)
+    if not name:
+        # The name is printed just above the date of birth and gender lines
+        for i, fragment in enumerate(fragments[1:], start=1):
+            if _AADHAAR_DETAIL_LABEL.search(fragment):
+                name = _clean_name(fragments[i - 1])
+                if name:
+                    name_confidence = 0.8
+                    break
+    if not name:
+        name, name_confidence = _first_name_like(fragments)
+
+    return number, number_confidence, name, name_confidence
+
+
+def _extract_driving_license(fragments):
+    """
+    I extract the licence number and the holder's name from the fragments of a driving licence.
+    """
+    number, number_confidence = "", 0.0
+    this_year = date.today().year
+    for fragment in fragments:
+        for state, rto, year, serial in _DL_PATTERN.findall(fragment.upper()):
+            # The number is state code, RTO code, year of issue and a serial
+            if state in _DL_STATE_CODES and 1950 <= int(year) <= this_year:
+                number, number_confidence = f"{state}{rto}{year}{serial}", 0.95
+                break
+        if number:
+            break
+
+    name, name_confidence = _name_after_label(fragments)
+    if not name:
+        name, name_confidence = _first_name_like(fragments)
+
+    return number, number_confidence, name, name_confidence
+
+
+# Extractor and stored ID type for each option of the app's sidebar
+DOCUMENT_TYPES = {
+    "PAN": ("PAN", _extract_pan),
+    "Aadhar": ("Aadhaar", _extract_aadhaar),
+    "Driving License": ("Driving License", _extract_driving_license),
+}
+
+
+@instrumented("extract_id_information")
+def extract_id_information(data_string, option):
+    """
+    I extract the ID number and name from OCR output for the selected ID card type.
+
+    I split the text into fragments once, look for the ID number with the precompiled pattern for the card
+    type and validate it (Verhoeff check digit for Aadhaar, structure and holder type for PAN, state code and
+    year for driving licences). An ID number that fails validation is dropped, so garbage reads never reach
+    the database.
+
+    :param data_string: Raw OCR output, fragments joined by `|`.
+    :param option: ID card type as offered in the sidebar: "PAN", "Aadhar" or "Driving License".
+    :return: Dictionary with "ID", "Name", "ID Type", "Confidence" (per-field score between 0 and 1)
+             and "Valid" (True when a validated ID number was found).
+    """
+    if option not in DOCUMENT_TYPES:
+        raise ValueError(f"Unsupported ID card type: {option}")
+    id_type, extractor = DOCUMENT_TYPES[option]
+
+    extracted_info = {
+        "ID": "",
+        "Name": "",
+        "ID Type": id_type,
+        "Confidence": {"ID": 0.0, "Name": 0.0},
+        "Valid": False,
+    }
+
+    try:
+        fragments = tokenise(data_string or "")
+        id_number, id_confidence, name, name_confidence = extractor(fragments)
+        extracted_info.update({
+            "ID": id_number,
+            "Name": name,
+            "Confidence": {"ID": id_confidence, "Name": name_confidence},
+            "Valid": bool(id_number),
+        })
+
+    except Exception as e:
+        logging.exception(f"Unexpected error during {id_type} information extraction: {e}")
+
+    # Logging if fields are missing
+    if not extracted_info["ID"]:
+        logging.warning(f"{id_type} number could not be extracted or failed validation.")
+    if not extracted_info["Name"]:
+        logging.warning("Name could not be extracted.")
+    logging.debug("Extracted %s information: %s", id_type, extracted_info)
+
+    return extracted_info
+
+
+@instrumented("extract_id_information_from_fields")
+def extract_id_information_from_fields(field_texts, option):
+    """
+    I build the extraction result from text read off the known field regions of a card.
+
+    The ID field holds only the number (and perhaps its label), so the card type's pattern and validation run on
+    it alone, and the name field holds only the name, so no keyword heuristics are needed to find it.
+
+    :param field_texts: Dictionary with the "ID" and "Name" text from `ocr.recognize_fields`.
+    :param option: ID card type as offered in the sidebar: "PAN", "Aadhar" or "Driving License".
+    :return: Dictionary in the same format as `extract_id_information`.
+    """
+    if option not in DOCUMENT_TYPES:
+        raise ValueError(f"Unsupported ID card type: {option}")
+    id_type, extractor = DOCUMENT_TYPES[option]
+
+    id_number, id_confidence, _, _ = extractor(tokenise(field_texts.get("ID", "")))
+    name_text = field_texts.get("Name", "")
+    label = _NAME_LABEL.search(name_text)
+    name = _clean_name(label.group(1) if label else name_text)
+    extracted_info = {
+        "ID": id_number,
+        "Name": name,
+        "ID Type": id_type,
+        "Confidence": {"ID": id_confidence, "Name": 0.95 if name else 0.0},
+        "Valid": bool(id_number),
+    }
+    logging.debug("Extracted %s information from field regions: %s", id_type, extracted_info)
+    return extracted_info
@@ -0,0 +1,295 @@
+import struct
+import logging
+import threading
+import cv2
+import numpy as np
+from utilities import get_config
+from instrumentation import instrumented
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+ingestion_config = config.get("ingestion", {})
+
+_MEGABYTE = 1024 * 1024
+_JPEG_SIGNATURE = b"\xff\xd8"
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Start-of-frame markers carry the image size; C4 (DHT), C8 (JPG) and CC (DAC) share the range but do not
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_EXIF_ORIENTATION_TAG = 0x0112
+# Bytes read from a stream at a time
+_CHUNK_SIZE = 64 * 1024
+# OpenCV decodes JPEG straight to 1/2, 1/4 or 1/8 scale by skipping DCT coefficients
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+# How to turn an image stored with each EXIF orientation upright
+_ORIENTATION_FIXES = {
+    2: lambda img: cv2.flip(img, 1),
+    3: lambda img: cv2.rotate(img, cv2.ROTATE_180),
+    4: lambda img: cv2.flip(img, 0),
+    5: lambda img: cv2.transpose(img),
+    6: lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE),
+    7: lambda img: cv2.flip(cv2.transpose(img), -1),
+    8: lambda img: cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE),
+}
+
+
+class UploadRejected(ValueError):
+    """
+    Raised when an upload is refused before or during decoding. The message says why, for the user.
+    """
+
+
+def _limit(name, default):
+    return ingestion_config.get(name, default)
+
+
+def read_upload(source, max_bytes=None):
+    """
+    I read an upload in chunks and stop as soon as it exceeds `max_bytes`, so an oversized file is never held
+    in memory in full.
+
+    :param source: Bytes, or a binary file-like object.
+    :param max_bytes: Largest accepted size. Defaults to `ingestion.max_upload_megabytes`.
+    :return: The upload as bytes.
+    :raises UploadRejected: If the upload is larger than `max_bytes`.
+    """
+    max_bytes = max_bytes or int(_limit("max_upload_megabytes", 20) * _MEGABYTE)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        if len(source) > max_bytes:
+            raise UploadRejected(f"The file is larger than {max_bytes // _MEGABYTE} MB")
+        return bytes(source)
+
+    chunks = []
+    size = 0
+    while True:
+        chunk = source.read(_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadRejected(f"The file is larger than {max_bytes // _MEGABYTE} MB")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _exif_orientation(tiff):
+    """
+    I read the orientation tag from the TIFF structure inside a JPEG's Exif segment.
+
+    :return: Orientation between 1 and 8, or 1 if the tag is missing or unreadable.
+    """
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return 1
+    try:
+        (ifd_offset,) = struct.unpack_from(order + "I", tiff, 4)
+        (entries,) = struct.unpack_from(order + "H", tiff, ifd_offset)
+        for entry in range(entries):
+            tag, _, _, value = struct.unpack_from(order + "HHIH", tiff, ifd_offset + 2 + entry * 12)
+            if tag == _EXIF_ORIENTATION_TAG:
+                return value if 1 <= value <= 8 else 1
+    except struct.error:
+        pass
+    return 1
+
+
+def _jpeg_header(data):
+    """
+    I walk the JPEG markers up to the first frame header, without decoding any pixels.
+    """
+    orientation = 1
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            raise UploadRejected("The JPEG file is corrupt")
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            position += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, position + 2)
+        segment = data[position + 4:position + 2 + length]
+        if marker == 0xE1 and segment[:6] == b"Exif\x00\x00":
+            orientation = _exif_orientation(segment[6:])
+        elif marker in _JPEG_SOF_MARKERS and len(segment) >= 5:
+            height, width = struct.unpack_from(">HH", segment, 1)
+            return {"format": "jpeg", "width": width, "height": height, "orientation": orientation}
+        elif marker == 0xDA:
+            break
+        position += 2 + length
+    raise UploadRejected("The JPEG file has no image header")
+
+
+def _png_header(data):
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        raise UploadRejected("The PNG file has no image header")
+    width, height = struct.unpack_from(">II", data, 16)
+    return {"format": "png", "width": width, "height": height, "orientation": 1}
+
+
+def _webp_header(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        width, height = struct.unpack_from("<HH", data, 26)
+        width, height = width & 0x3FFF, height & 0x3FFF
+    elif chunk == b"VP8L" and len(data) >= 25:
+        (bits,) = struct.unpack_from("<I", data, 21)
+        width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    elif chunk == b"VP8X" and len(data) >= 30:
+        width = 1 + int.from_bytes(data[24:27], "little")
+        height = 1 + int.from_bytes(data[27:30], "little")
+    else:
+        raise UploadRejected("The WebP file has no image header")
+    return {"format": "webp", "width": width, "height": height, "orientation": 1}
+
+
+def parse_header(data):
+    """
+    I identify the image format from its signature and read the pixel dimensions from the header.
+
+    :param data: Upload bytes; only the header is looked at.
+    :return: Dictionary with "format" ("jpeg", "png" or "webp"), "width", "height" and the EXIF "orientation".
+    :raises UploadRejected: If the format is not recognised or the header is truncated.
+    """
+    try:
+        if data[:2] == _JPEG_SIGNATURE:
+            return _jpeg_header(data)
+        if data[:8] == _PNG_SIGNATURE:
+            return _png_header(data)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _webp_header(data)
+    except struct.error:
+        raise UploadRejected("The image header is truncated")
+    raise UploadRejected("Unsupported file type; please upload a JPEG, PNG or WebP image")
+
+
+def validate_header(header):
+    """
+    I check a parsed header against the configured limits, before anything is decoded.
+
+    :param header: Result of `parse_header`.
+    :raises UploadRejected: If the format is not allowed or the dimensions are out of range.
+    """
+    allowed = _limit("allowed_formats", ["jpeg", "png", "webp"])
+    if header["format"] not in allowed:
+        raise UploadRejected(f"{header['format'].upper()} images are not accepted")
+    width, height = header["width"], header["height"]
+    if width == 0 or height == 0:
+        raise UploadRejected("The image has no pixels")
+    min_side = _limit("min_side", 200)
+    if min(width, height) < min_side:
+        raise UploadRejected(f"The image is too small; it must be at least {min_side} pixels on each side")
+    max_side = _limit("max_side", 12000)
+    if max(width, height) > max_side:
+        raise UploadRejected(f"The image is too large; it must be at most {max_side} pixels on each side")
+    max_pixels = int(_limit("max_megapixels", 50) * 1_000_000)
+    if width * height > max_pixels:
+        raise UploadRejected(f"The image has more than {max_pixels // 1_000_000} megapixels")
+
+
+class MemoryBudget:
+    """
+    I cap the bytes of decoded pixels one request may hold, across all of its images.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or int(_limit("request_memory_megabytes", 160) * _MEGABYTE)
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes, what="image"):
+        """
+        I account for `nbytes` about to be allocated.
+
+        :raises UploadRejected: If the request would go over its budget.
+        """
+        with self._lock:
+            if self.used + nbytes > self.max_bytes:
+                raise UploadRejected(f"The {what} needs more memory than a request is allowed")
+            self.used += nbytes
+
+
+def reduction_factor(header, decode_max_side=None):
+    """
+    I pick the largest JPEG scale-down (1, 2, 4 or 8) that keeps the longer side at least `decode_max_side`.
+
+    Other formats are always decoded at full size, since OpenCV would decode them fully and resize afterwards.
+
+    :param header: Result of `parse_header`.
+    :param decode_max_side: Target longer side. Defaults to `ingestion.decode_max_side`.
+    """
+    decode_max_side = decode_max_side or _limit("decode_max_side", 2000)
+    if header["format"] != "jpeg":
+        return 1
+    longer_side = max(header["width"], header["height"])
+    for factor in (8, 4, 2):
+        if longer_side / factor >= decode_max_side:
+            return factor
+    return 1
+
+
+def apply_orientation(img, orientation):
+    """
+    I turn a decoded image upright according to its EXIF orientation (1 to 8).
+
+    :param img: Image as stored in the file.
+    :param orientation: EXIF orientation from `parse_header`.
+    :return: The upright image; the same array when no change is needed.
+    """
+    fix = _ORIENTATION_FIXES.get(orientation)
+    return fix(img) if fix else img
+
+
+@instrumented("ingest_image")
+def decode_image(data, header=None, budget=None, decode_max_side=None):
+    """
+    I decode a validated upload to a BGR array, at reduced scale when the format allows it.
+
+    OpenCV applies the EXIF orientation at full scale but not with the reduced-scale flags, so I always decode
+    ignoring it and rotate the image myself from the header; the returned image is upright on both paths.
+
+    :param data: Upload bytes.
+    :param header: Result of `parse_header`; parsed and validated here when not given.
+    :param budget: `MemoryBudget` of the request. A budget of one request is used when not given.
+    :param decode_max_side: Target longer side. Defaults to `ingestion.decode_max_side`.
+    :return: Image as a numpy array.
+    :raises UploadRejected: If the upload is refused or cannot be decoded.
+    """
+    if header is None:
+        header = parse_header(data)
+        validate_header(header)
+    factor = reduction_factor(header, decode_max_side)
+    decoded_bytes = -(-header["width"] // factor) * -(-header["height"] // factor) * 3
+    max_decoded = int(_limit("max_decoded_megabytes", 64) * _MEGABYTE)
+    if decoded_bytes > max_decoded:
+        raise UploadRejected("The image is too large to process")
+    (budget or MemoryBudget()).reserve(decoded_bytes)
+
+    flags = _REDUCED_FLAGS.get(factor, cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if img is None:
+        raise UploadRejected("The image could not be decoded")
+    img = apply_orientation(img, header.get("orientation", 1))
+    if factor > 1:
+        logging.debug("Decoded %sx%s %s at 1/%s scale", header["width"], header["height"], header["format"], factor)
+    return img
+
+
+def ingest(source, budget=None):
+    """
+    I read, check and decode one upload: size first, then format and dimensions from the header, then pixels.
+
+    :param source: Bytes or a binary file-like object.
+    :param budget: `MemoryBudget` of the request.
+    :return: Image as a numpy array.
+    :raises UploadRejected: If the upload is refused at any step.
+    """
+    data = read_upload(source)
+    header = parse_header(data)
+    validate_header(header)
+    return decode_image(data, header, budget)
@@ -0,0 +1,311 @@
+import os
+import json
+import time
+import sys
+import bisect
+import logging
+import importlib
+import functools
+import threading
+from contextlib import contextmanager
+from utilities import get_config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+logging_config = config.get("logging", {})
+instrumentation_config = config.get("instrumentation", {})
+
+# Upper bounds, in seconds, of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_logging_configured = False
+_logging_lock = threading.Lock()
+
+
+def configure_logging(level=None, log_file=None):
+    """
+    I set up logging for the whole application once, from the `logging` configuration section.
+
+    Entry points (the Streamlit app, the batch CLI, the HTTP service) call me; library modules only log.
+    Calling me again does nothing, so every entry point can call me without checking.
+
+    :param level: Level name such as "INFO". Defaults to `logging.level`.
+    :param log_file: Log file path. Defaults to `logging.file`.
+    """
+    global _logging_configured
+    with _logging_lock:
+        if _logging_configured:
+            return
+        log_file = log_file or logging_config.get("file", os.path.join("logs", "ekyc_logs.log"))
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+        logging.basicConfig(filename=log_file,
+                            level=getattr(logging, (level or logging_config.get("level", "INFO")).upper()),
+                            format=logging_config.get("format", "[%(levelname)s]: %(message)s"),
+                            filemode="a")
+        _logging_configured = True
+
+
+_log_counts = {}
+_log_counts_lock = threading.Lock()
+
+
+def log_sampled(key, level, message, *args, every=None):
+    """
+    I log only one in `every` messages sharing `key`, for lines on the per-request hot path.
+
+    The message is formatted lazily by `logging`, so skipped and filtered lines cost a counter increment.
+
+    :param key: Name grouping the messages that are sampled together.
+    :param level: Logging level, such as `logging.INFO`.
+    :param message: %-style format string.
+    :param every: Sampling period. Defaults to `logging.sample_every`; 1 logs every message.
+    """
+    every = every or logging_config.get("sample_every", 1)
+    with _log_counts_lock:
+        count = _log_counts.get(key, 0)
+        _log_counts[key] = count + 1
+    if count % every == 0 and logging.getLogger().isEnabledFor(level):
+        logging.log(level, message, *args)
+
+
+def current_rss_bytes():
+    """
+    I return the resident set size of this process in bytes, or 0 if it cannot be read.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS; it is a peak, the closest available figure
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if peak > 1 << 32 else peak * 1024
+    return 0
+
+
+class StageMetrics:
+    """
+    I collect, per stage, a latency histogram, call and error counts, and the peak resident memory seen.
+
+    The RSS is read when a stage ends, so "peak_rss_bytes" is the largest process footprint observed at the
+    end of that stage and "max_rss_growth_bytes" the largest growth across one call. Stages running in other
+    threads at the same time share the process, so treat the memory figures as an upper bound per stage.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage):
+        entry = self._stages.get(stage)
+        if entry is None:
+            entry = self._stages[stage] = {
+                "count": 0, "errors": 0, "sum": 0.0, "max": 0.0,
+                "buckets": [0] * (len(self.buckets) + 1),
+                "peak_rss_bytes": 0, "max_rss_growth_bytes": 0,
+            }
+        return entry
+
+    def observe(self, stage, seconds, rss_before=0, rss_after=0, error=False):
+        """
+        I record one call of a stage.
+
+        :param stage: Stage name, such as "extract_text" or "db.check_duplicacy".
+        :param seconds: Wall-clock duration of the call.
+        :param rss_before: RSS in bytes when the call started, or 0 if not measured.
+        :param rss_after: RSS in bytes when the call ended, or 0 if not measured.
+        :param error: Whether the call raised.
+        """
+        with self._lock:
+            entry = self._stage(stage)
+            entry["count"] += 1
+            entry["errors"] += int(error)
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+            entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], rss_after)
+            if rss_before and rss_after:
+                entry["max_rss_growth_bytes"] = max(entry["max_rss_growth_bytes"], rss_after - rss_before)
+
+    @staticmethod
+    def _quantile(buckets, bounds, count, q):
+        """
+        I estimate a quantile from histogram counts by interpolating inside the bucket that holds it.
+        """
+        rank = q * count
+        cumulative = 0
+        lower = 0.0
+        for upper, bucket_count in zip(bounds, buckets):
+            if cumulative + bucket_count >= rank and bucket_count:
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+            lower = upper
+        return bounds[-1] if bounds else 0.0
+
+    def snapshot(self):
+        """
+        I return the metrics of every stage as plain dictionaries, with estimated p50, p95 and p99 latencies.
+        """
+        with self._lock:
+            stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in self._stages.items()}
+        for entry in stages.values():
+            # The overflow bucket is capped at the largest latency seen
+            bounds = list(self.buckets) + [max(entry["max"], self.buckets[-1])]
+            for q in (0.5, 0.95, 0.99):
+                entry[f"p{int(q * 100)}"] = self._quantile(entry["buckets"], bounds, entry["count"], q)
+            entry["mean"] = entry["sum"] / entry["count"] if entry["count"] else 0.0
+        return {"bucket_bounds": list(self.buckets), "stages": stages}
+
+    def prometheus_text(self):
+        """
+        I render the metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            stages = {stage: dict(entry, buckets=list(entry["buckets"])) for stage, entry in self._stages.items()}
+        lines = [
+            "# HELP ekyc_stage_duration_seconds Duration of e-KYC pipeline stages.",
+            "# TYPE ekyc_stage_duration_seconds histogram",
+        ]
+        for stage, entry in sorted(stages.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["buckets"]):
+                cumulative += count
+                lines.append(f'ekyc_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'ekyc_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'ekyc_stage_duration_seconds_sum{{stage="{stage}"}} {entry["sum"]}')
+            lines.append(f'ekyc_stage_duration_seconds_count{{stage="{stage}"}} {entry["count"]}')
+        for name, key, kind, description in (
+            ("ekyc_stage_errors_total", "errors", "counter", "Stage calls that raised."),
+            ("ekyc_stage_peak_rss_bytes", "peak_rss_bytes", "gauge", "Largest process RSS seen at the end of a stage."),
+            ("ekyc_stage_max_rss_growth_bytes", "max_rss_growth_bytes", "gauge", "Largest RSS growth across one call."),
+        ):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for stage, entry in sorted(stages.items()):
+                lines.append(f'{name}{{stage="{stage}"}} {entry[key]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        I drop every recorded value.
+        """
+        with self._lock:
+            self._stages.clear()
+
+
+metrics = StageMetrics(instrumentation_config.get("buckets", DEFAULT_BUCKETS))
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    I time the enclosed block and record it under `stage` in the process-wide metrics.
+
+    :param stage: Stage name.
+    """
+    if not instrumentation_config.get("enabled", True):
+        yield
+        return
+    track_memory = instrumentation_config.get("track_memory", True)
+    rss_before = current_rss_bytes() if track_memory else 0
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe(stage, seconds, rss_before, current_rss_bytes() if track_memory else 0, error)
+
+
+def instrumented(stage):
+    """
+    I decorate a function so every call is timed and recorded under `stage`.
+
+    :param stage: Stage name.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Seconds spent importing each heavy dependency, filled in by `timed_import`
+import_times = {}
+
+
+def timed_import(name):
+    """
+    I import a module on first use and record how long the import took, so the cost of heavy dependencies
+    (EasyOCR and torch, DeepFace and TensorFlow) shows up in the metrics instead of in an unexplained slow start.
+
+    :param name: Module name, such as "easyocr".
+    :return: The imported module.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    start = time.perf_counter()
+    with stage_timer(f"import.{name}"):
+        module = importlib.import_module(name)
+    import_times.setdefault(name, time.perf_counter() - start)
+    logging.info(f"Imported {name} in {import_times[name]:.2f}s")
+    return module
+
+
+def write_metrics(path=None):
+    """
+    I write the current metrics to a JSON file, replacing it atomically.
+
+    :param path: Output path; "{pid}" is replaced with the process ID. Defaults to `instrumentation.metrics_path`.
+    :return: The path written, or None if no path is configured.
+    """
+    path = path or instrumentation_config.get("metrics_path")
+    if not path:
+        return None
+    # "{pid}" in the path gives every worker process its own file
+    path = path.format(pid=os.getpid())
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(dict(metrics.snapshot(), pid=os.getpid(), written_at=time.time()), f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+_last_write = 0.0
+_last_write_lock = threading.Lock()
+
+
+def maybe_write_metrics():
+    """
+    I write the metrics file if `instrumentation.write_interval` seconds have passed since the last write.
+
+    The pipeline calls me after every request, so the file stays current without a background thread.
+    """
+    global _last_write
+    if not instrumentation_config.get("metrics_path"):
+        return None
+    now = time.monotonic()
+    with _last_write_lock:
+        if now - _last_write < instrumentation_config.get("write_interval", 10):
+            return None
+        _last_write = now
+    try:
+        return write_metrics()
+    except OSError as e:
+        logging.warning(f"Could not write the metrics file: {e}")
+        return None
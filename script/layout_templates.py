@@ -0,0 +1,67 @@
+from utilities import get_config
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+layout_config = config.get("layout_ocr", {})
+
+_DIGITS = "0123456789"
+_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_NAME_CHARACTERS = _UPPER + _UPPER.lower() + " .'"
+
+# Where each field sits on a front-facing card, as (left, top, right, bottom) fractions of the card's width and
+# height, with the characters the field may contain. The boxes are generous bands around the printed value, so
+# small misalignments of the card crop still keep the whole value inside.
+# They are estimates, not measurements on real cards, so layout OCR is off by default (`layout_ocr.enabled`).
+# Boxes measured on scans of real card versions go in the `layout_ocr.templates` configuration section, which
+# overrides these per card type and field without a code change; until `layout_ocr.cross_check` is turned off
+# the pipeline still reads the whole card and keeps its name over the Name box's.
+LAYOUT_TEMPLATES = {
+    "PAN": {
+        "ID": {"box": (0.34, 0.27, 0.99, 0.40), "allowlist": _UPPER + _DIGITS},
+        "Name": {"box": (0.34, 0.49, 0.99, 0.60), "allowlist": _NAME_CHARACTERS},
+    },
+    "Aadhar": {
+        "ID": {"box": (0.36, 0.74, 0.99, 0.92), "allowlist": _DIGITS + " "},
+        "Name": {"box": (0.34, 0.25, 0.99, 0.38), "allowlist": _NAME_CHARACTERS},
+    },
+    "Driving License": {
+        "ID": {"box": (0.34, 0.19, 0.99, 0.33), "allowlist": _UPPER + _DIGITS + " -"},
+        "Name": {"box": (0.34, 0.41, 0.99, 0.52), "allowlist": _NAME_CHARACTERS},
+    },
+}
+
+
+def get_template(option):
+    """
+    I return the field layout for an ID card type, or None when the type has no template or layout OCR is off.
+    Boxes and allowlists set under `layout_ocr.templates` replace the built-in ones.
+
+    :param option: ID card type as offered in the sidebar.
+    :return: Dictionary of field name to {"box", "allowlist"}.
+    """
+    if not layout_config.get("enabled", False):
+        return None
+    template = LAYOUT_TEMPLATES.get(option)
+    overrides = (layout_config.get("templates") or {}).get(option)
+    if template is None or not overrides:
+        return template
+    return {field: dict(layout, **{key: tuple(value) if key == "box" else value
+                                   for key, value in overrides.get(field, {}).items()})
+            for field, layout in template.items()}
+
+
+def field_boxes(template, shape):
+    """
+    I turn a template's relative boxes into pixel boxes for a card image of the given shape.
+
+    :param template: Result of `get_template`.
+    :param shape: Shape of the card image, (height, width[, channels]).
+    :return: Dictionary of field name to (x_min, x_max, y_min, y_max), the box format EasyOCR's `recognize` takes.
+    """
+    height, width = shape[:2]
+    boxes = {}
+    for field, layout in template.items():
+        left, top, right, bottom = layout["box"]
+        boxes[field] = (int(left * width), int(right * width), int(top * height), int(bottom * height))
+    return boxes
@@ -1,43 +1,372 @@
 import os
+import time
+import queue
 import logging
-import easyocr
+import threading
+from contextlib import contextmanager
+import cv2
+import numpy as np
+from instrumentation import instrumented, log_sampled, timed_import
+from warm_up import mark_loaded
 
-# Setup logging configuration
-logging_str = "[%(levelname)s]: %(message)s"
+# Number of readers a single (language, device) pool may hold at once
+DEFAULT_READER_POOL_SIZE = 2
 
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(filename=os.path.join(log_dir, "ekyc_logs.log"),
-                    level=logging.INFO, format=logging_str, filemode="a")
 
-def extract_text(image_path, confidence_threshold=0.10, language=['en']):
+def _module_memory_bytes(module):
+    """
+    I add up the bytes held by the parameters and buffers of a torch module.
+
+    :param module: A torch module, or None.
+    :return: Size in bytes, or 0 if the module cannot be inspected.
+    """
+    if module is None:
+        return 0
+    try:
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    except Exception:
+        return 0
+
+
+class ReaderPool:
+    """
+    I hold a bounded set of EasyOCR readers for one language tuple and device.
+
+    Readers are created lazily, up to `size`, and handed out one caller at a time. When every reader
+    is busy, callers wait until one is released instead of loading yet another copy of the weights.
+    """
+
+    def __init__(self, languages, device="auto", size=DEFAULT_READER_POOL_SIZE):
+        self.languages = tuple(languages)
+        self.device = device
+        self.size = max(1, int(size))
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._warmed = set()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0, "waits": 0, "memory_bytes": 0}
+
+    def _load(self):
+        """
+        I load a new EasyOCR reader from disk and record its load and memory counters.
+        """
+        if self.device == "auto":
+            gpu = True
+        elif self.device == "cpu":
+            gpu = False
+        else:
+            gpu = self.device
+
+        # EasyOCR pulls in torch, so it is only imported when the first reader is loaded
+        started = time.perf_counter()
+        easyocr = timed_import("easyocr")
+        logging.info(f"Loading EasyOCR reader for {self.languages} on {self.device}")
+        reader = easyocr.Reader(list(self.languages), gpu=gpu, verbose=False)
+        memory = _module_memory_bytes(getattr(reader, "detector", None)) + \
+            _module_memory_bytes(getattr(reader, "recognizer", None))
+
+        with self._lock:
+            self.stats["loads"] += 1
+            self.stats["memory_bytes"] += memory
+        mark_loaded("ocr", time.perf_counter() - started)
+        return reader
+
+    def acquire(self, timeout=None):
+        """
+        I hand out an idle reader, loading a new one only while the pool is below its size.
+
+        :param timeout: Seconds to wait for a busy reader to be released. None waits forever.
+        :return: An EasyOCR reader. It must be given back with `release`.
+        """
+        try:
+            reader = self._idle.get_nowait()
+            with self._lock:
+                self.stats["hits"] += 1
+            return reader
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                return self._load()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        with self._lock:
+            self.stats["waits"] += 1
+        reader = self._idle.get(timeout=timeout)
+        with self._lock:
+            self.stats["hits"] += 1
+        return reader
+
+    def release(self, reader):
+        """
+        I return a reader to the pool so the next caller can reuse it.
+        """
+        self._idle.put(reader)
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """
+        I lend a reader for the duration of a `with` block.
+        """
+        reader = self.acquire(timeout=timeout)
+        try:
+            yield reader
+        finally:
+            self.release(reader)
+
+    def warm_up(self, count=1):
+        """
+        I load up to `count` readers ahead of time and run each once on a blank image,
+        so the first real request does not pay for model loading or torch initialisation.
+
+        :param count: Number of readers to have loaded, capped at the pool size.
+        """
+        count = min(max(1, int(count)), self.size)
+        blank = np.full((32, 128, 3), 255, dtype=np.uint8)
+        borrowed = []
+        try:
+            for _ in range(count):
+                reader = self.acquire()
+                borrowed.append(reader)
+                if id(reader) not in self._warmed:
+                    reader.readtext(blank)
+                    self._warmed.add(id(reader))
+        finally:
+            for reader in borrowed:
+                self.release(reader)
+
+    def snapshot(self):
+        """
+        I return a copy of the pool counters along with its current size.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["loaded"] = self._created
+        stats["idle"] = self._idle.qsize()
+        stats["size"] = self.size
+        return stats
+
+
+_reader_pools = {}
+_reader_pools_lock = threading.Lock()
+
+
+def get_reader_pool(language=('en',), device="auto", pool_size=DEFAULT_READER_POOL_SIZE):
+    """
+    I return the process-wide reader pool for a language tuple and device, creating it on first use.
+
+    :param language: Iterable of EasyOCR language codes.
+    :param device: "auto" (use the GPU when available), "cpu", or a torch device string such as "cuda:0".
+    :param pool_size: Maximum number of readers for this key. Only used when the pool is first created.
+    :return: The shared `ReaderPool`.
+    """
+    key = (tuple(language), device)
+    with _reader_pools_lock:
+        pool = _reader_pools.get(key)
+        if pool is None:
+            pool = ReaderPool(key[0], device=device, size=pool_size)
+            _reader_pools[key] = pool
+        return pool
+
+
+def warm_up_readers(language=('en',), device="auto", count=1):
+    """
+    I load and exercise EasyOCR readers at startup so later calls to `extract_text` hit a warm pool.
+
+    :param language: Iterable of EasyOCR language codes.
+    :param device: Device of the pool to warm up.
+    :param count: Number of readers to have loaded.
+    """
+    pool = get_reader_pool(language, device)
+    pool.warm_up(count)
+    logging.info(f"EasyOCR readers warmed up: {pool.snapshot()}")
+
+
+def reader_stats():
+    """
+    I report hit, load, wait and memory counters for every reader pool in this process.
+
+    :return: Dictionary keyed by "<languages>@<device>".
+    """
+    with _reader_pools_lock:
+        pools = list(_reader_pools.items())
+    return {f"{'+'.join(languages)}@{device}": pool.snapshot() for (languages, device), pool in pools}
+
+
+def _filter_text(result, confidence_threshold):
+    """
+    I join the recognised fragments above the confidence threshold into the `|`-separated
+    string the postprocessors expect.
+
+    :param result: EasyOCR output as (bounding_box, text, confidence) triples.
+    :param confidence_threshold: Minimum confidence level to include text.
+    :return: Filtered text as a string.
+    """
+    filtered_text = ""
+    for bounding_box, recognized_text, confidence in result:
+        if confidence > confidence_threshold:
+            filtered_text += recognized_text + "|"
+    return filtered_text
+
+
+@instrumented("extract_text")
+def extract_text(image_path, confidence_threshold=0.10, language=['en'], device="auto"):
     """
     I extract text from an image using EasyOCR.
 
     :param image_path: Path to the image file.
     :param confidence_threshold: Minimum confidence level to include text.
     :param language: List of languages for OCR.
+    :param device: Device of the shared reader pool to use.
     :return: Extracted text as a string.
     """
-    
-    logging.info('Text extraction started') 
-    
-    reader = easyocr.Reader(language) 
-    
+
     try:
-        result = reader.readtext(image_path) 
-        filtered_text = "" 
-        for bounding_box, recognized_text, confidence in result:
-            if confidence > confidence_threshold:
-                filtered_text += recognized_text + "|"
-                
+        with get_reader_pool(language, device).reader() as reader:
+            result = reader.readtext(image_path)
+        filtered_text = _filter_text(result, confidence_threshold)
+
         if filtered_text:
-            logging.info('Text extraction completed successfully')
+            log_sampled("extract_text", logging.INFO, "Text extraction completed successfully")
         else:
             logging.info('No text found above the confidence threshold')
-            
+
         return filtered_text
-    
+
     except Exception as e:
         logging.exception(f"An error occurred during text extraction: {e}")
         return ""
+
+
+@instrumented("recognize_fields")
+def recognize_fields(image, template, confidence_threshold=0.10, language=['en'], device="auto"):
+    """
+    I read only the known field regions of a card, each with its own character allowlist.
+
+    EasyOCR's `recognize` skips the CRAFT text detector, which is most of the cost of `readtext`, and runs the
+    recognition model on the given boxes only. Restricting the characters (digits for an Aadhaar number,
+    capitals and digits for a PAN) stops look-alike letters and digits from being swapped.
+
+    :param image: Card image as a BGR numpy array, upright and cropped to the card.
+    :param template: Field layout from `layout_templates.get_template`.
+    :param confidence_threshold: Minimum confidence level to include text.
+    :param language: List of languages for OCR.
+    :param device: Device of the shared reader pool to use.
+    :return: Dictionary of field name to recognised text (empty when nothing passed the threshold).
+    """
+    from layout_templates import field_boxes
+
+    fields = {}
+    with get_reader_pool(language, device).reader() as reader:
+        for field, (x_min, x_max, y_min, y_max) in field_boxes(template, image.shape).items():
+            result = reader.recognize(image, horizontal_list=[[x_min, x_max, y_min, y_max]], free_list=[],
+                                      allowlist=template[field]["allowlist"], detail=1)
+            fields[field] = " ".join(text for _, text, confidence in result if confidence > confidence_threshold)
+    logging.debug("Recognised fields: %s", fields)
+    return fields
+
+
+def _load_batch_item(item):
+    """
+    I turn one batch input into a BGR numpy array.
+
+    :param item: Image as a numpy array, or a path to an image file.
+    :return: A tuple (image, source) where source is the path, or None for in-memory images.
+    """
+    if isinstance(item, np.ndarray):
+        return item, None
+    source = os.fspath(item)
+    image = cv2.imread(source)
+    if image is None:
+        raise ValueError(f"Failed to read image from {source}")
+    return image, source
+
+
+def extract_text_batch(images, confidence_threshold=0.10, language=['en'], device="auto",
+                       batch_size=16, recognizer_batch_size=32):
+    """
+    I extract text from many images, batching the EasyOCR detector and recognizer passes.
+
+    I read `batch_size` images at a time and group the ones with the same shape so the detector can
+    run on them together; the recognizer then handles each image's crops in batches of
+    `recognizer_batch_size`. Results are yielded one per input, in input order, as soon as their
+    chunk is done, so a backfill over a large archive never holds more than one chunk in memory.
+
+    :param images: Iterable of numpy arrays or image paths.
+    :param confidence_threshold: Minimum confidence level to include text.
+    :param language: List of languages for OCR.
+    :param device: Device of the shared reader pool to use.
+    :param batch_size: Number of images read and detected per chunk.
+    :param recognizer_batch_size: Number of text crops per recognizer pass.
+    :return: Generator of dictionaries with keys "index", "source", "text", "timings" and "error".
+             "text" has the same format as `extract_text`; "timings" holds per-image seconds for
+             "load", "ocr" (the group time shared across its images) and "total".
+    """
+    pool = get_reader_pool(language, device)
+    batch_size = max(1, int(batch_size))
+    iterator = iter(images)
+    index = 0
+
+    while True:
+        chunk = []
+        for item in iterator:
+            chunk.append(item)
+            if len(chunk) == batch_size:
+                break
+        if not chunk:
+            return
+
+        results = []
+        groups = {}
+        for offset, item in enumerate(chunk):
+            result = {"index": index + offset, "source": None, "text": "",
+                      "timings": {"load": 0.0, "ocr": 0.0, "total": 0.0}, "error": None}
+            start = time.perf_counter()
+            try:
+                image, result["source"] = _load_batch_item(item)
+                groups.setdefault(image.shape, []).append((offset, image))
+            except Exception as e:
+                logging.exception(f"Failed to load batch image {index + offset}: {e}")
+                result["error"] = str(e)
+            if isinstance(item, (str, os.PathLike)) and result["source"] is None:
+                result["source"] = os.fspath(item)
+            result["timings"]["load"] = time.perf_counter() - start
+            results.append(result)
+
+        with pool.reader() as reader:
+            for members in groups.values():
+                offsets = [offset for offset, _ in members]
+                start = time.perf_counter()
+                try:
+                    if len(members) == 1:
+                        outputs = [reader.readtext(members[0][1], batch_size=recognizer_batch_size)]
+                    else:
+                        outputs = reader.readtext_batched([image for _, image in members],
+                                                          batch_size=recognizer_batch_size)
+                    for offset, output in zip(offsets, outputs):
+                        results[offset]["text"] = _filter_text(output, confidence_threshold)
+                except Exception as e:
+                    logging.exception(f"An error occurred during batched text extraction: {e}")
+                    for offset in offsets:
+                        results[offset]["error"] = str(e)
+                shared = (time.perf_counter() - start) / len(members)
+                for offset in offsets:
+                    results[offset]["timings"]["ocr"] = shared
+
+        for result in results:
+            timings = result["timings"]
+            timings["total"] = timings["load"] + timings["ocr"]
+            yield result
+
+        logging.info(f"Batched text extraction processed images {index} to {index + len(chunk) - 1}")
+        index += len(chunk)
@@ -0,0 +1,107 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from utilities import get_config
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+orchestrator_config = config.get("orchestrator", {})
+
+MODES = ("sequential", "speculative", "eager_cancel")
+
+
+class StageTimeout(Exception):
+    """
+    Raised when a pipeline branch does not finish within its configured timeout.
+    """
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    I return the process-wide thread pool the pipeline branches run on, creating it on first use.
+
+    Threads are enough here: OpenCV, torch (EasyOCR) and TensorFlow (DeepFace) release the GIL while they work.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=orchestrator_config.get("max_workers", 4),
+                                           thread_name_prefix="ekyc-stage")
+        return _executor
+
+
+def run_branches(branches, mode=None, timeouts=None, failed=None):
+    """
+    I run independent pipeline branches, such as face verification and OCR, according to `mode`.
+
+    - "sequential": one branch after the other, in the given order, stopping as soon as a branch fails.
+    - "speculative": all branches start at once and I wait for all of them; the caller discards the results
+      it does not need, so latency is close to the slowest branch instead of the sum.
+    - "eager_cancel": all branches start at once, and as soon as one fails I cancel the others and return
+      without waiting for them.
+
+    A branch that is already running cannot be interrupted; on cancellation or timeout it finishes in the
+    background and its result is dropped.
+
+    :param branches: Ordered dictionary of branch name to a callable taking no arguments.
+    :param mode: One of `MODES`. Defaults to the `orchestrator.mode` setting.
+    :param timeouts: Dictionary of branch name to seconds. Defaults to the `orchestrator.timeouts` setting.
+    :param failed: Dictionary of branch name to a predicate telling whether that branch's result ends the pipeline.
+    :return: Dictionary of branch name to result, for the branches that completed.
+    :raises StageTimeout: If a branch exceeds its timeout.
+    """
+    mode = mode or orchestrator_config.get("mode", "speculative")
+    if mode not in MODES:
+        raise ValueError(f"Unsupported orchestrator mode: {mode}")
+    timeouts = orchestrator_config.get("timeouts", {}) if timeouts is None else timeouts
+    failed = failed or {}
+    executor = get_executor()
+    results = {}
+
+    def has_failed(name):
+        return name in failed and failed[name](results[name])
+
+    if mode == "sequential":
+        for name, func in branches.items():
+            future = executor.submit(func)
+            try:
+                results[name] = future.result(timeout=timeouts.get(name))
+            except FutureTimeoutError:
+                raise StageTimeout(f"Stage '{name}' did not finish within {timeouts.get(name)} seconds")
+            if has_failed(name):
+                break
+        return results
+
+    started = time.monotonic()
+    futures = {executor.submit(func): name for name, func in branches.items()}
+    deadlines = {name: started + timeouts[name] for name in branches if timeouts.get(name)}
+    pending = set(futures)
+
+    try:
+        while pending:
+            pending_deadlines = [deadlines[futures[f]] for f in pending if futures[f] in deadlines]
+            wait_for = max(0.0, min(pending_deadlines) - time.monotonic()) if pending_deadlines else None
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = futures[future]
+                results[name] = future.result()
+                if mode == "eager_cancel" and has_failed(name):
+                    logging.info(f"Stage '{name}' failed; cancelling {[futures[f] for f in pending]}")
+                    return results
+
+            now = time.monotonic()
+            expired = [futures[f] for f in pending if deadlines.get(futures[f], float("inf")) <= now]
+            if expired:
+                raise StageTimeout(f"Stage '{expired[0]}' did not finish within {timeouts[expired[0]]} seconds")
+    finally:
+        for future in pending:
+            future.cancel()
+
+    return results
@@ -0,0 +1,322 @@
+import os
+import time
+import uuid
+import logging
+import numpy as np
+from preprocessor import (extract_image_from_id, normalise_id_card, normalisation, resize_for_stage, save_image, artifacts,
+                          save_intermediate_images)
+from ocr import extract_text, recognize_fields
+from id_extraction import DOCUMENT_TYPES, extract_id_information, extract_id_information_from_fields
+from layout_templates import get_template, layout_config
+from validation import extract_face, face_comparison, get_face_embeddings
+from dbms_operations import check_duplicacy, insert_or_report_duplicate, record_stage_audit
+from face_index import find_face_duplicate, register_face
+from enrollment_queue import get_enrollment_queue, queue_config
+from result_cache import content_key, get_result_cache, cache_config
+from orchestrator import run_branches, orchestrator_config
+from quality_gate import assess_quality, quality_config
+from instrumentation import instrumented, maybe_write_metrics
+from ingestion import UploadRejected, MemoryBudget, read_upload, parse_header, validate_header, decode_image
+
+
+class _ImageInput:
+    """
+    I hold one pipeline input (path, uploaded bytes or array) and decode it only when a stage needs pixels.
+
+    Inputs given as bytes or paths are keyed by a hash of their content, so repeated uploads of the same
+    file hit the result cache without being decoded at all. Their size, format and dimensions are checked
+    up front, so a bad upload is refused before any work is done on it.
+    """
+
+    def __init__(self, source, use_cache, budget):
+        self.image = None
+        self.data = None
+        self.header = None
+        self.budget = budget
+        if isinstance(source, np.ndarray):
+            self.image = source
+        else:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                self.data = read_upload(source)
+            else:
+                with open(source, "rb") as f:
+                    self.data = read_upload(f)
+            self.header = parse_header(self.data)
+            validate_header(self.header)
+        self.key = None
+        if use_cache:
+            self.key = content_key(self.data if self.data is not None else self.image)
+
+    def decode(self, timings, stage):
+        """
+        I decode the image on first use and record how long that took under `stage`.
+        """
+        if self.image is None:
+            start = time.perf_counter()
+            try:
+                self.image = decode_image(self.data, self.header, self.budget)
+            finally:
+                timings[stage] = time.perf_counter() - start
+        return self.image
+
+
+class UnusableImage(ValueError):
+    """
+    Raised inside the pipeline when an upload is a readable image but shows no ID card or face to work on.
+    """
+
+
+class LowQualityImage(Exception):
+    """
+    Raised inside the pipeline when the ID card photo fails the quality gate.
+    """
+
+    def __init__(self, quality):
+        super().__init__(quality["reason"])
+        self.quality = quality
+
+
+@instrumented("pipeline")
+def run_pipeline(id_image, face_image, option, persist=True, use_cache=None, mode=None):
+    """
+    I run the full e-KYC pipeline for one ID card and selfie pair without any UI.
+
+    I read the ID card, extract its region of interest, detect the face on it, compare it with the selfie,
+    and only if they match run OCR, the field extraction for the card type, the duplicate check and the
+    insert. I time every stage so slow steps can be found from the results alone. Images stay in memory
+    between stages; nothing is written to disk unless the `debug.save_intermediate_images` flag is on, so
+    several pipelines can run side by side.
+
+    The ROI, ID face crop, face verification, OCR text and selfie embedding are cached by upload content,
+    so submitting the same card again skips contour detection, DeepFace and EasyOCR.
+
+    The card is cut out as an upright image of the fixed size of its type (`preprocessor.normalise_id_card`),
+    or as its bounding box when `normalisation.enabled` is off. After the ROI is extracted, the face on the
+    card is located and a cheap quality gate (blur, exposure, glare, card size and shape, face presence)
+    rejects hopeless photos before any model runs. Then the face branch (verification, selfie embedding) and
+    the OCR branch (field-targeted recognition from the card type's layout template, falling back to reading
+    the whole card, then field extraction) are handed to `orchestrator.run_branches`. In "speculative" and
+    "eager_cancel" modes they run in parallel, so the latency is close to the slower branch rather than
+    the sum of both; "sequential" keeps the original order of running OCR only after the faces match.
+
+    :param id_image: ID card image, as a path, uploaded bytes or a BGR numpy array.
+    :param face_image: Selfie image, as a path, uploaded bytes or a BGR numpy array.
+    :param option: ID card type, one of the keys of `id_extraction.DOCUMENT_TYPES`.
+    :param persist: Whether to run the duplicate check and insert the record into the database.
+    :param use_cache: Whether to use the result cache. Defaults to the `result_cache.enabled` setting.
+    :param mode: Orchestrator mode, one of `orchestrator.MODES`. Defaults to the `orchestrator.mode` setting.
+    :return: Dictionary with "status" ("enrolled", "accepted", "duplicate", "face_duplicate", "verified",
+             "invalid_id", "face_mismatch", "rejected", "unusable", "low_quality" or "error"), "fields",
+             "error", "card_geometry" (how the card was found and straightened, see `normalise_id_card`),
+             "timings" (seconds per stage) and "cache_hits" (stages served from the cache). The stages are
+             also recorded in the process-wide `instrumentation.metrics` and, when `persist` is True, in the
+             `stage_audit` table under "run_id".
+             "invalid_id" means no ID number passed validation, so the database was not touched.
+             "face_duplicate" means the selfie matches a face already enrolled under another ID number.
+             "enrolled" means the record was inserted into the database ("enrolment": "written"). "accepted"
+             means it was committed to the durable enrolment queue (`enrollment_queue.enabled`) instead
+             ("enrolment": "queued"); the background writer checks it against the shared database once more
+             and ends it as written, duplicate or face_duplicate.
+             "rejected" means an upload failed the ingestion checks; "error" says why.
+             "unusable" means an image was read but shows no ID card or no face on the card; "error" says
+             which.
+             "low_quality" means the ID card photo failed the quality gate before any model ran; "error" holds
+             the message for the user, "quality_check" the failed check and "quality" the scores.
+    """
+    started = time.perf_counter()
+    result = {"run_id": uuid.uuid4().hex, "status": "error", "fields": None, "error": None, "timings": {},
+              "cache_hits": []}
+    timings = result["timings"]
+    cached_stages = set()
+    if use_cache is None:
+        use_cache = cache_config.get("enabled", True)
+    cache = get_result_cache() if use_cache else None
+
+    def timed(stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def cached(stage, key, cache_stage, compute):
+        if cache is None or key is None:
+            return timed(stage, compute)
+        value, hit = timed(stage, cache.get_or_compute, key, cache_stage, compute)
+        if hit:
+            result["cache_hits"].append(cache_stage)
+            cached_stages.add(stage)
+        return value
+
+    try:
+        if option not in DOCUMENT_TYPES:
+            raise ValueError(f"Unsupported ID card type: {option}")
+        budget = MemoryBudget()
+        id_input = _ImageInput(id_image, use_cache, budget)
+        face_input = _ImageInput(face_image, use_cache, budget)
+        pair_key = f"{id_input.key}:{face_input.key}" if id_input.key and face_input.key else None
+
+        if normalisation.get("enabled", True):
+            # The canonical size depends on the card type, so everything derived from the card is cached per type
+            suffix = f":{option}"
+            card = cached("normalise_id_card", id_input.key, f"card{suffix}",
+                          lambda: dict(zip(("image", "geometry"),
+                                           normalise_id_card(id_input.decode(timings, "read_image"), option))))
+            image_roi, geometry = card["image"], card["geometry"]
+        else:
+            suffix, geometry = "", None
+            image_roi = cached("extract_image_from_id", id_input.key, "roi",
+                               lambda: extract_image_from_id(id_input.decode(timings, "read_image"))[0])
+        if image_roi is None:
+            raise UnusableImage("No ID card region found in the image")
+        result["card_geometry"] = geometry
+
+        # The face on the card is found before the quality gate, which needs to know whether there is one
+        id_face = cached("detect_and_extract_face", id_input.key, f"face_crop{suffix}",
+                         lambda: extract_face(img=image_roi)[0])
+        if quality_config.get("enabled", True):
+            quality = cached("quality_gate", id_input.key, f"quality{suffix}",
+                             lambda: assess_quality(image_roi,
+                                                    None if geometry else id_input.decode(timings, "read_image").shape[:2],
+                                                    id_face is not None, geometry=geometry))
+            result["quality"] = quality["scores"]
+            if not quality["passed"]:
+                raise LowQualityImage(quality)
+
+        if save_intermediate_images:
+            save_image(face_input.decode(timings, "read_face_image"), "face_image.jpg",
+                       path=os.path.dirname(artifacts["face_image_path_1"]))
+
+        mode = mode or orchestrator_config.get("mode", "speculative")
+
+        def face_branch():
+            if id_face is None:
+                raise UnusableImage("No face found on the ID card")
+            # Verification needs the selfie embedding anyway; computing it first lets the face service reuse
+            # it for the comparison and hands it to the enrolment without a second forward pass
+            embedding = compute_embedding() if persist else None
+            is_face_verified = cached("face_comparison", pair_key, "verification",
+                                      lambda: face_comparison(image1_path=selfie(), image2_path=id_face))
+            return is_face_verified, embedding
+
+        def ocr_branch():
+            ocr_image = resize_for_stage(image_roi, "ocr")
+            template = get_template(option)
+            field_info = None
+            if template is not None:
+                # Read only the ID and name regions of the card type's layout
+                field_texts = cached("recognize_fields", id_input.key, f"field_text:{option}",
+                                     lambda: recognize_fields(ocr_image, template))
+                field_info = timed("postprocess", extract_id_information_from_fields, field_texts, option)
+                # A box that misses its field reads the wrong text: a Name box over the father's name still reads
+                # a plausible name. Until the boxes are measured on real scans (`layout_ocr.cross_check`), the
+                # field read is checked against the whole card rather than trusted
+                trusted = field_info["Valid"] and field_info["Name"] and not layout_config.get("cross_check", True)
+                if trusted or not layout_config.get("fallback_to_full_ocr", True):
+                    return field_info
+                if not (field_info["Valid"] and field_info["Name"]):
+                    logging.info("No valid %s number or name in the field regions; reading the whole card", option)
+            extracted_text = cached("extract_text", id_input.key, f"ocr_text{suffix}", lambda: extract_text(ocr_image))
+            text_info = timed("postprocess", extract_id_information, extracted_text, option)
+            if field_info is not None:
+                if field_info["Valid"] and not text_info["Valid"]:
+                    # The number was validated from its field; only the name had to come from the whole card
+                    text_info.update(ID=field_info["ID"], Valid=True,
+                                     Confidence=dict(text_info["Confidence"], ID=field_info["Confidence"]["ID"]))
+                if field_info["Name"] and field_info["Name"].upper() != text_info["Name"].upper():
+                    # The whole card's name, found next to its label, wins
+                    logging.warning("The %s Name box read %r but the whole card reads %r; check the template",
+                                    option, field_info["Name"], text_info["Name"])
+            return text_info
+
+        def compute_embedding():
+            return cached("get_face_embeddings", face_input.key, "embedding",
+                          lambda: get_face_embeddings(selfie()))
+
+        selfie_image = []
+
+        def selfie():
+            # DeepFace runs its own face detector on the selfie, so give it an image sized for detection.
+            # Resized once, so the face service sees the same pixels (and the same cache key) every time
+            if not selfie_image:
+                selfie_image.append(resize_for_stage(face_input.decode(timings, "read_face_image"), "face_detection"))
+            return selfie_image[0]
+
+        branches = run_branches(
+            {"face": face_branch, "ocr": ocr_branch},
+            mode=mode,
+            failed={"face": lambda branch: not branch[0], "ocr": lambda text_info: not text_info["Valid"]},
+        )
+        is_face_verified, embedding = branches.get("face", (None, None))
+        text_info = branches.get("ocr")
+        result["fields"] = text_info
+
+        if is_face_verified is False:
+            result["status"] = "face_mismatch"
+            result["fields"] = None
+        elif not text_info["Valid"]:
+            result["status"] = "invalid_id"
+        else:
+            result["status"] = "verified"
+
+            if persist:
+                enrollment_queue = get_enrollment_queue() if queue_config["enabled"] else None
+                if (enrollment_queue is not None and enrollment_queue.is_queued(text_info["ID"], text_info["ID Type"])) \
+                        or timed("check_duplicacy", check_duplicacy, text_info):
+                    result["status"] = "duplicate"
+                else:
+                    if embedding is None:
+                        embedding = compute_embedding()
+                    face_duplicate = timed("find_face_duplicate", find_face_duplicate, embedding, text_info["ID"])
+                    if not face_duplicate and enrollment_queue is not None:
+                        # Queued faces join the face index only once the writer has inserted their record
+                        face_duplicate = timed("find_pending_face", enrollment_queue.find_pending_face, embedding,
+                                               text_info["ID"])
+                    if face_duplicate:
+                        result["status"] = "face_duplicate"
+                        result["matched_id"] = face_duplicate[0]
+                    elif enrollment_queue is not None:
+                        # The background writer inserts the record, then adds the face to the index
+                        if timed("enqueue_enrolment", enrollment_queue.enqueue, dict(text_info, Embedding=embedding)):
+                            # The writer still checks the ID and face against the shared database before
+                            # inserting, so the enrolment is only accepted until then
+                            result["status"] = "accepted"
+                            result["enrolment"] = "queued"
+                        else:
+                            # Queued by another request between the check and now
+                            result["status"] = "duplicate"
+                    elif timed("insert_records", insert_or_report_duplicate, dict(text_info, Embedding=embedding)):
+                        # Enrolled by another worker between the check and the insert
+                        result["status"] = "duplicate"
+                    else:
+                        register_face(text_info["ID"], embedding)
+                        result["status"] = "enrolled"
+                        result["enrolment"] = "written"
+
+    except LowQualityImage as e:
+        result["status"] = "low_quality"
+        result["error"] = e.quality["reason"]
+        result["quality_check"] = e.quality["code"]
+
+    except UploadRejected as e:
+        logging.warning("Upload rejected: %s", e)
+        result["status"] = "rejected"
+        result["error"] = str(e)
+
+    except UnusableImage as e:
+        logging.warning("Unusable image: %s", e)
+        result["status"] = "unusable"
+        result["error"] = str(e)
+
+    except Exception as e:
+        logging.exception("e-KYC pipeline failed: %s", e)
+        result["status"] = "error"
+        result["error"] = str(e)
+
+    timings["total"] = time.perf_counter() - started
+    if persist:
+        # The audit keys runs on the ID type stored with the records ("Aadhaar"), not the card option ("Aadhar")
+        id_type = DOCUMENT_TYPES[option][0] if option in DOCUMENT_TYPES else option
+        record_stage_audit(result["run_id"], result, id_type, cached_stages)
+    maybe_write_metrics()
+    return result
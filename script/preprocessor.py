@@ -2,29 +2,33 @@ import cv2
 import os
 import numpy as np
 import logging
-from utilities import read_yaml, file_exists
+from utilities import get_config, file_exists
+from instrumentation import instrumented, log_sampled
+from ingestion import ingest
 
-# Setup logging configuration
-logging_str = "[%(levelname)s]: %(message)s"
-
-log_dir = "logs"
-os.makedirs(log_dir, exist_ok=True)
-logging.basicConfig(filename=os.path.join(log_dir, "ekyc_logs.log"),
-                    level=logging.INFO, format=logging_str, filemode="a")
-
-# Read configuration from YAML file
-config_path = "configuration.yaml"
-config = read_yaml(config_path)
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
 
 artifacts = config["artifacts"]
 intermediate_dir_path = artifacts["intermediate_directory_path"]
 contour_file_name = artifacts["contour_image_file_name"]
+save_intermediate_images = config.get("debug", {}).get("save_intermediate_images", False)
+
+preprocessing = config.get("preprocessing", {})
+multi_resolution = preprocessing.get("multi_resolution", True)
+detection_max_side = preprocessing.get("detection_max_side", 1024)
+stage_max_side = preprocessing.get("stage_max_side", {})
 
+normalisation = config.get("normalisation", {})
+
+@instrumented("read_image")
 def read_image(image_path, is_uploaded=False):
     """
     I read an image from a file path or an uploaded file.
 
-    If the image is uploaded, I decode the image bytes; otherwise, I read the image from the local file system.
+    If the image is uploaded, it goes through `ingestion.ingest`: the size, format and dimensions are checked
+    before decoding and large JPEGs are decoded at reduced scale. Otherwise, I read the image from the local
+    file system.
 
     :param image_path: Path to the image file or uploaded file. If uploaded, this should be a file-like object.
     :param is_uploaded: Boolean indicating if the image is uploaded. Default is False.
@@ -32,8 +36,7 @@ def read_image(image_path, is_uploaded=False):
     """
     try:
         if is_uploaded:
-            image_bytes = image_path.read()
-            img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+            img = ingest(image_path)
         else:
             img = cv2.imread(image_path)
 
@@ -47,42 +50,117 @@ def read_image(image_path, is_uploaded=False):
         print(f"Error loading image: {e}")
         return None
 
-def extract_image_from_id(img):
+def resize_to_max_side(img, max_side):
+    """
+    I shrink an image so its longer side is at most `max_side` pixels, keeping the aspect ratio.
+
+    Images that are already small enough are returned unchanged; I never upscale.
+
+    :param img: Input image as a numpy array.
+    :param max_side: Maximum length of the longer side, or None to keep the image as is.
+    :return: A tuple (image, scale) where scale is the factor applied to the input (1.0 if unchanged).
+    """
+    height, width = img.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return img, 1.0
+    scale = max_side / max(height, width)
+    resized = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    return resized, scale
+
+def resize_for_stage(img, stage, enabled=None):
+    """
+    I size an image for a pipeline stage according to `preprocessing.stage_max_side`.
+
+    Face detection works well on small images while OCR needs sharp text, so each stage gets its own limit.
+
+    :param img: Input image as a numpy array.
+    :param stage: Stage name, such as "face_detection", "face_crop" or "ocr".
+    :param enabled: Whether multi-resolution processing is on. Defaults to `preprocessing.multi_resolution`.
+    :return: The resized image, or the input unchanged when disabled or already small enough.
+    """
+    if enabled is None:
+        enabled = multi_resolution
+    if not enabled or img is None:
+        return img
+    return resize_to_max_side(img, stage_max_side.get(stage))[0]
+
+def find_card_contour(img, multi_resolution_enabled=None):
+    """
+    I find the largest contour in the image, which is assumed to be the ID card.
+
+    With multi-resolution processing on, I blur, threshold and search for contours on a copy shrunk to
+    `preprocessing.detection_max_side`, then scale the contour back to the coordinates of the full image.
+
+    :param img: Input image as a numpy array.
+    :param multi_resolution_enabled: Whether to detect on a downscaled proxy. Defaults to `preprocessing.multi_resolution`.
+    :return: A tuple (contour, scale) where contour is in full-resolution coordinates (None if no contour with
+             a non-zero area is found) and scale is the proxy's size relative to the full image.
+    """
+    if multi_resolution_enabled is None:
+        multi_resolution_enabled = multi_resolution
+    proxy, scale = resize_to_max_side(img, detection_max_side) if multi_resolution_enabled else (img, 1.0)
+
+    gray_img = cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY)
+    blur_img = cv2.GaussianBlur(gray_img, (5, 5), 0)
+    threshold_img = cv2.adaptiveThreshold(blur_img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 2)
+    
+    contours, _ = cv2.findContours(threshold_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    largest_contour = None
+    largest_area = 0
+    
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area > largest_area:
+            largest_contour = cnt
+            largest_area = area
+    
+    if largest_contour is None or largest_area == 0:
+        return None, scale
+
+    if scale != 1.0:
+        largest_contour = np.round(largest_contour / scale).astype(np.int32)
+    return largest_contour, scale
+
+@instrumented("extract_image_from_id")
+def extract_image_from_id(img, save=None, multi_resolution_enabled=None):
     """
-    I extract the largest contour from the input image (assumed to be an ID card) and save it.
+    I extract the largest contour from the input image (assumed to be an ID card).
 
     I process the image to detect contours, identify the largest contour based on area, and then extract this contour 
-    from the image. Finally, I save the extracted contour to the specified path.
+    from the image. The contour is searched on a downscaled proxy when multi-resolution processing is on, but the
+    crop is always taken from the full-resolution image so the text stays sharp. The extracted contour is only
+    written to disk when saving is requested, so the normal pipeline keeps it in memory.
 
     :param img: Input image as a numpy array.
+    :param save: Whether to save the extracted contour to the intermediate directory. Defaults to the
+                 `debug.save_intermediate_images` configuration flag.
+    :param multi_resolution_enabled: Whether to detect the card on a downscaled proxy. Defaults to the
+                                     `preprocessing.multi_resolution` configuration flag.
     :return: A tuple (contour_image, filename) where contour_image is the extracted contour image, 
-             and filename is the name of the saved image file. Returns (None, None) if an error occurs.
+             and filename is the name of the saved image file, or None if it was not saved.
+             Returns (None, None) if an error occurs.
     """
     try:
-        gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        blur_img = cv2.GaussianBlur(gray_img, (5, 5), 0)
-        threshold_img = cv2.adaptiveThreshold(blur_img, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 11, 2)
-        
-        contours, _ = cv2.findContours(threshold_img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        largest_contour = None
-        largest_area = 0
-        
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if area > largest_area:
-                largest_contour = cnt
-                largest_area = area
+        largest_contour, scale = find_card_contour(img, multi_resolution_enabled)
         
-        if largest_contour is None or largest_area == 0:
+        if largest_contour is None:
             logging.warning("No contours found, or the largest contour has zero area.")
             return None, None
         
         x, y, w, h = cv2.boundingRect(largest_contour)
-        logging.info(f"Contours are found at {(x, y, w, h)}")
+        if scale != 1.0:
+            # One proxy pixel covers several full-resolution pixels; widen the box so no edge of the card is lost
+            pad = int(np.ceil(1 / scale))
+            x, y = max(0, x - pad), max(0, y - pad)
+            w = min(img.shape[1] - x, w + 2 * pad)
+            h = min(img.shape[0] - y, h + 2 * pad)
+        log_sampled("extract_image_from_id", logging.INFO, "Contours are found at %s", (x, y, w, h))
         
         contour_id = img[y:y+h, x:x+w]
-        filename = save_image(contour_id, contour_file_name, intermediate_dir_path)
+        if save is None:
+            save = save_intermediate_images
+        filename = save_image(contour_id, contour_file_name, intermediate_dir_path) if save else None
         
         return contour_id, filename
     
@@ -91,6 +169,218 @@ def extract_image_from_id(img):
         print(f"Error extracting image from ID: {e}")
         return None, None
 
+def order_corners(points):
+    """
+    I order four corner points as top-left, top-right, bottom-right, bottom-left, with the first edge along the
+    card's longer side so a card photographed in portrait still comes out landscape.
+
+    :param points: Array of four (x, y) points in any order.
+    :return: float32 array of shape (4, 2).
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    # Sort by angle around the centre: clockwise in image coordinates, starting from the top-left corner
+    centre = points.mean(axis=0)
+    angles = np.arctan2(points[:, 1] - centre[1], points[:, 0] - centre[0])
+    points = points[np.argsort(angles)]
+    start = int(np.argmin(points.sum(axis=1)))
+    points = np.roll(points, -start, axis=0)
+    if np.linalg.norm(points[1] - points[0]) < np.linalg.norm(points[3] - points[0]):
+        # Portrait: make the longer edge the top one
+        points = np.roll(points, -1, axis=0)
+    return points
+
+
+def fit_card_quad(contour):
+    """
+    I fit a quadrilateral to a card contour.
+
+    I simplify the contour with `approxPolyDP` at increasing tolerances until it has four corners; rounded card
+    corners or a finger over an edge can defeat that, in which case I fall back to the minimum-area rectangle.
+
+    :param contour: Contour as returned by `cv2.findContours`.
+    :return: A tuple (corners, method) with the ordered corners and "polygon" or "min_area_rect".
+    """
+    perimeter = cv2.arcLength(contour, True)
+    for tolerance in (0.02, 0.03, 0.04, 0.05, 0.06, 0.08):
+        approx = cv2.approxPolyDP(contour, tolerance * perimeter, True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_corners(approx), "polygon"
+        if len(approx) < 4:
+            break
+    return order_corners(cv2.boxPoints(cv2.minAreaRect(contour))), "min_area_rect"
+
+def find_card_quad(img, multi_resolution_enabled=None):
+    """
+    I locate the card as a quadrilateral.
+
+    Card edges are searched with Canny on the detection proxy, which separates the card from a plain background
+    far better than the adaptive threshold used by `find_card_contour`; if no edge contour large enough is found
+    I fall back to that largest contour.
+
+    :param img: Input image as a numpy array.
+    :param multi_resolution_enabled: Whether to detect on a downscaled proxy. Defaults to `preprocessing.multi_resolution`.
+    :return: A tuple (corners, method) in full-resolution coordinates, or (None, None) if nothing is found.
+    """
+    if multi_resolution_enabled is None:
+        multi_resolution_enabled = multi_resolution
+    proxy, scale = resize_to_max_side(img, detection_max_side) if multi_resolution_enabled else (img, 1.0)
+    image_area = proxy.shape[0] * proxy.shape[1]
+
+    gray_img = cv2.GaussianBlur(cv2.cvtColor(proxy, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    edges = cv2.dilate(cv2.Canny(gray_img, 50, 150), np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = normalisation.get("min_card_area_ratio", 0.10) * image_area
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        corners, method = fit_card_quad(contour)
+        return corners / scale, method
+
+    contour, _ = find_card_contour(img, multi_resolution_enabled)
+    if contour is None:
+        return None, None
+    return fit_card_quad(contour)
+
+def estimate_skew(gray, max_angle=5.0, step=0.5):
+    """
+    I estimate the residual rotation of the text on a card, in degrees.
+
+    I try small rotations of a binarised, shrunken copy and keep the one whose rows are most unevenly inked:
+    when text lines are horizontal, rows alternate between full lines and empty gaps.
+
+    :param gray: Grayscale card image.
+    :param max_angle: Largest rotation tried, either way.
+    :param step: Angle step in degrees.
+    :return: Rotation in degrees that straightens the text (0.0 when none helps).
+    """
+    small = resize_to_max_side(gray, 500)[0]
+    _, ink = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    height, width = ink.shape
+    centre = (width / 2, height / 2)
+    best_angle, best_score = 0.0, float(np.var(ink.sum(axis=1, dtype=np.float64)))
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        if abs(angle) < step / 2:
+            continue
+        rotated = cv2.warpAffine(ink, cv2.getRotationMatrix2D(centre, float(angle), 1.0), (width, height),
+                                 flags=cv2.INTER_NEAREST)
+        score = float(np.var(rotated.sum(axis=1, dtype=np.float64)))
+        # A rotation must clearly beat leaving the card as it is; blank or noisy cards score alike everywhere
+        if score > best_score * 1.05:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def canonical_size(option=None):
+    """
+    I return the (width, height) every card of a type is warped to.
+
+    :param option: ID card type as offered in the sidebar, or None for the default size.
+    """
+    sizes = normalisation.get("canonical_size", {})
+    return tuple(sizes.get(option, sizes.get("default", (1000, 630))))
+
+@instrumented("normalise_id_card")
+def normalise_id_card(img, option=None):
+    """
+    I cut the card out of a photo as an upright, fronto-parallel image of fixed size.
+
+    I fit a quadrilateral to the card, warp it to the canonical size of the card type with `warpPerspective`
+    and rotate away any remaining text skew. Every card of a type therefore reaches the later stages at the
+    same size, whatever the photo's resolution or angle, so their cost is predictable and the field boxes of
+    the layout templates line up.
+
+    When no card edge is found, or the quadrilateral covers practically the whole photo, the photo itself is
+    deskewed and scaled to the canonical width instead, since stretching it to the card shape would distort
+    the text.
+
+    :param img: Input image as a numpy array.
+    :param option: ID card type as offered in the sidebar, used to pick the canonical size.
+    :return: A tuple (card, geometry) where geometry holds "method", "corners" (in the photo's pixels),
+             "area_ratio", "aspect_ratio" and "skew" (degrees), or (None, None) if an error occurs.
+    """
+    try:
+        image_height, image_width = img.shape[:2]
+        width, height = canonical_size(option)
+        corners, method = find_card_quad(img)
+
+        area_ratio, aspect_ratio = 1.0, max(image_width, image_height) / min(image_width, image_height)
+        if corners is not None:
+            area_ratio = cv2.contourArea(corners) / float(image_width * image_height)
+            top, side = np.linalg.norm(corners[1] - corners[0]), np.linalg.norm(corners[3] - corners[0])
+            aspect_ratio = top / max(side, 1.0)
+
+        if corners is None or area_ratio > normalisation.get("max_card_area_ratio", 0.95):
+            method, corners, area_ratio = "frame", None, 1.0
+            aspect_ratio = max(image_width, image_height) / min(image_width, image_height)
+            card = img if image_width >= image_height else cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+            card = cv2.resize(card, (width, int(round(width * card.shape[0] / card.shape[1]))),
+                              interpolation=cv2.INTER_AREA if card.shape[1] > width else cv2.INTER_CUBIC)
+        else:
+            # warpPerspective has no area interpolation (INTER_AREA is not supported there), so a card much
+            # larger than its canonical size is first shrunk with resize, which has, and then warped bilinearly
+            source, quad = img, corners
+            scale = min(top / width, side / height)
+            if scale > 2.0:
+                source = cv2.resize(img, None, fx=2.0 / scale, fy=2.0 / scale, interpolation=cv2.INTER_AREA)
+                quad = corners * np.float32(2.0 / scale)
+            target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], np.float32)
+            card = cv2.warpPerspective(source, cv2.getPerspectiveTransform(quad, target), (width, height),
+                                       flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+        skew = 0.0
+        if normalisation.get("deskew", True):
+            skew = estimate_skew(cv2.cvtColor(card, cv2.COLOR_BGR2GRAY), normalisation.get("max_skew", 5.0),
+                                 normalisation.get("skew_step", 0.5))
+            if abs(skew) >= normalisation.get("min_skew", 0.5):
+                centre = (card.shape[1] / 2, card.shape[0] / 2)
+                card = cv2.warpAffine(card, cv2.getRotationMatrix2D(centre, skew, 1.0),
+                                      (card.shape[1], card.shape[0]), flags=cv2.INTER_LINEAR,
+                                      borderMode=cv2.BORDER_REPLICATE)
+            else:
+                skew = 0.0
+
+        geometry = {
+            "method": method,
+            "corners": corners.tolist() if corners is not None else None,
+            "area_ratio": float(area_ratio),
+            "aspect_ratio": float(aspect_ratio),
+            "skew": skew,
+        }
+        log_sampled("normalise_id_card", logging.INFO, "Card normalised: %s", geometry)
+        if save_intermediate_images:
+            save_image(card, contour_file_name, intermediate_dir_path)
+        return card, geometry
+
+    except Exception as e:
+        logging.exception(f"Error normalising the ID card: {e}")
+        return None, None
+
+def compare_resolution_modes(img):
+    """
+    I run card detection with and without the downscaled proxy and report how they differ.
+
+    This is the switch for checking that multi-resolution processing keeps the same crop while saving time.
+
+    :param img: Input image as a numpy array.
+    :return: Dictionary with the bounding box and seconds taken by each mode and the IoU of the two boxes.
+    """
+    report = {}
+    for name, enabled in (("full_resolution", False), ("multi_resolution", True)):
+        start = cv2.getTickCount()
+        contour, _ = find_card_contour(img, enabled)
+        seconds = (cv2.getTickCount() - start) / cv2.getTickFrequency()
+        report[name] = {"bbox": cv2.boundingRect(contour) if contour is not None else None, "seconds": seconds}
+
+    full, multi = report["full_resolution"]["bbox"], report["multi_resolution"]["bbox"]
+    iou = 0.0
+    if full and multi:
+        ix = max(0, min(full[0] + full[2], multi[0] + multi[2]) - max(full[0], multi[0]))
+        iy = max(0, min(full[1] + full[3], multi[1] + multi[3]) - max(full[1], multi[1]))
+        intersection = ix * iy
+        union = full[2] * full[3] + multi[2] * multi[3] - intersection
+        iou = intersection / union if union else 0.0
+    report["bbox_iou"] = iou
+    return report
+
 def save_image(image, filename, path):
     """
     I save an image to the specified directory path.
@@ -0,0 +1,112 @@
+import logging
+import cv2
+import numpy as np
+from utilities import get_config
+from preprocessor import resize_for_stage
+from instrumentation import instrumented
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+quality_config = config.get("quality_gate", {})
+
+# ID-1 card format (85.60 x 53.98 mm), the shape of PAN, Aadhaar and driving licence cards
+CARD_ASPECT_RATIO = 85.60 / 53.98
+
+_DEFAULT_THRESHOLDS = {
+    "min_sharpness": 60.0,
+    "min_brightness": 40.0,
+    "max_brightness": 225.0,
+    "max_glare_ratio": 0.10,
+    "min_area_ratio": 0.15,
+    "max_aspect_deviation": 0.35,
+    "require_face": True,
+}
+
+
+def quality_scores(roi, image_shape, geometry=None):
+    """
+    I compute cheap quality scores of an ID card ROI on a small grayscale copy.
+
+    - "sharpness": variance of the Laplacian; blurred images have few edges and score low. It is measured on
+      the copy sized for the "quality" stage, so thresholds do not depend on the upload's resolution.
+    - "brightness": mean gray level, 0 to 255.
+    - "glare_ratio": share of saturated pixels (250 and above), typical of light reflected off a laminated card.
+    - "area_ratio": share of the photo covered by the ROI; a small value means the card is far from the camera.
+    - "aspect_ratio": longer side over shorter side of the ROI, and "aspect_deviation" its relative distance
+      from the ID-1 card shape.
+
+    A normalised card always has its canonical size, so when its geometry is given the area and aspect ratio
+    are those of the card as found in the photo, before it was warped.
+
+    :param roi: ID card region as a BGR numpy array.
+    :param image_shape: (height, width) of the photo the ROI was cut from; unused when `geometry` is given.
+    :param geometry: Card geometry returned by `preprocessor.normalise_id_card`.
+    :return: Dictionary of scores.
+    """
+    gray = cv2.cvtColor(resize_for_stage(roi, "quality"), cv2.COLOR_BGR2GRAY)
+    roi_height, roi_width = roi.shape[:2]
+    if geometry is not None:
+        area_ratio, aspect_ratio = geometry["area_ratio"], geometry["aspect_ratio"]
+        aspect_ratio = max(aspect_ratio, 1.0 / max(aspect_ratio, 1e-6))
+    else:
+        area_ratio = (roi_height * roi_width) / float(image_shape[0] * image_shape[1])
+        aspect_ratio = max(roi_width, roi_height) / max(1, min(roi_width, roi_height))
+    return {
+        "sharpness": float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        "brightness": float(gray.mean()),
+        "glare_ratio": float(np.count_nonzero(gray >= 250)) / gray.size,
+        "area_ratio": area_ratio,
+        "aspect_ratio": aspect_ratio,
+        "aspect_deviation": abs(aspect_ratio - CARD_ASPECT_RATIO) / CARD_ASPECT_RATIO,
+    }
+
+
+@instrumented("quality_gate")
+def assess_quality(roi, image_shape, face_found, thresholds=None, geometry=None):
+    """
+    I decide whether an ID card photo is good enough to be worth running face verification and OCR on.
+
+    Checks run in order of how actionable the reason is for the user, and the first failing one is reported.
+    Every assessment is logged with all scores, so thresholds can be tuned from real uploads.
+
+    :param roi: ID card region as a BGR numpy array.
+    :param image_shape: (height, width) of the photo the ROI was cut from.
+    :param face_found: Whether a face was detected on the ROI.
+    :param thresholds: Overrides of the `quality_gate` configuration values.
+    :param geometry: Card geometry returned by `preprocessor.normalise_id_card`, if the card was normalised.
+    :return: Dictionary with "passed", "code" (short name of the failed check, such as "blurry"), "reason"
+             (a message for the user) and "scores". "code" and "reason" are None when the photo passes.
+    """
+    limits = dict(_DEFAULT_THRESHOLDS, **{k: v for k, v in quality_config.items() if k in _DEFAULT_THRESHOLDS})
+    limits.update(thresholds or {})
+    scores = quality_scores(roi, image_shape, geometry)
+    scores["face_found"] = bool(face_found)
+
+    checks = (
+        (scores["brightness"] < limits["min_brightness"], "too_dark",
+         "The photo is too dark. Please retake it in better light."),
+        (scores["brightness"] > limits["max_brightness"], "overexposed",
+         "The photo is overexposed. Please retake it without direct light on the card."),
+        (scores["glare_ratio"] > limits["max_glare_ratio"], "glare",
+         "There is glare on the card. Please tilt it slightly away from the light."),
+        (scores["sharpness"] < limits["min_sharpness"], "blurry",
+         "The photo is blurry. Please hold the camera steady and retake it."),
+        (scores["area_ratio"] < limits["min_area_ratio"], "card_too_small",
+         "The card is too small in the photo. Please move the camera closer."),
+        (scores["aspect_deviation"] > limits["max_aspect_deviation"], "not_a_card",
+         "The card is cut off or not fully visible. Please photograph the whole card."),
+        (limits["require_face"] and not face_found, "no_face",
+         "No face was found on the ID card. Please upload the side with the photo."),
+    )
+    failure = next(((code, message) for failed, code, message in checks if failed), None)
+
+    logging.info("Quality gate %s: %s", failure[0] if failure else "passed",
+                 " ".join(f"{name}={value:.3f}" if isinstance(value, float) else f"{name}={value}"
+                          for name, value in scores.items()))
+    return {
+        "passed": failure is None,
+        "code": failure[0] if failure else None,
+        "reason": failure[1] if failure else None,
+        "scores": scores,
+    }
@@ -0,0 +1,178 @@
+import os
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from utilities import get_config
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+cache_config = config.get("result_cache", {})
+
+# Marker for "not in the cache", since None can be a real cached result
+MISSING = object()
+
+
+def content_key(data):
+    """
+    I compute the cache key of an upload from its content, so the same file always maps to the same key.
+
+    :param data: Raw bytes of the upload, or an image as a numpy array.
+    :return: Hex SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    if isinstance(data, np.ndarray):
+        digest.update(str((data.shape, data.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(data).data)
+    else:
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _size_of(value):
+    """
+    I estimate how many bytes a cached value holds in memory.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, dict) and any(isinstance(item, np.ndarray) for item in value.values()):
+        return sum(_size_of(item) for item in value.values())
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 1024
+
+
+class ResultCache:
+    """
+    I cache per-stage pipeline results (ROI, face crop, embedding, OCR text, ...) keyed by upload content.
+
+    The memory tier is an LRU bounded by the total size of the cached values. When a disk directory is set,
+    every entry is also written there as a pickle, so results survive restarts and entries evicted from
+    memory can be read back without running the models again.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_directory=None):
+        self.max_bytes = max_bytes
+        self.disk_directory = disk_directory
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def _disk_path(self, key, stage):
+        return os.path.join(self.disk_directory, stage, f"{key}.pkl")
+
+    def get(self, key, stage):
+        """
+        I return the cached result of a stage for an upload, or `MISSING`.
+
+        :param key: Content key from `content_key`.
+        :param stage: Stage name, such as "roi" or "ocr_text".
+        """
+        with self._lock:
+            entry = self._entries.get((key, stage))
+            if entry is not None:
+                self._entries.move_to_end((key, stage))
+                self.stats["hits"] += 1
+                return entry[0]
+
+        if self.disk_directory:
+            path = self._disk_path(key, stage)
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logging.warning(f"Ignoring unreadable cache file {path}: {e}")
+            else:
+                self._store(key, stage, value)
+                with self._lock:
+                    self.stats["disk_hits"] += 1
+                return value
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return MISSING
+
+    def put(self, key, stage, value):
+        """
+        I cache the result of a stage for an upload, evicting the least recently used entries if needed.
+        """
+        self._store(key, stage, value)
+        if self.disk_directory:
+            path = self._disk_path(key, stage)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logging.warning(f"Could not write cache file {path}: {e}")
+
+    def _store(self, key, stage, value):
+        if isinstance(value, np.ndarray) and value.base is not None:
+            # A crop is a view into the full upload; copy it so the cache does not keep the whole image alive
+            value = value.copy()
+        size = _size_of(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((key, stage), None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[(key, stage)] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.stats["evictions"] += 1
+
+    def get_or_compute(self, key, stage, compute):
+        """
+        I return the cached result of a stage, or run `compute` and cache its result.
+
+        Results that are None are not cached, so a failed stage is retried on the next submission.
+
+        :return: A tuple (value, hit) where hit tells whether the value came from the cache.
+        """
+        if key is not None:
+            value = self.get(key, stage)
+            if value is not MISSING:
+                return value, True
+        value = compute()
+        if key is not None and value is not None:
+            self.put(key, stage, value)
+        return value, False
+
+    def snapshot(self):
+        """
+        I return the cache counters along with the number of entries and bytes held in memory.
+        """
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes)
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    I return the process-wide result cache, created from the `result_cache` configuration section.
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                max_bytes=int(cache_config.get("max_megabytes", 256) * 1024 * 1024),
+                disk_directory=cache_config.get("disk_directory") or None,
+            )
+        return _result_cache
@@ -0,0 +1,282 @@
+"""
+Database schema and migrations.
+
+Usage:
+    python schema.py status
+    python schema.py migrate
+
+Every change to the schema is a numbered migration below, applied once per database and recorded in the
+`schema_version` table. The same migrations run on MySQL and on the SQLite stand-in used for local runs,
+and `dbms_operations` applies any pending ones the first time a process touches the database.
+"""
+import json
+import logging
+import argparse
+
+# Name of the MySQL advisory lock that keeps two processes from migrating at the same time
+_MYSQL_LOCK = "ekyc_schema_migration"
+
+
+def _columns(cursor, backend, table):
+    """
+    I return the column names of a table, or an empty set if the table does not exist.
+    """
+    if backend == "sqlite":
+        cursor.execute(f"PRAGMA table_info({table})")
+        return {row[1] for row in cursor.fetchall()}
+    cursor.execute("SELECT column_name FROM information_schema.columns "
+                   "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _indexes(cursor, backend, table):
+    """
+    I return the index names of a table.
+    """
+    if backend == "sqlite":
+        cursor.execute(f"PRAGMA index_list({table})")
+        return {row[1] for row in cursor.fetchall()}
+    cursor.execute("SELECT DISTINCT index_name FROM information_schema.statistics "
+                   "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def _create_user_info(cursor, backend):
+    """
+    Create `user_info` for a new database. Tables created by hand before migrations existed are kept as they are
+    and brought up to date by the next migrations.
+    """
+    if backend == "sqlite":
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_info (
+            id TEXT NOT NULL,
+            name TEXT,
+            id_type TEXT NOT NULL,
+            embedding BLOB
+        )
+        """)
+    else:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_info (
+            id VARCHAR(32) NOT NULL,
+            name VARCHAR(255),
+            id_type VARCHAR(32) NOT NULL,
+            embedding BLOB NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+
+
+def _add_embedding(cursor, backend):
+    """
+    Add the float32 face embedding column to tables that predate it.
+    """
+    if "embedding" not in _columns(cursor, backend, "user_info"):
+        cursor.execute("ALTER TABLE user_info ADD COLUMN embedding BLOB NULL")
+
+
+def _add_timestamps(cursor, backend):
+    """
+    Record when each user was enrolled and last changed.
+    """
+    columns = _columns(cursor, backend, "user_info")
+    if backend == "sqlite":
+        # SQLite cannot add a column defaulting to CURRENT_TIMESTAMP, so a trigger fills it on insert
+        for column in ("created_at", "updated_at"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE user_info ADD COLUMN {column} TEXT")
+        cursor.execute("UPDATE user_info SET created_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP "
+                       "WHERE created_at IS NULL")
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS user_info_created_at AFTER INSERT ON user_info
+        WHEN NEW.created_at IS NULL
+        BEGIN
+            UPDATE user_info SET created_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+            WHERE rowid = NEW.rowid;
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS user_info_updated_at AFTER UPDATE OF id, name, id_type, embedding ON user_info
+        BEGIN
+            UPDATE user_info SET updated_at = CURRENT_TIMESTAMP WHERE rowid = NEW.rowid;
+        END
+        """)
+    else:
+        if "created_at" not in columns:
+            cursor.execute("ALTER TABLE user_info ADD COLUMN created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP")
+        if "updated_at" not in columns:
+            cursor.execute("ALTER TABLE user_info ADD COLUMN updated_at TIMESTAMP NOT NULL "
+                           "DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+
+
+def _add_id_indexes(cursor, backend):
+    """
+    Make (id_type, id) unique, which is what `fetch_records`, `check_duplicacy` and `insert_or_report_duplicate`
+    filter on, and index `id` on its own for `check_duplicacy_many`, so they stay index lookups at millions of
+    rows.
+
+    Duplicates left by the unconstrained table stop the migration rather than being deleted silently.
+    """
+    cursor.execute("SELECT COUNT(*) FROM (SELECT 1 FROM user_info GROUP BY id_type, id HAVING COUNT(*) > 1) AS d")
+    (duplicates,) = cursor.fetchone()
+    if duplicates:
+        raise RuntimeError(f"user_info holds {duplicates} (id_type, id) pairs more than once; remove the extra "
+                           "rows, then run `python schema.py migrate` again")
+    indexes = _indexes(cursor, backend, "user_info")
+    if "user_info_type_id" not in indexes:
+        cursor.execute("CREATE UNIQUE INDEX user_info_type_id ON user_info (id_type, id)")
+    if "user_info_id" not in indexes:
+        cursor.execute("CREATE INDEX user_info_id ON user_info (id)")
+
+
+def _create_stage_audit(cursor, backend):
+    """
+    Keep one row per pipeline stage and request, with its duration and the request's outcome, so slow stages
+    and failure rates can be queried per card type and over time.
+    """
+    if backend == "sqlite":
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stage_audit (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            record_id TEXT,
+            id_type TEXT,
+            status TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            seconds REAL NOT NULL,
+            cached INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+    else:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stage_audit (
+            seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+            run_id CHAR(32) NOT NULL,
+            record_id VARCHAR(32) NULL,
+            id_type VARCHAR(32) NULL,
+            status VARCHAR(32) NOT NULL,
+            stage VARCHAR(64) NOT NULL,
+            seconds DOUBLE NOT NULL,
+            cached BOOLEAN NOT NULL DEFAULT FALSE,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+    indexes = _indexes(cursor, backend, "stage_audit")
+    if "stage_audit_run" not in indexes:
+        cursor.execute("CREATE INDEX stage_audit_run ON stage_audit (run_id)")
+    if "stage_audit_record" not in indexes:
+        cursor.execute("CREATE INDEX stage_audit_record ON stage_audit (record_id)")
+    if "stage_audit_created" not in indexes:
+        cursor.execute("CREATE INDEX stage_audit_created ON stage_audit (created_at, stage)")
+
+
+def _index_created_at(cursor, backend):
+    """
+    Index `created_at`, which each process's face index polls for faces enrolled by other processes.
+    """
+    if "user_info_created" not in _indexes(cursor, backend, "user_info"):
+        cursor.execute("CREATE INDEX user_info_created ON user_info (created_at)")
+
+
+# (version, description, function(cursor, backend)); append new migrations, never edit applied ones
+MIGRATIONS = (
+    (1, "create user_info", _create_user_info),
+    (2, "add user_info.embedding", _add_embedding),
+    (3, "add user_info.created_at and updated_at", _add_timestamps),
+    (4, "unique (id_type, id) and index on id", _add_id_indexes),
+    (5, "create stage_audit", _create_stage_audit),
+    (6, "index user_info.created_at", _index_created_at),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _ensure_version_table(cursor, backend):
+    if backend == "sqlite":
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+    else:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB
+        """)
+
+
+def current_version(cursor, backend):
+    """
+    I return the highest migration applied to the database, 0 for a database never migrated.
+    """
+    _ensure_version_table(cursor, backend)
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    (version,) = cursor.fetchone()
+    return version or 0
+
+
+def migrate(cursor, backend, target=None):
+    """
+    I apply every migration newer than the database's version, in order, recording each one.
+
+    On MySQL an advisory lock keeps concurrent processes (batch workers starting together) from running the
+    same migration twice; DDL commits implicitly there, which is why each migration checks what already exists.
+    SQLite serialises writers on its own.
+
+    :param cursor: Cursor on the database, using `%s` placeholders (see `dbms_operations.get_cursor`).
+    :param backend: "mysql" or "sqlite".
+    :param target: Version to stop at. Defaults to the latest.
+    :return: List of the versions applied.
+    """
+    target = LATEST_VERSION if target is None else target
+    if backend == "mysql":
+        cursor.execute("SELECT GET_LOCK(%s, 60)", (_MYSQL_LOCK,))
+        if not cursor.fetchone()[0]:
+            raise TimeoutError("Another process has been migrating the database schema for over 60 seconds")
+    applied = []
+    try:
+        version = current_version(cursor, backend)
+        for number, description, apply in MIGRATIONS:
+            if version < number <= target:
+                logging.info(f"Applying schema migration {number}: {description}")
+                apply(cursor, backend)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                               (number, description))
+                applied.append(number)
+    finally:
+        if backend == "mysql":
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (_MYSQL_LOCK,))
+            cursor.fetchall()
+    if applied:
+        logging.info(f"Database schema migrated to version {applied[-1]}")
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or upgrade the e-KYC database schema.")
+    parser.add_argument("command", choices=("status", "migrate"),
+                        help="status: show the schema version; migrate: apply pending migrations")
+    parser.add_argument("--sqlite", metavar="PATH", default=None,
+                        help="use a local SQLite file instead of the configured database")
+    args = parser.parse_args()
+
+    from instrumentation import configure_logging
+    configure_logging()
+
+    from dbms_operations import get_cursor, configure_database, db_config
+    # Migrate only when asked to, not as a side effect of opening the cursor
+    configure_database(auto_migrate=False, **({"backend": "sqlite", "sqlite_path": args.sqlite} if args.sqlite else {}))
+    with get_cursor(commit=True) as cursor:
+        applied = migrate(cursor, db_config["backend"]) if args.command == "migrate" else []
+        version = current_version(cursor, db_config["backend"])
+    print(json.dumps({"backend": db_config["backend"], "version": version, "latest": LATEST_VERSION,
+                      "applied": applied}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+HTTP e-KYC service.
+
+Usage:
+    python server.py --port 8000 --workers 2
+
+Endpoints:
+    POST /v1/verify   multipart/form-data with the files `id_image` and `face_image`, the field `id_type`
+                      (PAN, Aadhar or Driving License) and optionally `persist` ("false" to skip enrolment).
+                      Returns the pipeline result as JSON; a queued enrolment is answered 202 "accepted".
+    GET  /healthz     200 while the process is serving.
+    GET  /readyz      200 once the OCR and face models are loaded, 503 before (with --no-warm-up, 200 at once as
+                      the models load on the first request); the body is `warm_up.readiness()`.
+    GET  /metrics     Stage latency histograms in the Prometheus text format.
+
+Instances share nothing but the database, so any number of them can run behind a load balancer. Every duplicate
+decision is made against the database: the ID is looked up there, and each instance's face index polls it for
+faces enrolled through the others (`face_index.sync_interval`). An instance's enrolment queue only buffers
+writes; its writer checks each enrolment against the database again before inserting it, which is why a queued
+enrolment is answered "accepted" rather than "enrolled".
+
+Requests are handed to a fixed pool of worker threads sharing the process's models through a bounded queue;
+when the queue is full the service answers 429 at once, without reading the uploads, so a load balancer can send
+the request elsewhere instead of piling it up here.
+"""
+import json
+import time
+import uuid
+import queue
+import logging
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utilities import get_config
+from id_extraction import DOCUMENT_TYPES
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+server_config = {
+    "host": "0.0.0.0",
+    "port": 8000,
+    "workers": 2,
+    "queue_size": 8,
+    "request_timeout": 120,
+    "max_body_megabytes": 45,
+    "retry_after": 2,
+}
+server_config.update(config.get("server", {}))
+
+_MEGABYTE = 1024 * 1024
+
+# HTTP status of each pipeline status; every verdict is a successful answer, and a queued enrolment is accepted
+# for processing (202). Uploads that cannot be processed
+# ("rejected" by ingestion, "unusable" with no card or face on it) are the client's fault, anything else is ours.
+_HTTP_STATUS = {"accepted": 202, "rejected": 422, "unusable": 422, "error": 500}
+
+
+class _Job:
+    """
+    One request waiting for a worker.
+    """
+
+    def __init__(self, id_image, face_image, option, persist):
+        self.args = (id_image, face_image, option)
+        self.persist = persist
+        self.result = None
+        self.done = threading.Event()
+        self.abandoned = False
+        self.enqueued_at = time.perf_counter()
+
+
+class WorkerPool:
+    """
+    I run pipeline requests on a fixed number of threads fed from a bounded queue.
+
+    The models are process-wide singletons, so the threads share one copy of them; the pool size caps how many
+    requests compete for the CPU at once, and the queue size caps how many wait. `submit` never blocks: a full
+    queue is the caller's signal to shed load.
+    """
+
+    def __init__(self, workers=2, queue_size=8):
+        self.workers = workers
+        self._jobs = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self.stats = {"accepted": 0, "shed": 0, "completed": 0, "abandoned": 0}
+        self._lock = threading.Lock()
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"ekyc-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def full(self):
+        return self._jobs.full()
+
+    def shed(self):
+        """
+        I count a request turned away before it could be submitted.
+        """
+        self._count("shed")
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def submit(self, job):
+        """
+        I queue a job.
+
+        :return: False if the queue is full and the job was not accepted.
+        """
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            self._count("shed")
+            return False
+        self._count("accepted")
+        return True
+
+    def _work(self):
+        from pipeline import run_pipeline
+        while True:
+            job = self._jobs.get()
+            if job.abandoned:
+                # The client gave up while the job was queued; do not spend the models on it
+                self._count("abandoned")
+                continue
+            try:
+                job.result = run_pipeline(*job.args, persist=job.persist)
+                timings = job.result["timings"]
+                timings["queued"] = time.perf_counter() - job.enqueued_at - timings["total"]
+            except Exception as e:
+                logging.exception(f"Worker failed: {e}")
+                job.result = {"status": "error", "fields": None, "error": str(e)}
+            finally:
+                self._count("completed")
+                job.done.set()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, queued=self._jobs.qsize(), workers=self.workers)
+
+
+def parse_multipart(content_type, body):
+    """
+    I split a multipart/form-data body into its parts.
+
+    :param content_type: Value of the request's Content-Type header, with the boundary.
+    :param body: Request body as bytes.
+    :return: Dictionary of field name to bytes.
+    :raises ValueError: If the body is not multipart/form-data.
+    """
+    if not content_type or not content_type.startswith("multipart/form-data"):
+        raise ValueError("Expected a multipart/form-data body")
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\nMIME-Version: 1.0\r\n\r\n" + body)
+    if not message.is_multipart():
+        raise ValueError("The multipart body could not be parsed")
+    parts = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name:
+            parts[name] = part.get_payload(decode=True) or b""
+    return parts
+
+
+class EkycRequestHandler(BaseHTTPRequestHandler):
+    """
+    I serve the e-KYC endpoints of one `ThreadingHTTPServer`; `pool` is set by `serve`.
+    """
+
+    pool = None
+    protocol_version = "HTTP/1.1"
+    server_version = "ekyc"
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        payload = body if isinstance(body, bytes) else json.dumps(body, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _refuse(self, status, message, headers=None):
+        # The body may not have been read, so the connection cannot be reused
+        self.close_connection = True
+        self._send(status, {"status": "error", "error": message}, headers=dict(headers or {}, Connection="close"))
+
+    def do_GET(self):
+        from warm_up import readiness
+        if self.path == "/healthz":
+            self._send(200, {"status": "ok", "pool": self.pool.snapshot()})
+        elif self.path == "/readyz":
+            status = readiness()
+            self._send(200 if status["ready"] else 503, status)
+        elif self.path == "/metrics":
+            from instrumentation import metrics
+            self._send(200, metrics.prometheus_text().encode("utf-8"), content_type="text/plain; version=0.0.4")
+        else:
+            self._send(404, {"status": "error", "error": f"No such endpoint: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/v1/verify":
+            self._refuse(404, f"No such endpoint: {self.path}")
+            return
+        # Shed load before reading the uploads; the queue may still fill up meanwhile, which `submit` catches
+        if self.pool.full():
+            self.pool.shed()
+            self._refuse(429, "The service is busy; please retry shortly",
+                         headers={"Retry-After": str(server_config["retry_after"])})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            self._refuse(411, "The request needs a Content-Length")
+            return
+        if length > server_config["max_body_megabytes"] * _MEGABYTE:
+            self._refuse(413, f"The request is larger than {server_config['max_body_megabytes']} MB")
+            return
+
+        try:
+            parts = parse_multipart(self.headers.get("Content-Type"), self.rfile.read(length))
+        except ValueError as e:
+            self._send(400, {"status": "error", "error": str(e)})
+            return
+        missing = [name for name in ("id_image", "face_image", "id_type") if not parts.get(name)]
+        if missing:
+            self._send(400, {"status": "error", "error": f"Missing form fields: {', '.join(missing)}"})
+            return
+        option = parts["id_type"].decode("utf-8", "replace").strip()
+        if option not in DOCUMENT_TYPES:
+            self._send(400, {"status": "error", "error": f"Unsupported id_type {option!r}; "
+                                                         f"expected one of {', '.join(DOCUMENT_TYPES)}"})
+            return
+        persist = parts.get("persist", b"true").decode("utf-8", "replace").strip().lower() not in ("false", "0", "no")
+        job = _Job(parts["id_image"], parts["face_image"], option, persist)
+
+        if not self.pool.submit(job):
+            self._send(429, {"status": "error", "error": "The service is busy; please retry shortly"},
+                       headers={"Retry-After": str(server_config["retry_after"])})
+            return
+        if not job.done.wait(server_config["request_timeout"]):
+            job.abandoned = True
+            self._send(504, {"status": "error", "error": "The request timed out"})
+            return
+        self._send(_HTTP_STATUS.get(job.result["status"], 200), job.result)
+
+    def log_message(self, format, *args):
+        logging.debug("%s %s", self.address_string(), format % args)
+
+
+def serve(host=None, port=None, workers=None, queue_size=None, warm_up=True):
+    """
+    I start the worker pool and serve HTTP requests until interrupted.
+
+    :param host: Interface to listen on. Defaults to `server.host`.
+    :param port: Port to listen on. Defaults to `server.port`.
+    :param workers: Number of pipeline worker threads. Defaults to `server.workers`.
+    :param queue_size: Requests that may wait for a worker before new ones get 429. Defaults to `server.queue_size`.
+    :param warm_up: Whether to load the models in the background right away. Without the warm-up the service
+                    reports ready at once and loads each model on the first request that needs it.
+    """
+    from instrumentation import configure_logging
+    from warm_up import start_background_warm_up, allow_lazy_loading
+    configure_logging()
+
+    pool = WorkerPool(workers or server_config["workers"], queue_size or server_config["queue_size"])
+    pool.start()
+    if warm_up:
+        start_background_warm_up()
+    else:
+        allow_lazy_loading()
+    handler = type("Handler", (EkycRequestHandler,), {"pool": pool})
+    httpd = ThreadingHTTPServer((host or server_config["host"], port or server_config["port"]), handler)
+    httpd.daemon_threads = True
+    logging.info(f"e-KYC service listening on {httpd.server_address[0]}:{httpd.server_address[1]} "
+                 f"with {pool.workers} workers and a queue of {queue_size or server_config['queue_size']}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def call_service(url, id_image, face_image, option, persist=True, timeout=None):
+    """
+    I send one verification request to a running service and return its JSON result, for thin clients such as
+    the Streamlit app.
+
+    :param url: Base URL of the service, such as "http://localhost:8000".
+    :param id_image: ID card image bytes.
+    :param face_image: Selfie image bytes.
+    :param option: ID card type.
+    :param persist: Whether the service should enrol the user.
+    :param timeout: Seconds to wait for the answer. Defaults to `server.request_timeout` plus a margin.
+    :return: The result dictionary. A busy service gives status "busy".
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value, filename in (("id_image", id_image, "id_image"), ("face_image", face_image, "face_image"),
+                                  ("id_type", option.encode("utf-8"), None),
+                                  ("persist", b"true" if persist else b"false", None)):
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        parts.append(f"--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode("utf-8") + value + b"\r\n")
+    body = b"".join(parts) + f"--{boundary}--\r\n".encode("utf-8")
+    request = urllib.request.Request(url.rstrip("/") + "/v1/verify", data=body, method="POST",
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout or server_config["request_timeout"] + 10) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        if e.code == 429:
+            return {"status": "busy", "fields": None, "error": "The service is busy; please retry shortly"}
+        try:
+            return json.loads(e.read())
+        except ValueError:
+            return {"status": "error", "fields": None, "error": f"The service answered {e.code}"}
+
+
+def service_readiness(url, timeout=2):
+    """
+    I fetch `/readyz` from a running service, in the shape of `warm_up.readiness()`.
+    """
+    try:
+        with urllib.request.urlopen(url.rstrip("/") + "/readyz", timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return json.loads(e.read())
+    except (urllib.error.URLError, OSError) as e:
+        return {"ready": False, "models": {"service": {"state": "unreachable", "seconds": None, "error": str(e)}}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the e-KYC pipeline over HTTP.")
+    parser.add_argument("--host", default=None, help="interface to listen on (default: server.host)")
+    parser.add_argument("--port", type=int, default=None, help="port to listen on (default: server.port)")
+    parser.add_argument("--workers", type=int, default=None, help="pipeline worker threads (default: server.workers)")
+    parser.add_argument("--queue-size", type=int, default=None,
+                        help="requests waiting for a worker before answering 429 (default: server.queue_size)")
+    parser.add_argument("--no-warm-up", action="store_true", help="load the models on the first request instead")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.queue_size, warm_up=not args.no_warm_up)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import os
+import yaml
+import logging
+import functools
+
+
+def read_yaml(path_to_yaml):
+    """
+    I read a YAML file and return its content as a dictionary.
+
+    :param path_to_yaml: Path to the YAML file.
+    :return: Parsed content of the file. An empty file gives an empty dictionary.
+    """
+    with open(path_to_yaml, encoding="utf-8") as yaml_file:
+        content = yaml.safe_load(yaml_file) or {}
+    logging.info(f"YAML file loaded successfully: {path_to_yaml}")
+    return content
+
+
+@functools.lru_cache(maxsize=None)
+def get_config(path_to_yaml="configuration.yaml"):
+    """
+    I parse the configuration file the first time a module asks for it and hand every later caller the same
+    dictionary, so importing several modules reads the YAML once.
+
+    Treat the result as read-only; modules that adjust settings at runtime copy the section they change.
+
+    :param path_to_yaml: Path to the YAML file.
+    :return: Parsed configuration.
+    """
+    return read_yaml(path_to_yaml)
+
+
+def file_exists(file_path):
+    """
+    I check whether a file exists at the given path.
+
+    :param file_path: Path to the file.
+    :return: True if the path exists and is a file, otherwise False.
+    """
+    return bool(file_path) and os.path.isfile(file_path)
@@ -0,0 +1,139 @@
+import os
+import cv2
+import logging
+from utilities import get_config, file_exists
+from preprocessor import resize_for_stage
+from instrumentation import instrumented, log_sampled
+from face_service import get_face_service
+
+# Read configuration from YAML file (parsed once per process)
+config = get_config()
+
+artifacts = config["artifacts"]
+haarcascade_path = artifacts["haarcascade_file_path"]
+face_image_path = artifacts["face_image_path_2"]
+save_intermediate_images = config.get("debug", {}).get("save_intermediate_images", False)
+
+# Fall back to the cascade shipped next to this script when the configured path is missing
+if not file_exists(haarcascade_path):
+    haarcascade_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "haarcascade_frontalface_default.xml")
+
+
+
+def get_face_cascade():
+    """
+    I return the Haar cascade owned by the shared face service, loading it on first use.
+    """
+    return get_face_service(haarcascade_path).cascade
+
+
+def warm_up_face_models():
+    """
+    I load the Haar cascade and the DeepFace recognition model and run them once on a blank image, so the
+    first verification does not pay for loading the weights.
+    """
+    get_face_service(haarcascade_path).warm_up()
+    logging.info("Face models warmed up")
+
+
+@instrumented("extract_face")
+def extract_face(img, save=None):
+    """
+    I detect the largest face in an image (usually the ID card ROI) and return it with some margin around it.
+
+    I run the Haar cascade on a grayscale copy sized for face detection, keep the largest detection, map it
+    back to the full image and double its width and height so the crop includes the whole head, as DeepFace
+    expects. The crop itself is then sized for the face models, which resize their input anyway.
+
+    :param img: Input image as a numpy array.
+    :param save: Whether to save the face crop to `face_image_path_2`. Defaults to the
+                 `debug.save_intermediate_images` configuration flag.
+    :return: A tuple (face_image, filename) where filename is None if the crop was not saved.
+             Returns (None, None) if no face is found or an error occurs.
+    """
+    try:
+        detection_img = resize_for_stage(img, "face_detection")
+        scale = detection_img.shape[1] / img.shape[1]
+        gray_img = cv2.cvtColor(detection_img, cv2.COLOR_BGR2GRAY)
+        faces = get_face_cascade().detectMultiScale(gray_img, scaleFactor=1.1, minNeighbors=5)
+
+        if len(faces) == 0:
+            logging.warning("No face detected in the image.")
+            return None, None
+
+        x, y, w, h = (int(round(v / scale)) for v in max(faces, key=lambda face: face[2] * face[3]))
+        new_w, new_h = int(w * 2), int(h * 2)
+        new_x = max(0, x - int((new_w - w) / 2))
+        new_y = max(0, y - int((new_h - h) / 2))
+        face_image = resize_for_stage(img[new_y:new_y + new_h, new_x:new_x + new_w], "face_crop")
+        log_sampled("extract_face", logging.INFO, "Face detected at %s", (x, y, w, h))
+
+        if save is None:
+            save = save_intermediate_images
+        filename = None
+        if save:
+            os.makedirs(os.path.dirname(face_image_path) or ".", exist_ok=True)
+            cv2.imwrite(face_image_path, face_image)
+            filename = face_image_path
+
+        return face_image, filename
+
+    except Exception as e:
+        logging.exception(f"Error extracting face: {e}")
+        return None, None
+
+
+def detect_and_extract_face(img):
+    """
+    I detect the face in an image, save the crop and return the path of the saved file.
+
+    This keeps the file-based contract for callers that still pass paths around; the pipeline uses
+    `extract_face` instead and keeps the crop in memory.
+
+    :param img: Input image as a numpy array.
+    :return: Path of the saved face image, or None if no face is found.
+    """
+    _, filename = extract_face(img, save=True)
+    return filename
+
+
+@instrumented("face_comparison")
+def face_comparison(image1_path, image2_path):
+    """
+    I check whether two images show the same person using the shared face service.
+
+    Each image is embedded once by the service, so comparing a selfie whose embedding was already computed
+    (or computing it afterwards for enrolment) does not run the model again.
+
+    :param image1_path: First face, as a path or a BGR numpy array.
+    :param image2_path: Second face, as a path or a BGR numpy array.
+    :return: True if the embedding distance is within the model's verification threshold, otherwise False.
+    """
+    if image1_path is None or image2_path is None:
+        logging.warning("Face comparison skipped because a face is missing.")
+        return False
+
+    try:
+        verified, distance = get_face_service(haarcascade_path).verify(image1_path, image2_path)
+        log_sampled("face_comparison", logging.INFO, "Face comparison distance: %s", distance)
+        return bool(verified)
+
+    except Exception as e:
+        logging.exception(f"Error comparing faces: {e}")
+        return False
+
+
+@instrumented("get_face_embeddings")
+def get_face_embeddings(image_path):
+    """
+    I return the DeepFace embedding of a face, computed at most once per image by the shared face service.
+
+    :param image_path: Face image, as a path or a BGR numpy array.
+    :return: Embedding as a list of floats, or None if an error occurs.
+    """
+    try:
+        return get_face_service(haarcascade_path).embed(image_path).tolist()
+
+    except Exception as e:
+        logging.exception(f"Error computing face embeddings: {e}")
+        return None
@@ -0,0 +1,121 @@
+import time
+import logging
+import threading
+from instrumentation import import_times
+
+# Models loaded by the background warm-up, in the order they are loaded
+MODELS = ("ocr", "face")
+
+_status = {name: {"state": "cold", "seconds": None, "error": None} for name in MODELS}
+_status_lock = threading.Lock()
+_ready = {name: threading.Event() for name in MODELS}
+_thread = None
+_lazy = False
+_process_started = time.perf_counter()
+
+
+def _load(name):
+    """
+    I load one model and record its state, so `readiness` can report it while the others are still loading.
+    """
+    with _status_lock:
+        _status[name]["state"] = "loading"
+    start = time.perf_counter()
+    try:
+        if name == "ocr":
+            from ocr import warm_up_readers
+            warm_up_readers()
+        elif name == "face":
+            from validation import warm_up_face_models
+            warm_up_face_models()
+    except Exception as e:
+        logging.exception(f"Warm-up of the {name} model failed: {e}")
+        with _status_lock:
+            _status[name].update(state="failed", seconds=time.perf_counter() - start, error=str(e))
+    else:
+        with _status_lock:
+            _status[name].update(state="ready", seconds=time.perf_counter() - start)
+        logging.info(f"{name} model ready after {_status[name]['seconds']:.2f}s")
+    finally:
+        # Waiters are released on failure too; the pipeline then loads the model itself and reports the error
+        _ready[name].set()
+
+
+def start_background_warm_up(models=MODELS):
+    """
+    I load the OCR and face models on a background thread, so the UI can render while they load.
+
+    Calling me again while or after the warm-up runs does nothing, which suits Streamlit's reruns.
+
+    :param models: Names from `MODELS` to load.
+    :return: The warm-up thread.
+    """
+    global _thread
+    with _status_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=lambda: [_load(name) for name in models],
+                                       name="ekyc-warm-up", daemon=True)
+            _thread.start()
+        return _thread
+
+
+def allow_lazy_loading():
+    """
+    I make `readiness` count models that are not loaded yet as ready, for processes that load them on their
+    first request instead of warming up; otherwise such a process would never be reported ready.
+    """
+    global _lazy
+    with _status_lock:
+        _lazy = True
+
+
+def mark_loaded(name, seconds=None):
+    """
+    I record that a model was loaded outside the warm-up, on first use.
+
+    :param name: Name from `MODELS`.
+    :param seconds: How long loading took, if known.
+    """
+    if name not in _status:
+        return
+    with _status_lock:
+        if _status[name]["state"] != "ready":
+            _status[name].update(state="ready", seconds=seconds, error=None)
+    _ready[name].set()
+
+
+def wait_until_ready(models=MODELS, timeout=None):
+    """
+    I block until the given models have finished loading, or failed to load.
+
+    :param models: Names from `MODELS` to wait for.
+    :param timeout: Seconds to wait in total. None waits forever.
+    :return: True if every model finished before the timeout.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for name in models:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not _ready[name].wait(remaining):
+            return False
+    return True
+
+
+def readiness():
+    """
+    I report whether each model is hot, how long it took to load, and how long the heavy imports took.
+
+    :return: Dictionary with "ready" (every model loaded, or not yet loaded but allowed to load lazily),
+             "lazy", "models" (state per model: "cold", "loading", "ready" or "failed"), "imports" (seconds
+             per imported dependency) and "uptime" in seconds.
+    """
+    with _status_lock:
+        models = {name: dict(status) for name, status in _status.items()}
+        lazy = _lazy
+    accepted = ("ready", "cold", "loading") if lazy else ("ready",)
+    return {
+        "ready": all(status["state"] in accepted for status in models.values()),
+        "lazy": lazy,
+        "models": models,
+        "imports": dict(import_times),
+        "uptime": time.perf_counter() - _process_started,
+    }
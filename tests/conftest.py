@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live side by side in script/ and read configuration.yaml from the working directory
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "script")
+sys.path.insert(0, SCRIPT_DIR)
+os.chdir(SCRIPT_DIR)
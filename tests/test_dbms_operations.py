@@ -0,0 +1,57 @@
+import sqlite3
+
+import pytest
+
+import dbms_operations
+
+
+@pytest.fixture
+def database(tmp_path):
+    dbms_operations.configure_database(backend="sqlite", sqlite_path=str(tmp_path / "ekyc.sqlite3"))
+    yield tmp_path
+    dbms_operations.configure_database(backend="sqlite", sqlite_path=":memory:")
+
+
+def _record(record_id, id_type="PAN", name="Test"):
+    return {"ID": record_id, "Name": name, "ID Type": id_type}
+
+
+def test_same_number_on_another_card_type_is_not_a_duplicate(database):
+    assert not dbms_operations.insert_or_report_duplicate(_record("123456789012", "Aadhaar"))
+    assert not dbms_operations.check_duplicacy(_record("123456789012", "Driving License"))
+    assert not dbms_operations.insert_or_report_duplicate(_record("123456789012", "Driving License"))
+    assert dbms_operations.insert_or_report_duplicate(_record("123456789012", "Aadhaar"))
+    assert dbms_operations.check_duplicacy(_record("123456789012", "Aadhaar"))
+    assert [row["id_type"] for row in dbms_operations.fetch_records(_record("123456789012", "Aadhaar"))] == ["Aadhaar"]
+
+
+def test_check_duplicacy_many_matches_on_type_and_number(database):
+    dbms_operations.insert_records_many([_record("ABCPE1234F"), _record("MH1220150012345", "Driving License")])
+    existing = dbms_operations.check_duplicacy_many([_record("ABCPE1234F"), _record("ABCPE1234F", "Aadhaar"),
+                                                     _record("MH1220150012345", "Driving License"),
+                                                     _record("ZZZPZ9999Z")])
+    assert existing == {("PAN", "ABCPE1234F"), ("Driving License", "MH1220150012345")}
+
+
+def test_unique_index_rejects_a_second_row(database):
+    dbms_operations.insert_records(_record("ABCPE1234F"))
+    with pytest.raises(sqlite3.IntegrityError):
+        dbms_operations.insert_records(_record("ABCPE1234F", name="Other"))
+
+
+def test_insert_losing_a_race_reports_a_duplicate(database, monkeypatch):
+    # Both inserts passed the NOT EXISTS check; the unique index stops the second one
+    def lose_race(*args, **kwargs):
+        raise sqlite3.IntegrityError("UNIQUE constraint failed: user_info.id_type, user_info.id")
+
+    monkeypatch.setattr(dbms_operations, "_execute", lose_race)
+    assert dbms_operations.insert_or_report_duplicate(_record("ABCPE1234F"))
+
+
+def test_other_errors_are_not_reported_as_duplicates(database, monkeypatch):
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(dbms_operations, "_execute", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        dbms_operations.insert_or_report_duplicate(_record("ABCPE1234F"))
@@ -0,0 +1,160 @@
+import sqlite3
+import threading
+
+import numpy as np
+import pytest
+
+import dbms_operations
+import face_index
+from enrollment_queue import QUEUE_SCHEMA, EnrollmentQueue
+
+
+@pytest.fixture
+def local_stand_ins(tmp_path, monkeypatch):
+    dbms_operations.configure_database(backend="sqlite", sqlite_path=str(tmp_path / "ekyc.sqlite3"))
+    monkeypatch.setattr(face_index, "face_index_path", str(tmp_path / "face_index.npz"))
+    monkeypatch.setattr(face_index, "_face_index", None)
+    monkeypatch.setattr(face_index, "_unsaved_adds", 0)
+    yield tmp_path
+    dbms_operations.configure_database(backend="sqlite", sqlite_path=":memory:")
+
+
+@pytest.fixture
+def enrolments(local_stand_ins):
+    return EnrollmentQueue(str(local_stand_ins / "enrollment_queue.sqlite3"), batch_size=10, max_attempts=2,
+                           retry_backoff=0.0, max_backoff=0.0)
+
+
+def _face(seed, dim=16):
+    return np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+
+
+def _record(record_id, id_type="PAN", seed=0):
+    return {"ID": record_id, "Name": "Test", "ID Type": id_type, "Embedding": _face(seed)}
+
+
+def test_an_id_is_queued_once_per_card_type(enrolments):
+    assert enrolments.enqueue(_record("ABCPE1234F"))
+    assert not enrolments.enqueue(_record("ABCPE1234F"))
+    assert enrolments.enqueue(_record("ABCPE1234F", "Aadhaar"))
+    assert enrolments.is_queued("ABCPE1234F", "PAN")
+    assert not enrolments.is_queued("ABCPE1234F", "Driving License")
+
+
+def test_flush_writes_new_records_and_marks_existing_ones_duplicate(enrolments):
+    dbms_operations.insert_records(_record("ABCPE1234F"))
+    enrolments.enqueue(_record("ABCPE1234F", seed=1))
+    enrolments.enqueue(_record("ABCPE1234F", "Aadhaar", seed=2))
+    assert enrolments.flush() == {"duplicate": 1, "written": 1, "failed": 0}
+    assert dbms_operations.check_duplicacy(_record("ABCPE1234F", "Aadhaar"))
+
+
+def test_face_joins_the_index_only_once_written(enrolments):
+    enrolments.enqueue(_record("P1", seed=1))
+    assert "P1" not in face_index.get_face_index()
+    assert face_index.find_face_duplicate(_face(1), "P2") is None
+    assert enrolments.find_pending_face(_face(1), "P2")[0] == "P1"
+    assert enrolments.find_pending_face(_face(1), "P1") is None
+
+    enrolments.flush()
+    assert "P1" in face_index.get_face_index()
+    assert enrolments.find_pending_face(_face(1), "P2") is None
+
+
+def test_failed_enrolment_never_reaches_the_face_index(enrolments, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(dbms_operations, "check_duplicacy_many", unavailable)
+    monkeypatch.setattr(dbms_operations, "insert_or_report_duplicate", unavailable)
+    enrolments.enqueue(_record("P1", seed=1))
+    enrolments.flush()
+    enrolments.flush()
+    assert enrolments.status()["counts"]["failed"] == 1
+    assert "P1" not in face_index.get_face_index()
+    # A failed enrolment does not block the same face under a corrected ID
+    assert enrolments.find_pending_face(_face(1), "P2") is None
+
+
+def test_stop_releases_the_batch_of_a_stuck_writer(enrolments, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+
+    def stuck(batch):
+        entered.set()
+        release.wait(10)
+        return {seq: "written" for seq, _ in batch}
+
+    monkeypatch.setattr(enrolments, "_flush_batch", stuck)
+    enrolments.enqueue(_record("P1", seed=1))
+    enrolments.start()
+    assert entered.wait(10)
+    assert enrolments.status()["counts"]["flushing"] == 1
+    enrolments.stop(drain=False, timeout=0.1)
+    assert enrolments.status()["counts"]["pending"] == 1
+    release.set()
+
+
+def test_queue_keyed_on_id_alone_is_rebuilt(local_stand_ins):
+    path = str(local_stand_ins / "old_queue.sqlite3")
+    connection = sqlite3.connect(path)
+    connection.executescript(QUEUE_SCHEMA.replace("id TEXT NOT NULL,", "id TEXT NOT NULL UNIQUE,")
+                             .split("CREATE UNIQUE INDEX")[0])
+    connection.execute("INSERT INTO enrolments (id, name, id_type, enqueued_at) VALUES ('P1', 'Test', 'PAN', 0)")
+    connection.commit()
+    connection.close()
+
+    enrolments = EnrollmentQueue(path)
+    assert enrolments.status()["counts"]["pending"] == 1
+    assert enrolments.enqueue(_record("P1", "Aadhaar"))
+
+
+def test_writer_turns_down_faces_enrolled_elsewhere_or_earlier_in_the_batch(enrolments, monkeypatch):
+    monkeypatch.setattr(face_index, "sync_interval", 0.0)
+    face_index.get_face_index()
+    # Enrolled through another instance after this one loaded its face index
+    dbms_operations.insert_records(_record("P0", seed=0))
+    enrolments.enqueue(_record("P1", seed=0))
+    enrolments.enqueue(_record("P2", seed=2))
+    enrolments.enqueue(_record("P3", "Aadhaar", seed=2))
+    assert enrolments.flush() == {"face_duplicate": 2, "written": 1, "failed": 0}
+    assert not dbms_operations.check_duplicacy(_record("P1"))
+    assert not enrolments.is_queued("P1", "PAN")
+    # The same ID may try again with its own face
+    assert enrolments.enqueue(_record("P1", seed=5))
+
+
+def test_written_enrolment_no_longer_counts_once_its_record_is_gone(enrolments):
+    enrolments.enqueue(_record("P1", seed=1))
+    enrolments.flush()
+    assert not enrolments.is_queued("P1", "PAN")
+    # The pipeline only enqueues an ID the database does not hold, e.g. after the record was deleted
+    assert enrolments.enqueue(_record("P1", seed=1))
+    assert enrolments.is_queued("P1", "PAN")
+
+
+def test_finished_enrolments_are_pruned_after_the_retention(enrolments, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    enrolments.enqueue(_record("P1", seed=1))
+    enrolments.flush()
+    monkeypatch.setattr(dbms_operations, "check_duplicacy_many", unavailable)
+    monkeypatch.setattr(dbms_operations, "insert_or_report_duplicate", unavailable)
+    enrolments.enqueue(_record("P2", seed=2))
+    enrolments.flush()
+    enrolments.flush()
+    assert enrolments.prune(retention=3600) == 0
+    assert enrolments.prune(retention=-1) == 1
+    counts = enrolments.status()["counts"]
+    assert counts["failed"] == 1 and counts["written"] == 0
+
+
+def test_pending_faces_follow_changes_made_by_other_processes(enrolments, local_stand_ins):
+    assert enrolments.find_pending_face(_face(1), "P9") is None
+    other = EnrollmentQueue(str(local_stand_ins / "enrollment_queue.sqlite3"), batch_size=10)
+    other.enqueue(_record("P1", seed=1))
+    other.enqueue(_record("P2", seed=2))
+    assert enrolments.find_pending_face(_face(1), "P9")[0] == "P1"
+    other.flush()
+    assert enrolments.find_pending_face(_face(1), "P9") is None
+    assert enrolments.find_pending_face(_face(2), "P9") is None
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import dbms_operations
+import face_index
+from face_index import FaceIndex
+
+
+@pytest.fixture
+def local_stand_ins(tmp_path, monkeypatch):
+    dbms_operations.configure_database(backend="sqlite", sqlite_path=str(tmp_path / "ekyc.sqlite3"))
+    monkeypatch.setattr(face_index, "face_index_path", str(tmp_path / "face_index.npz"))
+    monkeypatch.setattr(face_index, "_face_index", None)
+    monkeypatch.setattr(face_index, "_unsaved_adds", 0)
+    yield tmp_path
+    dbms_operations.configure_database(backend="sqlite", sqlite_path=":memory:")
+
+
+def _face(seed, dim=16):
+    return np.random.default_rng(seed).normal(size=dim).astype(np.float32)
+
+
+def _enrol(record_id, embedding):
+    dbms_operations.insert_records({"ID": record_id, "Name": "Test", "ID Type": "PAN", "Embedding": embedding})
+    face_index.register_face(record_id, embedding)
+
+
+def test_snapshot_is_topped_up_from_the_database_after_a_restart(local_stand_ins):
+    _enrol("P0", _face(0))
+    face_index.get_face_index().save(face_index.face_index_path)
+    _enrol("P1", _face(1))
+    assert face_index.find_face_duplicate(_face(1), "NEW")[0] == "P1"
+
+    face_index._face_index = None
+    match = face_index.find_face_duplicate(_face(1), "NEW")
+    assert match is not None and match[0] == "P1"
+    assert len(face_index.get_face_index()) == 2
+
+
+def test_first_build_from_the_database_does_not_add_the_new_record_twice(local_stand_ins):
+    dbms_operations.insert_records({"ID": "P0", "Name": "Test", "ID Type": "PAN", "Embedding": _face(0)})
+    face_index.register_face("P0", _face(0))
+    index = face_index.get_face_index()
+    assert len(index) == 1
+    assert index.ids == ["P0"]
+
+
+def test_save_leaves_no_temporary_files(tmp_path):
+    index = FaceIndex()
+    index.add(["A", "B"], np.stack([_face(0), _face(1)]))
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+    index.save(path)
+    assert os.listdir(tmp_path) == ["index.npz"]
+    assert FaceIndex.load(path).ids == ["A", "B"]
+
+
+def test_large_index_switches_to_ivf(local_stand_ins, monkeypatch):
+    monkeypatch.setattr(face_index, "ivf_threshold", 50)
+    ids = [f"P{i}" for i in range(60)]
+    dbms_operations.insert_records_many([{"ID": record_id, "Name": "Test", "ID Type": "PAN", "Embedding": _face(i)}
+                                        for i, record_id in enumerate(ids)])
+    index = face_index.get_face_index()
+    assert index.centroids is not None
+    assert face_index.find_face_duplicate(_face(7), "NEW")[0] == "P7"
+
+
+def test_faces_enrolled_by_another_process_are_picked_up(local_stand_ins, monkeypatch):
+    monkeypatch.setattr(face_index, "sync_interval", 0.0)
+    _enrol("P0", _face(0))
+    assert face_index.find_face_duplicate(_face(1), "NEW") is None
+    # Another instance writes straight to the shared database
+    dbms_operations.insert_records({"ID": "P1", "Name": "Test", "ID Type": "PAN", "Embedding": _face(1)})
+    match = face_index.find_face_duplicate(_face(1), "NEW")
+    assert match is not None and match[0] == "P1"
+
+
+def test_float16_storage_finds_the_same_faces(tmp_path):
+    faces = np.stack([_face(i, dim=4096) for i in range(20)])
+    half, full = FaceIndex(dtype="float16"), FaceIndex(dtype="float32")
+    half.add([f"P{i}" for i in range(20)], faces)
+    full.add([f"P{i}" for i in range(20)], faces)
+    assert half.vectors.dtype == np.float16
+    for i in (0, 7, 19):
+        (match, distance), = half.search(faces[i])
+        assert match == f"P{i}" and distance == pytest.approx(full.search(faces[i])[0][1], abs=1e-3)
+    path = str(tmp_path / "index.npz")
+    full.save(path)
+    assert FaceIndex.load(path).vectors.dtype == face_index.storage_dtype
+
+
+def test_snapshots_are_saved_off_the_request_path(local_stand_ins, monkeypatch):
+    monkeypatch.setattr(face_index, "save_every", 1)
+    saves = []
+    monkeypatch.setattr(FaceIndex, "save", lambda index, path: saves.append(threading.current_thread().name))
+    face_index.get_face_index()
+    face_index.register_face("P0", _face(0))
+    for _ in range(100):
+        if saves:
+            break
+        time.sleep(0.05)
+    assert saves == ["face-index-saver"]
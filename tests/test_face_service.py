@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+
+from face_service import FaceService
+
+
+class _FakeDeepFace:
+    """
+    Stands in for DeepFace: the embedding is the mean colour of the image, read from the path like DeepFace does.
+    """
+
+    calls = 0
+
+    @classmethod
+    def represent(cls, img_path, **kwargs):
+        cls.calls += 1
+        image = cv2.imread(img_path) if isinstance(img_path, str) else img_path
+        return [{"embedding": image.reshape(-1, 3).mean(axis=0).tolist()}]
+
+
+def test_path_inputs_are_keyed_on_file_content(tmp_path):
+    service = FaceService()
+    service._deepface = _FakeDeepFace
+    path = str(tmp_path / "extracted_face.jpg")
+
+    cv2.imwrite(path, np.full((64, 64, 3), (200, 20, 20), np.uint8))
+    first = service.embed(path)
+    # The next person's face is written to the same file
+    cv2.imwrite(path, np.full((64, 64, 3), (20, 20, 200), np.uint8))
+    second = service.embed(path)
+
+    assert not np.allclose(first, second)
+    assert np.allclose(service.embed(path), second)
+    assert service.stats == {"embeddings": 2, "embedding_hits": 1, "verifications": 0}
@@ -0,0 +1,93 @@
+import pytest
+
+from id_extraction import (
+    extract_id_information,
+    extract_id_information_from_fields,
+    pan_is_valid,
+    verhoeff_is_valid,
+)
+
+
+@pytest.mark.parametrize("number", ["234123412346", "498765432102"])
+def test_verhoeff_accepts_valid_numbers(number):
+    assert verhoeff_is_valid(number)
+
+
+@pytest.mark.parametrize("number", ["234123412345", "234123412364", "498765432120"])
+def test_verhoeff_rejects_wrong_check_digit_and_swaps(number):
+    assert not verhoeff_is_valid(number)
+
+
+@pytest.mark.parametrize("pan,valid", [
+    ("ABCPE1234F", True),
+    ("ABCTE1234F", True),
+    ("ABCXE1234F", False),  # unknown holder type
+    ("ABCPE12345", False),
+    ("ABCP1E234F", False),
+    ("ABCPE1234", False),
+])
+def test_pan_structure(pan, valid):
+    assert pan_is_valid(pan) is valid
+
+
+@pytest.mark.parametrize("text", [
+    "Permanent Account Number ABCPE1234F|Name: RAHUL KUMAR|",
+    "INCOME TAX DEPARTMENT|ABCPE 1234 F|Name: RAHUL KUMAR",
+    "ABCPE-1234-F|Name RAHUL KUMAR",
+])
+def test_pan_found_next_to_its_label_or_split_in_words(text):
+    info = extract_id_information(text, "PAN")
+    assert info["ID"] == "ABCPE1234F" and info["Valid"]
+    assert info["Name"] == "RAHUL KUMAR"
+
+
+def test_pan_from_fields_with_label():
+    info = extract_id_information_from_fields(
+        {"ID": "Permanent Account Number ABCPE1234F", "Name": "Name: RAHUL KUMAR"}, "PAN")
+    assert info["ID"] == "ABCPE1234F" and info["Valid"]
+    assert info["Name"] == "RAHUL KUMAR"
+
+
+def test_pan_misread_characters_are_repaired():
+    info = extract_id_information("ABCPE12O4F", "PAN")
+    assert info["ID"] == "ABCPE1204F"
+    assert info["Confidence"]["ID"] < 1.0
+
+
+def test_first_repaired_pan_is_kept():
+    assert extract_id_information("ABCPE12O4F|XYZPQ98765", "PAN")["ID"] == "ABCPE1204F"
+
+
+@pytest.mark.parametrize("name", ["KAMALESH KUMAR", "VIMALESH SHARMA", "RICARDO DSOUZA"])
+def test_names_containing_label_words_are_kept(name):
+    info = extract_id_information(f"ABCPE1234F|Name: {name}", "PAN")
+    assert info["Valid"] and info["Name"] == name
+    assert extract_id_information_from_fields({"ID": "ABCPE1234F", "Name": name}, "PAN")["Name"] == name
+
+
+def test_words_joined_across_a_label_do_not_make_a_pan():
+    assert not extract_id_information("NUMBER ABCP|CARD", "PAN")["Valid"]
+
+
+def test_aadhaar_number_is_checked():
+    assert extract_id_information("Name: Priya Sharma|2341 2341 2346", "Aadhar")["ID"] == "234123412346"
+    assert not extract_id_information("2341 2341 2345", "Aadhar")["Valid"]
+    # Aadhaar numbers never start with 0 or 1
+    assert not extract_id_information("1341 2341 2346", "Aadhar")["Valid"]
+
+
+@pytest.mark.parametrize("text", ["VID: 9123 2341 2341 2346", "2341 2341 2346 9123", "2341234123469123"])
+def test_virtual_id_is_not_read_as_an_aadhaar_number(text):
+    assert not extract_id_information(text, "Aadhar")["Valid"]
+
+
+def test_driving_licence_number():
+    info = extract_id_information("DL No: MH12 2015 0012345|Name: AMIT SINGH", "Driving License")
+    assert info["ID"] == "MH1220150012345" and info["Name"] == "AMIT SINGH"
+    assert not extract_id_information("XX12 2015 0012345", "Driving License")["Valid"]
+    assert not extract_id_information("MH12 1900 0012345", "Driving License")["Valid"]
+
+
+def test_unsupported_card_type():
+    with pytest.raises(ValueError):
+        extract_id_information("", "Passport")
@@ -0,0 +1,103 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+import ingestion
+from ingestion import UploadRejected, decode_image, parse_header, validate_header
+
+
+def _jpeg(width=400, height=200):
+    img = np.zeros((height, width, 3), np.uint8)
+    img[:height // 4, :width // 4] = 255
+    img[-height // 4:, -width // 4:, 2] = 200
+    return img, cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 100])[1].tobytes()
+
+
+def _with_exif_orientation(jpeg, orientation):
+    ifd = struct.pack(">H", 1) + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0) + b"\x00\x00\x00\x00"
+    app1 = b"Exif\x00\x00" + b"MM\x00\x2a" + struct.pack(">I", 8) + ifd
+    return jpeg[:2] + b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + jpeg[2:]
+
+
+def test_parse_header_reads_jpeg_size_and_orientation():
+    _, jpeg = _jpeg()
+    header = parse_header(_with_exif_orientation(jpeg, 6))
+    assert header == {"format": "jpeg", "width": 400, "height": 200, "orientation": 6}
+
+
+def test_parse_header_reads_png_size():
+    png = cv2.imencode(".png", np.zeros((240, 320, 3), np.uint8))[1].tobytes()
+    assert parse_header(png) == {"format": "png", "width": 320, "height": 240, "orientation": 1}
+
+
+def test_parse_header_rejects_unknown_format():
+    with pytest.raises(UploadRejected):
+        parse_header(b"GIF89a" + b"\x00" * 32)
+
+
+def test_validate_header_rejects_small_images():
+    with pytest.raises(UploadRejected):
+        validate_header({"format": "jpeg", "width": 100, "height": 50, "orientation": 1})
+
+
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_reduced_decode_is_upright_like_full_decode(orientation):
+    _, jpeg = _jpeg()
+    data = _with_exif_orientation(jpeg, orientation)
+    # OpenCV's own full-scale decode applies the orientation; both of our paths must agree with it
+    reference = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    full = decode_image(data, decode_max_side=10000)
+    reduced = decode_image(data, decode_max_side=100)
+
+    assert full.shape == reference.shape
+    assert np.abs(full.astype(int) - reference).max() == 0
+    assert reduced.shape[:2] == (reference.shape[0] // 4, reference.shape[1] // 4)
+    shrunk = cv2.resize(reference, (reduced.shape[1], reduced.shape[0]), interpolation=cv2.INTER_AREA)
+    assert np.abs(shrunk.astype(int) - reduced).mean() < 5
+
+
+def test_read_upload_stops_at_limit():
+    with pytest.raises(UploadRejected):
+        ingestion.read_upload(b"x" * 1025, max_bytes=1024)
+
+
+def test_parse_header_reads_webp_size():
+    ok, webp = cv2.imencode(".webp", np.zeros((240, 320, 3), np.uint8))
+    if not ok:
+        pytest.skip("OpenCV built without WebP")
+    assert parse_header(webp.tobytes()) == {"format": "webp", "width": 320, "height": 240, "orientation": 1}
+
+
+@pytest.mark.parametrize("cut", [4, 20])
+def test_parse_header_rejects_truncated_jpeg(cut):
+    _, jpeg = _jpeg()
+    with pytest.raises(UploadRejected):
+        parse_header(jpeg[:cut])
+
+
+def test_parse_header_rejects_corrupt_jpeg_markers():
+    with pytest.raises(UploadRejected, match="corrupt"):
+        parse_header(b"\xff\xd8\x00\x00\x00\x00\x00\x00")
+
+
+def test_validate_header_rejects_too_many_pixels():
+    with pytest.raises(UploadRejected, match="megapixels"):
+        validate_header({"format": "png", "width": 10000, "height": 10000, "orientation": 1})
+
+
+@pytest.mark.parametrize("width, height, fmt, factor", [
+    (16000, 9000, "jpeg", 8), (4000, 3000, "jpeg", 2), (1999, 1500, "jpeg", 1), (16000, 9000, "png", 1),
+])
+def test_reduction_factor_keeps_the_longer_side_above_the_target(width, height, fmt, factor):
+    header = {"format": fmt, "width": width, "height": height, "orientation": 1}
+    assert ingestion.reduction_factor(header, decode_max_side=2000) == factor
+
+
+def test_memory_budget_is_shared_by_the_images_of_a_request():
+    budget = ingestion.MemoryBudget(max_bytes=1000)
+    budget.reserve(600, "ID card")
+    with pytest.raises(UploadRejected, match="selfie"):
+        budget.reserve(600, "selfie")
+    budget.reserve(400, "selfie")
@@ -0,0 +1,29 @@
+import layout_templates
+from id_extraction import extract_id_information_from_fields
+from layout_templates import LAYOUT_TEMPLATES, field_boxes, get_template
+
+
+def test_layout_ocr_is_off_until_boxes_are_measured():
+    assert get_template("PAN") is None
+
+
+def test_configured_boxes_override_the_built_in_ones(monkeypatch):
+    monkeypatch.setitem(layout_templates.layout_config, "enabled", True)
+    monkeypatch.setitem(layout_templates.layout_config, "templates", {"PAN": {"Name": {"box": [0.1, 0.2, 0.3, 0.4]}}})
+    template = get_template("PAN")
+    assert template["Name"]["box"] == (0.1, 0.2, 0.3, 0.4)
+    assert template["Name"]["allowlist"] == LAYOUT_TEMPLATES["PAN"]["Name"]["allowlist"]
+    assert template["ID"] == LAYOUT_TEMPLATES["PAN"]["ID"]
+    assert LAYOUT_TEMPLATES["PAN"]["Name"]["box"] == (0.34, 0.49, 0.99, 0.60)
+
+
+def test_field_boxes_are_in_pixels():
+    boxes = field_boxes({"ID": {"box": (0.1, 0.2, 0.5, 0.4)}}, (630, 1000, 3))
+    assert boxes == {"ID": (100, 500, 126, 252)}
+
+
+def test_misplaced_name_box_gives_no_name():
+    # A box that lands on a label or the card title instead of the name must not produce a name
+    for text in ("INCOME TAX DEPARTMENT", "12/05/1990", "", "Date of Birth"):
+        info = extract_id_information_from_fields({"ID": "ABCPE1234F", "Name": text}, "PAN")
+        assert info["Valid"] and info["Name"] == ""
@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+import pytest
+
+from preprocessor import canonical_size, normalise_id_card
+
+
+def _photo(card_width, margin=200):
+    # A light card with dark text lines on a dark background
+    card_height = int(round(card_width / 1.586))
+    photo = np.full((card_height + 2 * margin, card_width + 2 * margin, 3), 30, np.uint8)
+    photo[margin:margin + card_height, margin:margin + card_width] = 235
+    for row in range(1, 6):
+        y = margin + row * card_height // 7
+        cv2.rectangle(photo, (margin + card_width // 10, y), (margin + card_width * 7 // 10, y + card_height // 40),
+                      (20, 20, 20), -1)
+    return photo
+
+
+@pytest.mark.parametrize("card_width", [700, 3000])
+def test_card_is_warped_to_its_canonical_size(card_width):
+    card, geometry = normalise_id_card(_photo(card_width), "PAN")
+    width, height = canonical_size("PAN")
+    assert card.shape == (height, width, 3)
+    assert geometry["method"] != "frame"
+    assert geometry["skew"] == 0.0
+    # The background must not show at the edges, and the text lines must survive the downscale
+    assert card[height // 2, 5].mean() > 200 and card[height // 2, width - 5].mean() > 200
+    assert card[:, width // 2].min() < 60
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+import schema
+
+
+class _Cursor:
+    """
+    An sqlite3 cursor taking the `%s` placeholders the migrations are written with.
+    """
+
+    def __init__(self, connection):
+        self._cursor = connection.cursor()
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(sql.replace("%s", "?"), params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+@pytest.fixture
+def connection():
+    connection = sqlite3.connect(":memory:")
+    yield connection
+    connection.close()
+
+
+def _legacy_table(connection):
+    # The table as it was created by hand before migrations existed
+    connection.execute("CREATE TABLE user_info (id TEXT NOT NULL, name TEXT, id_type TEXT NOT NULL)")
+
+
+def test_new_database_is_migrated_to_the_latest_version(connection):
+    cursor = _Cursor(connection)
+    assert schema.current_version(cursor, "sqlite") == 0
+    assert schema.migrate(cursor, "sqlite") == [number for number, _, _ in schema.MIGRATIONS]
+    assert schema.current_version(cursor, "sqlite") == schema.LATEST_VERSION
+    assert schema.migrate(cursor, "sqlite") == []
+    assert {"user_info_type_id", "user_info_id"} <= schema._indexes(cursor, "sqlite", "user_info")
+
+
+def test_legacy_table_keeps_its_rows_and_gains_the_new_columns(connection):
+    _legacy_table(connection)
+    connection.execute("INSERT INTO user_info VALUES ('ABCPE1234F', 'Test', 'PAN')")
+    cursor = _Cursor(connection)
+    schema.migrate(cursor, "sqlite")
+    assert {"embedding", "created_at", "updated_at"} <= schema._columns(cursor, "sqlite", "user_info")
+    row = connection.execute("SELECT id, created_at FROM user_info").fetchone()
+    assert row[0] == "ABCPE1234F" and row[1] is not None
+    connection.execute("INSERT INTO user_info (id, name, id_type) VALUES ('ABCPE1234F', 'Test', 'Aadhaar')")
+    with pytest.raises(sqlite3.IntegrityError):
+        connection.execute("INSERT INTO user_info (id, name, id_type) VALUES ('ABCPE1234F', 'Test', 'PAN')")
+
+
+def test_duplicates_stop_the_unique_index_migration(connection):
+    _legacy_table(connection)
+    connection.executemany("INSERT INTO user_info VALUES (?, ?, ?)",
+                           [("ABCPE1234F", "Test", "PAN"), ("ABCPE1234F", "Test", "PAN")])
+    cursor = _Cursor(connection)
+    with pytest.raises(RuntimeError, match="more than once"):
+        schema.migrate(cursor, "sqlite")
+    assert schema.current_version(cursor, "sqlite") == 3
+
+
+def test_migrate_stops_at_the_target_version(connection):
+    cursor = _Cursor(connection)
+    assert schema.migrate(cursor, "sqlite", target=2) == [1, 2]
+    assert "created_at" not in schema._columns(cursor, "sqlite", "user_info")
@@ -0,0 +1,73 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import warm_up
+from server import EkycRequestHandler, WorkerPool, parse_multipart
+
+BOUNDARY = "ekyc-test-boundary"
+
+
+def _multipart(fields):
+    body = b""
+    for name, value in fields.items():
+        body += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"; filename=\"{name}\"\r\n"
+                 f"Content-Type: application/octet-stream\r\n\r\n").encode("latin-1") + value + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode("latin-1")
+
+
+@pytest.fixture
+def service():
+    # The pool is never started: every request below must be answered before reaching a worker
+    handler = type("Handler", (EkycRequestHandler,), {"pool": WorkerPool(workers=1, queue_size=1)})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(url, fields):
+    request = urllib.request.Request(url + "/v1/verify", data=_multipart(fields), method="POST",
+                                     headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_parse_multipart_keeps_binary_payloads():
+    payload = bytes(range(256))
+    parts = parse_multipart(f"multipart/form-data; boundary={BOUNDARY}",
+                            _multipart({"id_image": payload, "id_type": b"PAN"}))
+    assert parts == {"id_image": payload, "id_type": b"PAN"}
+
+
+def test_parse_multipart_rejects_other_bodies():
+    with pytest.raises(ValueError):
+        parse_multipart("application/json", b"{}")
+
+
+def test_unknown_id_type_is_a_client_error(service):
+    status, body = _post(service, {"id_image": b"x", "face_image": b"y", "id_type": b"Passport"})
+    assert status == 400
+    assert "Passport" in body["error"] and "PAN" in body["error"]
+
+
+def test_missing_fields_are_a_client_error(service):
+    status, body = _post(service, {"id_image": b"x", "id_type": b"PAN"})
+    assert status == 400
+    assert "face_image" in body["error"]
+
+
+def test_lazy_loading_counts_cold_models_as_ready(monkeypatch):
+    monkeypatch.setattr(warm_up, "_lazy", False)
+    assert not warm_up.readiness()["ready"]
+    warm_up.allow_lazy_loading()
+    assert warm_up.readiness()["ready"]